@@ -87,3 +87,4 @@ def get_config(config_file_or_yaml=None, config_from_args=None):
 # OTHER PARAMETERS
 VERTEX_SIZE = 2 # this has to be adapted in the future to be dependent on the image size
 SCALING_INITIAL = 5 # this has to be adapted in the future to be dependent on the image size
+TRACE_TOLERANCE = 1.0 # minimum distance in image pixels between two points of a trace and maximum deviation of its simplification
@@ -1,17 +1,21 @@
 import sys
 
-from PyQt5.QtCore import pyqtSignal, QPointF, QRectF, Qt, QSize
-from PyQt5.QtWidgets import QMainWindow, QFileDialog, QListWidgetItem, QMessageBox, QMenu
-from PyQt5.QtGui import QPixmap, QIcon
+from PyQt5.QtCore import pyqtSignal, QPointF, QRectF, Qt, QSize, QModelIndex, QCoreApplication, QEvent
+from PyQt5.QtWidgets import QMainWindow, QFileDialog, QMessageBox, QMenu, QTableWidgetItem
+from PyQt5.QtGui import QPixmap
 
 from typing import Tuple, List, Union
 from numpy import argmax
 
-from seg_utils.utils.database import SQLiteDatabase
+from seg_utils.utils.database import SQLiteDatabase, label_class_dict
+from seg_utils.utils.image_cache import ImageCache
+from seg_utils.utils.label_writer import LabelWriter
+from seg_utils.utils.autosave_journal import AutosaveJournal, JOURNAL_SUFFIX
 from seg_utils.utils import qt
 from seg_utils.ui.toolbar import Toolbar
 from seg_utils.src.actions import Action
 from seg_utils.ui.label_ui import LabelUI
+from seg_utils.ui.file_list_model import FileListModel, FileFilterProxyModel
 from seg_utils.ui.shape import Shape
 from seg_utils.ui.dialogs import NewShapeDialog, ForgotToSaveMessageBox, DeleteShapeMessageBox
 from seg_utils.config import VERTEX_SIZE
@@ -33,10 +37,16 @@ class LabelMain(QMainWindow, LabelUI):
         # placeholder variables that can be used later
         self.database = None
         self.basedir = None
-        self.labeled_images = []
+        self.imageCache = None
+        self.labelWriter = None
+        self.journal = None  # AutosaveJournal of the unsaved edits if b_autoSave is set
+        self._journalSaves = {}  # image_path: sequence number of the last journaled edit of a queued save
+        self.labeled_images = []  # FileListModel, which is indexed like the list of image paths
+        self.fileFilter = FileFilterProxyModel(self)
         self.current_labels = []
+        self._labelsRevision = 0  # incremented on every change of the current labels
+        self._savedRevision = 0  # revision of the current labels which is stored in the database
         self.classes = {}
-        self.isLabeled = None
         self.img_idx = 0
         self.b_autoSave = True
         self.actions = tuple()
@@ -134,7 +144,7 @@ class LabelMain(QMainWindow, LabelUI):
         self.initContextMenu((actionEditLabel, actionDeleteLabel))
 
     def connectEvents(self):
-        self.fileList.itemClicked.connect(self.handleFileListItemClicked)
+        self.fileList.clicked.connect(self.handleFileListItemClicked)
         self.fileSearch.textChanged.connect(self.handleFileListSearch)
         self.polyList.itemClicked.connect(self.handlePolyListSelection)
         self.imageDisplay.canvas.sRequestLabelListUpdate.connect(self.handleUpdatePolyList)
@@ -162,14 +172,33 @@ class LabelMain(QMainWindow, LabelUI):
         """This function is called if a correct database is selected"""
         self.basedir = pathlib.Path(database).parents[0]
         self.database = SQLiteDatabase(database)
-        self.labeled_images, self.isLabeled = self.database.get_labeled_images()
+        self.labeled_images = FileListModel(self.database, prefix=IMAGES_DIR, parent=self)
+        self.imageCache = ImageCache(database, self.basedir, parent=self)
+        self.imageCache.start()
+        self.labelWriter = LabelWriter(database, parent=self)
+        self.labelWriter.sSaved.connect(self.on_labelsSaved)
+        self.labelWriter.sFailed.connect(self.on_saveFailed)
+        self.labelWriter.start()
+        if self.b_autoSave:
+            self.initJournal(database)
         self.imageDisplay.setInitialized()
         self.initColors()
         self.initClasses()
         self.initFileList()
+        self.initStats()
         self.initImage()
         self.enableButtons()
 
+    def initJournal(self, database: str):
+        r"""Replays the edits which have not been saved before the last session ended, e.g. by a crash, into the
+        database and starts journaling the edits of this session"""
+        self.journal = AutosaveJournal(database + JOURNAL_SUFFIX, parent=self)
+        recovered, failed = self.journal.recover(self.database)
+        if recovered or failed:
+            self.statusbar.showMessage(f"Recovered unsaved labels of {len(recovered)} images"
+                                       + (f", {len(failed)} could not be written" if failed else ""))
+        self.journal.start()
+
     def initClasses(self):
         """This function initializes the available classes in the database and updates the label list"""
         classes = self.database.get_label_classes()
@@ -178,65 +207,90 @@ class LabelMain(QMainWindow, LabelUI):
             self.labelList.addItem(item)
             self.classes[_class] = idx
 
+    def initStats(self):
+        r"""Fills the panel with the class distribution of the whole dataset, which is read from the statistics
+        tables instead of decoding the labels. The panel is hidden if the database has no statistics tables"""
+        self.statsFrame.setVisible(self.database.has_stats_tables)
+        if not self.database.has_stats_tables:
+            return
+        stats = self.database.get_class_stats()
+        self.statsTable.setRowCount(len(stats))
+        for row, (label, images, instances, area) in enumerate(stats):
+            for column, value in enumerate([label, str(images), str(instances), f"{area / instances:.1f}"]):
+                item = QTableWidgetItem(value)
+                if column > 0:
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.statsTable.setItem(row, column, item)
+
     def initColors(self):
         r"""Initialise the colors for plotting and for the individual lists """
         self.colorMap, drawNewColor = qt.colormapRGB(n=self._num_colors)  # have a buffer for new classes
         self.imageDisplay.canvas.setNewColor(drawNewColor)
 
-    def initFileList(self, show_check_box=False):
-        r"""Initialize the file list with all the entries found in the database"""
-        for idx, elem in enumerate(self.labeled_images):
-            if show_check_box:
-                # TODO: relative path doesnt work
-                item = QListWidgetItem(QIcon("./icons/checked.png"),
-                                       self.labeled_images[idx].replace(IMAGES_DIR, ""))
-            else:
-                item = QListWidgetItem(self.labeled_images[idx].replace(IMAGES_DIR, ""))
-            self.fileList.addItem(item)
-        self.fileList.setCurrentRow(self.img_idx)
-
-    def initLabels(self):
+    def initFileList(self):
+        r"""Initialize the file list with all the entries found in the database. The entries are only read from the
+        database once they are displayed"""
+        self.fileFilter.setSourceModel(self.labeled_images)
+        self.fileList.setModel(self.fileFilter)
+        if self.database.has_search_index:
+            self.fileSearch.setPlaceholderText("Search Filename, Class or Note")
+        self.setCurrentFile()
+
+    def setCurrentFile(self):
+        r"""Selects the displayed image in the file list if it is not hidden by the search"""
+        index = self.fileFilter.mapFromSource(self.labeled_images.index(self.img_idx))
+        if index.isValid():
+            self.fileList.setCurrentIndex(index)
+            self.fileList.scrollTo(index)
+        else:
+            self.fileList.clearSelection()
+
+    def initLabels(self, labels: list = None):
         r"""This function initializes the labels for the current image. Necessary to have only one call to the database
-        if the image is changed"""
-        labels = self.database.get_label_from_imagepath(self.labeled_images[self.img_idx])
+        if the image is changed. Labels which have been prefetched are not read from the database again"""
+        pending = self.labelWriter.pending(self.labeled_images[self.img_idx])
+        if pending is not None:
+            # the last save of this image is not written yet, so the database is not up to date
+            labels = pending['label_list']
+        elif labels is None:
+            labels = self.database.get_label_from_imagepath(self.labeled_images[self.img_idx])
+            self.imageCache.setLabels(self.labeled_images[self.img_idx], labels)
         self.current_labels = [Shape(image_size=self.image_size, label_dict=_label,
                                      color=self.getColorForLabel(_label['label']))
                                for _label in labels]
+        self._savedRevision = self._labelsRevision
         self.polyList.updateList(self.current_labels)
 
     def initImage(self):
-        """Initializes the displayed image and respective label/canvas"""
-        image = QPixmap(str(self.basedir / self.labeled_images[self.img_idx]))
+        """Initializes the displayed image and respective label/canvas. The image is usually decoded in advance by
+        the image cache, so only the conversion into a pixmap is left"""
+        decoded, labels = self.imageCache.get(self.labeled_images[self.img_idx])
+        image = QPixmap.fromImage(decoded)
         self.image_size = image.size()
-        self.initLabels()
+        self.initLabels(labels)
         self.imageDisplay.canvas.setPixmap(image)
         self.imageDisplay.canvas.setLabels(self.current_labels)
-        self.fileList.setCurrentRow(self.img_idx)
+        self.setCurrentFile()
         self.on_zoomLevelChanged(1)
+        self.imageCache.prefetch(self.labeled_images, self.img_idx)
 
     def initContextMenu(self, actions: Tuple[Action]):
         for action in actions:
             self.contextMenu.addAction(action)
             self.polyList.contextMenu.addAction(action)
 
-    def handleFileListItemClicked(self):
+    def handleFileListItemClicked(self, index: QModelIndex):
         """Tracks the changed item in the label List"""
-        dlgResult = self.checkForChanges()
-        if dlgResult == QMessageBox.AcceptRole or dlgResult == QMessageBox.DestructiveRole:
-            if dlgResult == QMessageBox.AcceptRole:
-                self.on_saveLabel()
-            selected_file = self.fileList.currentItem().text()
-            self.img_idx = self.labeled_images.index(IMAGES_DIR + selected_file)
+        if self.resolveChanges():
+            self.img_idx = self.fileFilter.mapToSource(index).row()
             self.initImage()
+        else:
+            self.setCurrentFile()
 
     def handleFileListSearch(self):
         r"""Handles the file search. If the user types into the text box, it changes the files which are displayed"""
-        text = self.fileSearch.toPlainText()
-        for item_idx in range(self.fileList.count()):
-            if text not in self.fileList.item(item_idx).text():
-                self.fileList.item(item_idx).setHidden(True)
-            else:
-                self.fileList.item(item_idx).setHidden(False)
+        self.fileFilter.setFilterText(self.fileSearch.toPlainText())
+        self.setCurrentFile()
 
     def handleUpdatePolyList(self, _item_idx):
         for _idx in range(self.polyList.count()):
@@ -259,15 +313,40 @@ class LabelMain(QMainWindow, LabelUI):
             # Add multiple shapes
             for _shape in shapes:
                 self.current_labels.append(_shape)
+            self.markLabelsChanged()
         elif isinstance(shapes, tuple):
             # replace a shape with a new shape
             self.current_labels[shapes[0]] = shapes[1]
+            self.markLabelsChanged(shapes[0])
         elif isinstance(shapes, Shape):
             # add one shape
             self.current_labels.append(shapes)
+            self.markLabelsChanged(len(self.current_labels) - 1)
         self.imageDisplay.canvas.setLabels(self.current_labels)
         self.polyList.updateList(self.current_labels)
 
+    def markLabelsChanged(self, shape_idx: int = None):
+        r"""Has to be called on every change of the current labels, as the check for unsaved changes only compares
+        the revision of the labels with the one that has been saved. The change is recorded in the autosave journal
+
+            :param int shape_idx: index of the only changed or added shape, None if several shapes changed or
+                shapes have been removed
+        """
+        self._labelsRevision += 1
+        if self.journal is not None:
+            image_path = self.labeled_images[self.img_idx]
+            if shape_idx is None or \
+                    not self.journal.set_shape(image_path, shape_idx, self.current_labels[shape_idx].to_dict()[0]):
+                self.journal.set_labels(image_path, [_lbl.to_dict()[0] for _lbl in self.current_labels])
+
+    def hasUnsavedChanges(self) -> bool:
+        return self._labelsRevision != self._savedRevision
+
+    def discardChanges(self):
+        r"""Drops the unsaved changes of the current labels from the autosave journal, if the user dismissed them"""
+        if self.journal is not None:
+            self.journal.discard(self.labeled_images[self.img_idx])
+
     def enableButtons(self):
         """This function enables/disabled all the buttons as soon as there is a valid database selected.
             :param bool value: True enables Buttons, False disables them
@@ -295,10 +374,16 @@ class LabelMain(QMainWindow, LabelUI):
                 self.toolBar.widgetForAction(act).setChecked(Qt.Unchecked)
 
     def closeEvent(self, event) -> None:
-        dlgResult = self.checkForChanges()
-        if dlgResult == QMessageBox.AcceptRole or dlgResult == QMessageBox.DestructiveRole:
-            if dlgResult == QMessageBox.AcceptRole:
-                self.on_saveLabel()
+        self.resolveChanges()
+        if self.labelWriter is not None:
+            # writes all queued saves before the application quits
+            self.labelWriter.stop()
+        if self.journal is not None:
+            # delivers the signals of the saves written above, so their edits are removed from the journal
+            QCoreApplication.sendPostedEvents(None, QEvent.MetaCall)
+            self.journal.stop()
+        if self.imageCache is not None:
+            self.imageCache.stop()
 
     def on_openDatabase(self, fddirectory, fdoptions):
         """This function is the handle for opening a database"""
@@ -314,36 +399,47 @@ class LabelMain(QMainWindow, LabelUI):
             sys.exit(1)
 
     def on_saveLabel(self):
-        """Save current state to database"""
-        label_list = []
-        classes_set = set()
-        for _lbl in self.current_labels:
-            label_dict, class_name = _lbl.to_dict()
-            label_list.append(label_dict)
-            classes_set.add(class_name)
-        classes_dict = {_key: 0 for _key in self.classes.keys()}  # initialize the final dict
-        for _class in classes_set:
-            if _class in classes_dict.keys():
-                classes_dict[_class] = 1
-        classes_dict['label_list'] = label_list
-        self.database.update_label(image_name=self.labeled_images[self.img_idx], label_class_dict=classes_dict)
+        """Save current state to database. The save is only queued, it is written by the background writer"""
+        label_list = [_lbl.to_dict()[0] for _lbl in self.current_labels]
+        image_path = self.labeled_images[self.img_idx]
+        self.labelWriter.save(image_path, label_class_dict(label_list, list(self.classes.keys())))
+        if self.journal is not None:
+            self._journalSaves[image_path] = self.journal.last_seq(image_path)
+        self._savedRevision = self._labelsRevision
+        self.imageCache.setLabels(self.labeled_images[self.img_idx], label_list)
+
+    def on_labelsSaved(self, image_paths: List[str]):
+        r"""Handles the labels committed by the background writer. Their edits are removed from the journal unless
+        a later save of the same image is still queued, and labels which are prefetched at the same time are
+        dropped"""
+        if self.journal is not None:
+            for _path in image_paths:
+                if _path in self._journalSaves and self.labelWriter.pending(_path) is None:
+                    self.journal.mark_saved(_path, self._journalSaves.pop(_path))
+        for _path in image_paths:
+            # labels prefetched before the commit are outdated
+            self.imageCache.invalidateLabels(_path)
+        self.initStats()
+
+    def on_saveFailed(self, image_path: str, error: str):
+        r"""Handles a save which could not be written. The labels of the current image are marked as unsaved again,
+        the cache is reset such that the labels are read from the database once the image is displayed again"""
+        self.statusbar.showMessage(f"Saving {image_path} failed: {error}")
+        self._journalSaves.pop(image_path, None)
+        self.imageCache.setLabels(image_path, None)
+        if image_path == self.labeled_images[self.img_idx]:
+            self._savedRevision = -1
 
     def on_nextImage(self):
         """Display the next image"""
-        dlgResult = self.checkForChanges()
-        if dlgResult == QMessageBox.AcceptRole or dlgResult == QMessageBox.DestructiveRole:
-            if dlgResult == QMessageBox.AcceptRole:
-                self.on_saveLabel()
+        if self.resolveChanges():
             self.img_idx = (self.img_idx + 1) % len(self.labeled_images)
             self.initImage()
             self.setButtonsUnchecked()
 
     def on_prevImag(self):
         """Display the previous image"""
-        dlgResult = self.checkForChanges()
-        if dlgResult == QMessageBox.AcceptRole or dlgResult == QMessageBox.DestructiveRole:
-            if dlgResult == QMessageBox.AcceptRole:
-                self.on_saveLabel()
+        if self.resolveChanges():
             self.img_idx = (self.img_idx - 1) % len(self.labeled_images)
             self.initImage()
             self.setButtonsUnchecked()
@@ -408,17 +504,20 @@ class LabelMain(QMainWindow, LabelUI):
         if dialog.answer == 1:
             # Delete the shape
             self.current_labels.pop(self._selectedShape)
+            self.markLabelsChanged()
             self.updateLabels()
 
     def on_moveVertex(self, vShape: int, vNum: int, newPos: QPointF):
         if vShape != -1:
             if self.current_labels[vShape].vertices.selectedVertex != -1:
-                self.current_labels[vShape].moveVertex(vNum, newPos)
-                self.imageDisplay.canvas.setLabels(self.current_labels)
+                if self.current_labels[vShape].moveVertex(vNum, newPos):
+                    self.markLabelsChanged(vShape)
+                    self.imageDisplay.canvas.setLabels(self.current_labels)
 
     def on_moveShape(self, hShape: int, displacement: QPointF):
-        self.current_labels[hShape].moveShape(displacement)
-        self.imageDisplay.canvas.setLabels(self.current_labels)
+        if self.current_labels[hShape].moveShape(displacement):
+            self.markLabelsChanged(hShape)
+            self.imageDisplay.canvas.setLabels(self.current_labels)
 
     def on_anchorRest(self, vShape: int):
         """Handles the reset of the anchor upon the mouse release within the respective label/shape"""
@@ -429,16 +528,30 @@ class LabelMain(QMainWindow, LabelUI):
             size = [self.imageDisplay.canvas.pixmap.width(), self.imageDisplay.canvas.pixmap.height()]
             shape.setScaling(zoom, size[argmax(size)])
 
+    def resolveChanges(self) -> bool:
+        r"""Asks the user to save or dismiss the unsaved changes of the current labels, if there are any. Without
+        changes, nothing is saved
+
+            :returns: False if the user cancelled, True otherwise
+        """
+        if not self.hasUnsavedChanges():
+            return True
+        dlgResult = self.checkForChanges()
+        if dlgResult == QMessageBox.AcceptRole:
+            self.on_saveLabel()
+        elif dlgResult == QMessageBox.DestructiveRole:
+            self.discardChanges()
+        else:
+            return False
+        return True
+
     def checkForChanges(self) -> int:
-        r"""Check for changes with the database
+        r"""Check for unsaved changes of the current labels. Only compares the revision counters, so neither the
+        database is queried nor any shape is created
 
             :returns: 0 if accepted or no changes, 1 if cancelled and 2 if dimissed
         """
-        sql_labels = self.database.get_label_from_imagepath(self.labeled_images[self.img_idx])
-        sql_labels = [Shape(image_size=self.image_size, label_dict=_label, color=self.getColorForLabel(_label['label']))
-                      for _label in sql_labels]
-
-        if sql_labels == self.current_labels:
+        if not self.hasUnsavedChanges():
             return 0
         else:
             d = ForgotToSaveMessageBox(self)
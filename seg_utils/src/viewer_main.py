@@ -1,16 +1,20 @@
 from PyQt5.QtCore import QDir, QUrl, Qt
 from PyQt5.QtMultimedia import QMediaContent, QMediaPlayer
-from PyQt5.QtWidgets import QMainWindow, QFileDialog, QStyle, QGraphicsView, QGraphicsScene
+from PyQt5.QtWidgets import QMainWindow, QFileDialog, QStyle, QGraphicsView, QGraphicsScene, QListWidgetItem
 from PyQt5.QtGui import QPixmap, QKeySequence
 
 from seg_utils.utils.database import SQLiteDatabase
+from seg_utils.utils.probe import get_video_meta
 from seg_utils.ui.viewer_ui import ViewerUI
 from seg_utils.utils.qt import getIcon
 
 import pathlib
+import subprocess
 
 FD_DIR = '/home/nico/isys/data'  # QDir.homePath()
 FD_Options = QFileDialog.DontUseNativeDialog
+DEFAULT_FPS = 25.0  # used if a video can not be probed
+SEARCH_LIMIT = 100  # maximum number of displayed search results
 
 
 class ViewerMain(QMainWindow, ViewerUI):
@@ -21,6 +25,7 @@ class ViewerMain(QMainWindow, ViewerUI):
         self.database = None
         self.basedir = None
         self.labeled_images = None
+        self._imageRows = {}  # image path: index within labeled_images
         self.label_classes = None
         self.labelFrame = None
         self.image_idx = 0
@@ -28,7 +33,7 @@ class ViewerMain(QMainWindow, ViewerUI):
         self._begin = None
         self._end = None
         self._videoDuration = None
-        self.fps = 25.0
+        self.fps = DEFAULT_FPS  # replaced by the probed fps of the current video
         self.frameDurationMS = (1.0/self.fps)*1000.0  # duration of one frame in ms
         #self._scene = QGraphicsScene()
 
@@ -44,6 +49,8 @@ class ViewerMain(QMainWindow, ViewerUI):
         self.nextFrameButton.clicked.connect(self.nextFrame)
         self.prevFrameButton.clicked.connect(self.prevFrame)
         self.displayLabelButton.clicked.connect(self.displayLabel)
+        self.searchEdit.textChanged.connect(self.search)
+        self.searchResults.itemClicked.connect(self.showSearchResult)
 
     def openDatabase(self):
         database, _ = QFileDialog.getOpenFileName(self,
@@ -54,6 +61,7 @@ class ViewerMain(QMainWindow, ViewerUI):
         self.basedir = pathlib.Path(database).parents[0]
         self.database = SQLiteDatabase(database)
         self.labeled_images = self.database.get_entries_of_column('labels', 'image_path')
+        self._imageRows = {_path: _idx for _idx, _path in enumerate(self.labeled_images)}
         self.updateImages()
         self.initButtons()
         self.initVideo()
@@ -62,25 +70,36 @@ class ViewerMain(QMainWindow, ViewerUI):
         self.statusbar.showMessage("Click in Image and press left CTRL to zoom in respective image")
 
     def nextImage(self):
-        self.getNotesFromUI()
-        if self.stackedWidget.currentWidget() == self.videoWidget:
-            self.stackedWidget.setCurrentWidget(self.labelImage)
-        self.image_idx = (self.image_idx + 1) % len(self.labeled_images)
-        self.setNotesOfUI()
-        self.mediaPlayer.stop()
-        self.setSkipButtons(False)
-        self.updateImages()
+        self.showImage((self.image_idx + 1) % len(self.labeled_images))
 
     def prevImage(self):
+        self.showImage((self.image_idx + -1) % len(self.labeled_images))
+
+    def showImage(self, image_idx: int):
+        """Stores the notes of the current image and displays the image at image_idx"""
         self.getNotesFromUI()
         if self.stackedWidget.currentWidget() == self.videoWidget:
             self.stackedWidget.setCurrentWidget(self.labelImage)
-        self.image_idx = (self.image_idx + -1) % len(self.labeled_images)
+        self.image_idx = image_idx
         self.setNotesOfUI()
         self.mediaPlayer.stop()
         self.setSkipButtons(False)
         self.updateImages()
 
+    def search(self, text: str):
+        """Lists the images whose file name, classes or notes match the text, ranked by relevance"""
+        self.searchResults.clear()
+        for _, image_path in self.database.search_labels(text, limit=SEARCH_LIMIT):
+            item = QListWidgetItem(image_path)
+            item.setData(Qt.UserRole, image_path)
+            self.searchResults.addItem(item)
+        self.searchResults.setVisible(self.searchResults.count() > 0)
+
+    def showSearchResult(self, item: QListWidgetItem):
+        image_idx = self._imageRows.get(item.data(Qt.UserRole))
+        if image_idx is not None:
+            self.showImage(image_idx)
+
     def nextFrame(self):
         self.setPosition(self.mediaPlayer.position() + self.frameDurationMS)
 
@@ -144,8 +163,17 @@ class ViewerMain(QMainWindow, ViewerUI):
         self.mediaPlayer.setPosition(position)
 
     def setStartingPosition(self):
-        self._begin = max(0.0, self.frame_to_ms(self.labelFrame) - self.videoRangeMS / 2.0)
-        self._end = min(self._videoDuration, self.frame_to_ms(self.labelFrame) + self.videoRangeMS / 2.0)
+        self._begin = max(0.0, self.frame_to_ms(self.labelFrame, self.fps) - self.videoRangeMS / 2.0)
+        self._end = min(self._videoDuration, self.frame_to_ms(self.labelFrame, self.fps) + self.videoRangeMS / 2.0)
+
+    def setFps(self, video: str):
+        """Sets the fps of the current video from the video_meta cache, which only probes the video once"""
+        try:
+            self.fps = get_video_meta(self.database, str(self.basedir), video).fps
+        except (subprocess.CalledProcessError, OSError, ValueError, KeyError) as err:
+            print(err)
+            self.fps = DEFAULT_FPS
+        self.frameDurationMS = (1.0/self.fps)*1000.0
 
     def setVideo(self):
         # TODO: move to init?
@@ -153,6 +181,7 @@ class ViewerMain(QMainWindow, ViewerUI):
         video, self.labelFrame, self._videoDuration = self.database.get_video_from_image(self.labeled_images[self.image_idx])
         self.mediaPlayer.setMedia(
             QMediaContent(QUrl.fromLocalFile(str(self.basedir / video))))
+        self.setFps(video)
         self.setStartingPosition()
         self.setPosition(self._begin)
         self.playButton.setEnabled(True)
@@ -180,6 +209,7 @@ class ViewerMain(QMainWindow, ViewerUI):
         self.nextImageButton.setEnabled(True)
         self.prevImageButton.setEnabled(True)
         self.playButton.setEnabled(True)
+        self.searchEdit.setEnabled(True)
 
     def displayLabel(self):
         if self.mediaPlayer.state() == QMediaPlayer.PlayingState:
@@ -212,6 +242,6 @@ class ViewerMain(QMainWindow, ViewerUI):
         pass
 
     @staticmethod
-    def frame_to_ms(frame_number: int, fps: int = 25):
+    def frame_to_ms(frame_number: int, fps: float = DEFAULT_FPS):
         return (frame_number/fps) * 1000.0
 
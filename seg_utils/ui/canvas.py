@@ -1,9 +1,10 @@
-from PyQt5.QtCore import QRectF, pyqtSignal, pyqtSlot, QPointF
-from PyQt5.QtGui import QPixmap, QPainter, QColor
+from PyQt5.QtCore import QRectF, pyqtSignal, pyqtSlot, QPointF, QRect, Qt
+from PyQt5.QtGui import QPixmap, QPainter, QColor, QImage
 from PyQt5.QtWidgets import QWidget
 
 from seg_utils.config import VERTEX_SIZE
 from seg_utils.ui.shape import Shape
+from seg_utils.utils.spatial_index import SpatialIndex
 
 from typing import List
 from random import randint
@@ -12,6 +13,10 @@ from random import randint
 class Canvas(QWidget):
     r"""Base drawing widget as it should be instantiated and then connected to a scene
      https://forum.qt.io/topic/93327/how-can-i-use-qpainter-to-paint-on-qgraphicsview/3
+
+     Rendering is incremental: all shapes which are neither highlighted nor selected are drawn once into a cached
+     overlay image. Highlighted, selected and temporary shapes are drawn on top of it in every paint event. Every
+     change only repaints the bounding rectangles of the shapes which have changed since the last render
      """
     sRequestFitInView = pyqtSignal(QRectF)
     sRequestLabelListUpdate = pyqtSignal(int)
@@ -24,21 +29,30 @@ class Canvas(QWidget):
         self.drawNewColor = None
         self.labels = [Shape]
         self.temp_label = None
+        self.spatialIndex = SpatialIndex()  # hit-testing of the labels, only re-indexes altered labels
         self.pixmap = QPixmap()
         self.mode = self.EDIT
         self._painter = QPainter()
+        self._overlay = QImage()  # cached layer of all static shapes
+        self._rendered = []  # per label: (shape, render state, bounding rect, active) as of the last render
+        self._tempRect = QRect()
 
     def setPixmap(self, pixmap: QPixmap):
         r"""Sets the pixmap and resizes the Widget to the size of the pixmaps as this is just connected
         to the Scene and the image_viewer will display the scene respectively a view into the scene"""
         self.pixmap = pixmap
+        self._overlay = QImage(self.pixmap.size(), QImage.Format_ARGB32_Premultiplied)
+        self._overlay.fill(Qt.transparent)
+        self._rendered = []
         self.resize(self.pixmap.size())
+        self.update()
         self.sRequestFitInView.emit(QRectF(self.pixmap.rect()))
 
     def setLabels(self, labels: List[Shape]):
         """Set the labels which are drawn on the canvas"""
         self.labels = labels
-        self.update()
+        self.spatialIndex.sync(self.labels)
+        self.refresh()
 
     def setNewColor(self, color: QColor):
         """Sets the color for drawing a new item"""
@@ -53,7 +67,9 @@ class Canvas(QWidget):
         else:
             self.temp_label = None
 
-        self.update()
+        tempRect = self.shapeRect(self.temp_label) if self.temp_label else QRect()
+        self.update(self._tempRect.united(tempRect))
+        self._tempRect = tempRect
 
     def handleShapeHovered(self,  shape_idx: int, closest_vertex_shape: int, vertex_idx: int):
         """Handles both shape and vertex highlighting in one call as I then only have to update it once"""
@@ -61,7 +77,7 @@ class Canvas(QWidget):
         if shape_idx > -1:
             self.labels[shape_idx].isHighlighted = True
         self.handleVertexHighlighted(closest_vertex_shape, vertex_idx)
-        self.update()
+        self.refresh()
 
     def handleShapeSelected(self, shape_idx: int, closest_vertex_shape: int, vertex_idx: int):
         self.on_ResetSelected()
@@ -69,7 +85,7 @@ class Canvas(QWidget):
             self.labels[shape_idx].isSelected = True
             self.sRequestLabelListUpdate.emit(shape_idx)
         self.handleVertexSelected(closest_vertex_shape, vertex_idx)
-        self.update()
+        self.refresh()
 
     def handleVertexHighlighted(self, shape_idx: int, vertex_idx: int):
         if shape_idx != -1:
@@ -88,6 +104,69 @@ class Canvas(QWidget):
     def on_ResetSelAndHigh(self):
         self.labels = list(map(self.resetHighlight, self.labels))
         self.labels = list(map(self.resetSelection, self.labels))
+        self.refresh()
+
+    def refresh(self):
+        r"""Compares every label with its state of the last render. Static labels which have changed are redrawn
+        into the overlay and only the bounding rectangles of the changed labels are scheduled for repainting"""
+        rendered = []
+        dirty = []
+        staticDirty = QRect()
+        for _idx in range(max(len(self.labels), len(self._rendered))):
+            old = self._rendered[_idx] if _idx < len(self._rendered) else None
+            new = None
+            if _idx < len(self.labels):
+                label = self.labels[_idx]
+                state = self.renderState(label)
+                if old is not None and old[0] is label and old[1] == state:
+                    rendered.append(old)
+                    continue
+                new = (label, state, self.shapeRect(label), self.isActive(label))
+                rendered.append(new)
+            for _entry in (old, new):
+                if _entry is not None:
+                    dirty.append(_entry[2])
+                    if not _entry[3]:
+                        staticDirty = staticDirty.united(_entry[2])
+        self._rendered = rendered
+        if not staticDirty.isEmpty():
+            self.paintOverlay(staticDirty)
+        for _rect in dirty:
+            self.update(_rect)
+
+    def paintOverlay(self, rect: QRect):
+        r"""Redraws all static labels intersecting the rectangle into the overlay"""
+        if self._overlay.isNull():
+            return
+        painter = QPainter(self._overlay)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setClipRect(rect)
+        painter.setCompositionMode(QPainter.CompositionMode_Clear)
+        painter.fillRect(rect, Qt.transparent)
+        painter.setCompositionMode(QPainter.CompositionMode_SourceOver)
+        for _label, _, _rect, _active in self._rendered:
+            if not _active and _rect.intersects(rect):
+                _label.paint(painter)
+        painter.end()
+
+    @staticmethod
+    def renderState(label: Shape) -> tuple:
+        r"""Everything the appearance of a label depends on"""
+        vertices = label.vertices
+        return (vertices.revision, label.isHighlighted, label.isSelected, vertices.highlightedVertex,
+                vertices.selectedVertex, vertices._scaling, label.line_color.rgba(), label.shape_type)
+
+    @staticmethod
+    def isActive(label: Shape) -> bool:
+        r"""Active labels are drawn in every paint event instead of the overlay"""
+        return label.isHighlighted or label.isSelected or \
+            label.vertices.highlightedVertex != -1 or label.vertices.selectedVertex != -1
+
+    @staticmethod
+    def shapeRect(label: Shape) -> QRect:
+        r"""Rectangle covering everything painted for a label including the vertices and the pen"""
+        margin = label.vertices.vertexSize() + 2
+        return label.boundingRect().adjusted(-margin, -margin, margin, margin).toAlignedRect()
 
     @staticmethod
     def resetHighlight(label: Shape):
@@ -106,16 +185,20 @@ class Canvas(QWidget):
         if not self.pixmap:
             return super(Canvas, self).paintEvent(event)
 
+        rect = event.rect()
         self._painter.begin(self)
         self._painter.setRenderHint(QPainter.Antialiasing)
-        self._painter.setRenderHint(QPainter.HighQualityAntialiasing)
         self._painter.setRenderHint(QPainter.SmoothPixmapTransform)
-        self._painter.drawPixmap(0, 0, self.pixmap)
-        if self.labels:
-            for _label in self.labels:
+        self._painter.drawPixmap(rect, self.pixmap, rect)
+        # the overlay has the resolution of the image, so it would be blurred if the view magnifies the canvas.
+        # Then the static labels within the repainted rectangle are drawn directly instead
+        magnified = self._painter.deviceTransform().m11() > 1.0
+        if not magnified and not self._overlay.isNull():
+            self._painter.drawImage(rect, self._overlay, rect)
+        for _label, _, _rect, _active in self._rendered:
+            if (_active or magnified) and _rect.intersects(rect):
                 _label.paint(self._painter)
         if self.temp_label:
             self.temp_label.paint(self._painter)
 
         self._painter.end()
-
@@ -0,0 +1,165 @@
+from PyQt5.QtCore import QAbstractListModel, QAbstractProxyModel, QModelIndex, Qt
+
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+from seg_utils.utils.database import SQLiteDatabase
+
+PAGE_SIZE = 256  # image paths fetched from the database at once
+MAX_PAGES = 64  # pages held in memory, the least recently used page is dropped first
+
+
+class FileListModel(QAbstractListModel):
+    r"""List model over the image paths of the labels table. Only the sorted label_ids are held in memory, which
+    map rows onto label_ids and back by a binary search. The image paths are read page by page from the database
+    when the view requests them, so neither all image paths nor one item per image is created upfront.
+    Besides the model interface, it acts as a read-only sequence of the image paths (len and indexing)"""
+    def __init__(self, database: SQLiteDatabase, prefix: str = "", page_size: int = PAGE_SIZE,
+                 max_pages: int = MAX_PAGES, parent=None):
+        super(FileListModel, self).__init__(parent)
+        self.database = database
+        self.prefix = prefix  # removed from the displayed image paths
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self._pages = OrderedDict()  # page index: image paths
+        self._rows = {}  # image path: row of every image path which has been loaded once
+        self._labelIds = np.empty(0, dtype=np.int64)  # label_id of every row
+        self.reload()
+
+    def __len__(self) -> int:
+        return len(self._labelIds)
+
+    def __getitem__(self, row: int) -> str:
+        return self.imagePath(row)
+
+    def reload(self):
+        r"""Drops all cached pages, e.g. after labels have been added to the database"""
+        self.beginResetModel()
+        self._pages.clear()
+        self._rows.clear()
+        self._labelIds = np.asarray(self.database.get_label_ids(), dtype=np.int64)
+        self.endResetModel()
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._labelIds)
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole):
+        if not index.isValid() or not 0 <= index.row() < len(self._labelIds):
+            return None
+        if role == Qt.DisplayRole:
+            image_path = self.imagePath(index.row())
+            return image_path[len(self.prefix):] if image_path.startswith(self.prefix) else image_path
+        elif role == Qt.UserRole:
+            return self.imagePath(index.row())
+        return None
+
+    def imagePath(self, row: int) -> str:
+        r"""Returns the image path of a row, negative rows count from the end"""
+        if row < 0:
+            row += len(self._labelIds)
+        if not 0 <= row < len(self._labelIds):
+            raise IndexError(f"row {row} out of range for {len(self._labelIds)} images")
+        page_idx, offset = divmod(row, self.page_size)
+        return self._page(page_idx)[offset]
+
+    def rowOf(self, image_path: str) -> Optional[int]:
+        r"""Returns the row of an image path or None if it is not part of the model. Image paths of loaded pages are
+        looked up in a dict, all others by the unique index of the labels table"""
+        row = self._rows.get(image_path)
+        if row is None:
+            label_id = self.database.get_label_id(image_path)
+            row = self.rowsOf([label_id])[0] if label_id is not None else None
+            if row is not None:
+                self._rows[image_path] = row
+        return row
+
+    def rowsOf(self, label_ids: List[int]) -> List[Optional[int]]:
+        r"""Returns the rows of several label_ids by a binary search, None for label_ids which are not part of
+        the model"""
+        label_ids = np.asarray(label_ids, dtype=np.int64)
+        rows = np.searchsorted(self._labelIds, label_ids)
+        found = rows < len(self._labelIds)
+        found[found] = self._labelIds[rows[found]] == label_ids[found]
+        return [int(_row) if _found else None for _row, _found in zip(rows, found)]
+
+    def _page(self, page_idx: int) -> List[str]:
+        page = self._pages.get(page_idx)
+        if page is None:
+            page = self.database.get_image_path_page(int(self._labelIds[page_idx * self.page_size]),
+                                                     self.page_size)
+            self._pages[page_idx] = page
+            self._rows.update((_path, page_idx * self.page_size + _idx) for _idx, _path in enumerate(page))
+            if len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
+        else:
+            self._pages.move_to_end(page_idx)
+        return page
+
+
+class FileFilterProxyModel(QAbstractProxyModel):
+    r"""Proxy showing only the rows of a FileListModel which match the search text, in the order of their rank.
+    The matches are determined by one query of the database (see SQLiteDatabase.search_labels) instead of testing
+    every row, and both directions of the mapping are answered from a list and a dict"""
+    def __init__(self, parent=None):
+        super(FileFilterProxyModel, self).__init__(parent)
+        self._text = ""
+        self._sourceRows = None  # matching source rows or None if every row is shown
+        self._proxyRows = {}  # source row: proxy row
+
+    def setSourceModel(self, model: FileListModel):
+        self.beginResetModel()
+        super(FileFilterProxyModel, self).setSourceModel(model)
+        model.modelReset.connect(self.invalidate)
+        self._update()
+        self.endResetModel()
+
+    def setFilterText(self, text: str):
+        if text != self._text:
+            self.beginResetModel()
+            self._text = text
+            self._update()
+            self.endResetModel()
+
+    def invalidate(self):
+        self.beginResetModel()
+        self._update()
+        self.endResetModel()
+
+    def _update(self):
+        if self._text and self.sourceModel() is not None:
+            matches = self.sourceModel().database.search_labels(self._text)
+            rows = self.sourceModel().rowsOf([_label_id for _label_id, _ in matches])
+            self._sourceRows = [_row for _row in rows if _row is not None]
+            self._proxyRows = {_row: _idx for _idx, _row in enumerate(self._sourceRows)}
+        else:
+            self._sourceRows, self._proxyRows = None, {}
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        if parent.isValid() or self.sourceModel() is None:
+            return 0
+        return self.sourceModel().rowCount() if self._sourceRows is None else len(self._sourceRows)
+
+    def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else 1
+
+    def index(self, row: int, column: int = 0, parent: QModelIndex = QModelIndex()) -> QModelIndex:
+        if parent.isValid() or column != 0 or not 0 <= row < self.rowCount():
+            return QModelIndex()
+        return self.createIndex(row, column)
+
+    def parent(self, index: QModelIndex = QModelIndex()) -> QModelIndex:
+        return QModelIndex()
+
+    def mapToSource(self, proxyIndex: QModelIndex) -> QModelIndex:
+        if not proxyIndex.isValid() or self.sourceModel() is None:
+            return QModelIndex()
+        row = proxyIndex.row() if self._sourceRows is None else self._sourceRows[proxyIndex.row()]
+        return self.sourceModel().index(row, 0)
+
+    def mapFromSource(self, sourceIndex: QModelIndex) -> QModelIndex:
+        if not sourceIndex.isValid():
+            return QModelIndex()
+        row = sourceIndex.row() if self._sourceRows is None else self._proxyRows.get(sourceIndex.row())
+        return QModelIndex() if row is None else self.createIndex(row, 0)
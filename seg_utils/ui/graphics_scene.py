@@ -2,7 +2,8 @@ from PyQt5.QtWidgets import QGraphicsScene, QGraphicsSceneMouseEvent, QMenu
 from PyQt5.QtCore import Qt, pyqtSignal, QPointF, QRectF, QPoint
 
 from seg_utils.utils.qt import isInCircle
-from seg_utils.config import VERTEX_SIZE
+from seg_utils.utils.simplify import douglas_peucker
+from seg_utils.config import VERTEX_SIZE, TRACE_TOLERANCE
 from seg_utils.src.actions import Action
 
 from typing import Tuple
@@ -57,6 +58,11 @@ class ImageViewerScene(QGraphicsScene):
 
     def setClosedPath(self):
         self._startButtonPressed = False
+        if self.shape_type in ['tempTrace'] and len(self.poly_points) > 3:
+            # the final pass removes the points which barely deviate from the outline
+            points = douglas_peucker(np.array([(_pt.x(), _pt.y()) for _pt in self.poly_points]), TRACE_TOLERANCE)
+            if len(points) >= 3:
+                self.poly_points = [QPointF(_x, _y) for _x, _y in points.tolist()]
         self.sDrawingDone.emit(self.poly_points, self.shape_type)
         self.poly_points = []
         self.starting_point = QPointF()
@@ -100,8 +106,11 @@ class ImageViewerScene(QGraphicsScene):
                 else:
                     if self._startButtonPressed:
                         if self.shape_type in ['tempTrace']:
-                            self.poly_points.append(self.checkOutOfBounds(event.scenePos()))
-                            self.sDrawing.emit(self.poly_points, self.shape_type)
+                            # radial distance filter: points too close to the last one are skipped
+                            point = self.checkOutOfBounds(event.scenePos())
+                            if not self.poly_points or self.isFarEnough(point, self.poly_points[-1]):
+                                self.poly_points.append(point)
+                                self.sDrawing.emit(self.poly_points, self.shape_type)
                         elif self.shape_type in ['circle', 'rectangle']:
                             self.sDrawing.emit([self.starting_point, self.checkOutOfBounds(event.scenePos())],
                                                self.shape_type)
@@ -136,27 +145,31 @@ class ImageViewerScene(QGraphicsScene):
                     self._startButtonPressed = False
 
     def isMouseOnShape(self, event: QGraphicsSceneMouseEvent) -> Tuple[int, int, int]:
-        r"""Check if event position is within the boundaries of a shape
+        r"""Check if event position is within the boundaries of a shape. Only the shapes and vertices close to the
+        position are tested, which are looked up in the spatial index of the canvas
 
             :param event: Mouse Event on scene
             :returns: hovered shape index, closest shape index, vertex index
         """
-        selected_shape = -1
-        isOnVertex = []
-        closestVertex = []
         # only contains one item which is the proxy item aka the canvas
-        for _item_idx, _item in enumerate(self.items()[0].widget().labels):
+        canvas = self.items()[0].widget()
+        labels = canvas.labels
+        canvas.spatialIndex.sync(labels)
+        pos = event.scenePos()
+
+        selected_shape = -1
+        for _item_idx in canvas.spatialIndex.shapesAt(pos.x(), pos.y()):
             # Check if it is in the shape
-            if _item.contains(event.scenePos()):
+            if labels[_item_idx].contains(pos):
                 selected_shape = _item_idx
-            _isOnVert, _cVert = _item.vertices.isOnVertex(event.scenePos())
-            isOnVertex.append(_isOnVert)
-            closestVertex.append(_cVert)
-        # check if any of them are True, i.e. the vertex is highlighted
-        if any(isOnVertex):
-            return selected_shape, int(np.argmax(isOnVertex)), closestVertex[np.argmax(isOnVertex)]
-        else:
-            return selected_shape, -1, -1
+
+        # the rectangle of a vertex reaches up to its corner, so the radius covers the diagonal
+        radius = max((_item.vertices.vertexSize() for _item in labels), default=0) * np.sqrt(2)
+        for _item_idx, _vertex_idx, _ in canvas.spatialIndex.closestVertices(pos.x(), pos.y(), radius):
+            # check if any of them are True, i.e. the vertex is highlighted
+            if labels[_item_idx].vertices.isInVertexRect(pos, _vertex_idx):
+                return selected_shape, _item_idx, _vertex_idx
+        return selected_shape, -1, -1
 
     def isOnBeginning(self, point: QPointF) -> bool:
         """Check if a point is within the area around the starting point"""
@@ -173,6 +186,12 @@ class ImageViewerScene(QGraphicsScene):
         else:
             return False
 
+    @staticmethod
+    def isFarEnough(point: QPointF, last_point: QPointF) -> bool:
+        """Check if a point of a trace is at least TRACE_TOLERANCE away from the previous point"""
+        delta = point - last_point
+        return delta.x() ** 2 + delta.y() ** 2 >= TRACE_TOLERANCE ** 2
+
     def isShapeSelected(self):
         r"""Check if shape is highlighted which enables the context menu"""
         selectedShape = -1
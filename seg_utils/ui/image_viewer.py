@@ -28,7 +28,8 @@ class ImageViewer(QGraphicsView):
         self.setResizeAnchor(QGraphicsView.AnchorUnderMouse)
         self.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
         self.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
-        self.setViewportUpdateMode(QGraphicsView.FullViewportUpdate)
+        # only the regions updated by the canvas are repainted
+        self.setViewportUpdateMode(QGraphicsView.SmartViewportUpdate)
 
         # Protected Item
         self._zoom = 1
@@ -84,6 +84,32 @@ class LabelUI(object):
         self.labelList.setSelectionMode(QtWidgets.QAbstractItemView.SelectionMode.NoSelection)
         self.labelLayout.addWidget(self.labelList)
         self.rightMenuLayout.addWidget(self.labelFrame)
+
+        # Frame for the class statistics of the whole dataset, only shown if the database has the statistics tables
+        self.statsFrame = QtWidgets.QFrame(self.rightMenuFrame)
+        self.statsFrame.setMinimumSize(QtCore.QSize(0, 150))
+        self.statsFrame.setFrameShape(QtWidgets.QFrame.StyledPanel)
+        self.statsFrame.setFrameShadow(QtWidgets.QFrame.Raised)
+        self.statsFrame.setObjectName("statsFrame")
+        self.statsLayout = QtWidgets.QVBoxLayout(self.statsFrame)
+        self.statsLayout.setContentsMargins(0, 0, 0, 0)
+        self.statsLayout.setSpacing(0)
+        self.statsLayout.setObjectName("statsLayout")
+        self.statsLabel = QtWidgets.QLabel(self.statsFrame)
+        self.statsLabel.setStyleSheet("background-color: rgb(186, 189, 182);")
+        self.statsLabel.setObjectName("statsLabel")
+        self.statsLabel.setText("Class Statistics")
+        self.statsLayout.addWidget(self.statsLabel)
+        self.statsTable = QtWidgets.QTableWidget(0, 4, self.statsFrame)
+        self.statsTable.setHorizontalHeaderLabels(["Class", "Images", "Instances", "Mean Area"])
+        self.statsTable.horizontalHeader().setStretchLastSection(True)
+        self.statsTable.verticalHeader().hide()
+        self.statsTable.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.statsTable.setSelectionMode(QtWidgets.QAbstractItemView.SelectionMode.NoSelection)
+        self.statsTable.setObjectName("statsTable")
+        self.statsLayout.addWidget(self.statsTable)
+        self.statsFrame.setVisible(False)
+        self.rightMenuLayout.addWidget(self.statsFrame)
         
         # Frame for the Polygons
         self.polyFrame = QtWidgets.QFrame(self.rightMenuFrame)
@@ -142,9 +168,18 @@ class LabelUI(object):
         self.fileSearch.setPlaceholderText("Search Filename")
         self.fileSearch.setObjectName("fileSearch")
         self.fileLayout.addWidget(self.fileSearch)
-        self.fileList = QtWidgets.QListWidget(self.fileFrame)
+        # a table view only lays out the visible rows, whereas a list view would query every row of the model
+        self.fileList = QtWidgets.QTableView(self.fileFrame)
         self.fileList.setIconSize(QtCore.QSize(7, 7))
-        self.fileList.setItemAlignment(QtCore.Qt.AlignmentFlag.AlignLeft)
+        self.fileList.horizontalHeader().hide()
+        self.fileList.horizontalHeader().setStretchLastSection(True)
+        self.fileList.verticalHeader().hide()
+        self.fileList.verticalHeader().setDefaultSectionSize(self.fileList.fontMetrics().height() + 4)
+        self.fileList.setShowGrid(False)
+        self.fileList.setWordWrap(False)
+        self.fileList.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+        self.fileList.setSelectionMode(QtWidgets.QAbstractItemView.SingleSelection)
+        self.fileList.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
         self.fileList.setObjectName("fileList")
         self.fileLayout.addWidget(self.fileList)
         self.rightMenuLayout.addWidget(self.fileFrame)
@@ -61,10 +61,10 @@ class Shape(QGraphicsItem):
         return f"Shape [{self.label.capitalize()}, {self.shape_type.capitalize()}]"
 
     def __eq__(self, other):
-        if self.vertices.vertices == other.vertices.vertices and self.label == other.label:
-            return True
-        else:
+        # points are stored as float32 in the database so an exact comparison with the current shape would fail
+        if self.label != other.label or len(self.vertices) != len(other.vertices):
             return False
+        return np.array_equal(np.float32(self.vertices.asArray()), np.float32(other.vertices.asArray()))
 
     @property
     def isHighlighted(self) -> bool:
@@ -137,28 +137,34 @@ class Shape(QGraphicsItem):
         """Resets the anchor set """
         self._anchorPoint = None
 
-    def moveVertex(self, vNum: int, newPos: QPointF):
-        """Handles the movement of one vertex"""
+    def moveVertex(self, vNum: int, newPos: QPointF) -> bool:
+        """Handles the movement of one vertex. Returns True if the vertices changed"""
+        changed = False
         if self.shape_type == 'polygon':
-            self.vertices.vertices[vNum] = QPointF(newPos.x(), newPos.y())
+            changed = self.vertices.setVertex(vNum, QPointF(newPos.x(), newPos.y()))
         elif self.shape_type in ['rectangle', 'circle']:
             if not self._anchorPoint:
                 # this point is the anchor a.k.a the point diagonally from the selected one
                 # however, as i am rebuilding the shape from there, i only need to select the anchor once and store it
                 self._anchorPoint = deepcopy(self.vertices.vertices[vNum - 2])
                 print("New Anchor Set")
-            self.vertices.vertices = QPolygonF([self._anchorPoint, newPos])
-
-        if self.shape_type in ['rectangle', 'circle'] and len(self.vertices.vertices) == 2:
-            self.vertices.completePoly()
+            # the same bounding points as completePoly generates, which are only set if they differ
+            points = QPolygonF([self._anchorPoint, QPointF(newPos.x(), self._anchorPoint.y()), newPos,
+                                QPointF(self._anchorPoint.x(), newPos.y())])
+            if points != self.vertices.vertices:
+                self.vertices.vertices = points
+                changed = True
 
         self.vertices.updateSelAndHigh(np.asarray([newPos.x(), newPos.y()]))
+        return changed
 
-    def moveShape(self, displacement: QPointF) -> None:
-        r"""Moves the shape by the given displacement"""
+    def moveShape(self, displacement: QPointF) -> bool:
+        r"""Moves the shape by the given displacement. Returns True if the vertices changed, i.e. False if the
+        displacement has been clamped to zero"""
         displacement = self.checkDisplacement(displacement)
         if self.shape_type in ['polygon', 'rectangle', 'circle']:
-            self.vertices.vertices.translate(displacement)
+            return self.vertices.translate(displacement)
+        return False
 
     def checkDisplacement(self, displacement: QPointF) -> List[QPointF]:
         """This function checks whether the bounding rect of the current shape exceeds the image if the
@@ -246,6 +252,8 @@ class VertexCollection(object):
     def __init__(self, points: List[QPointF], line_color: QColor, brush_color: QColor, vertex_size):
         # i am going to save them as a polygon as it is a representation of a vector and i can access it like a matrix
         self._points = QPolygonF(points)
+        self._array = None  # cached numpy copy of the points, kept in sync by the methods altering the points
+        self.revision = 0  # incremented on every change of the points, e.g. for the spatial index
         self.line_color = line_color
         self.brush_color = brush_color
         self.highlight_color = Qt.GlobalColor.white
@@ -277,6 +285,38 @@ class VertexCollection(object):
     @vertices.setter
     def vertices(self, value):
         self._points = value
+        self.invalidate()
+
+    def invalidate(self):
+        """Has to be called if the points have been altered directly and not by the methods of this class"""
+        self._array = None
+        self.revision += 1
+
+    def asArray(self) -> np.ndarray:
+        """Returns the points as (N, 2) array, which is only converted again after the points have changed"""
+        if self._array is None:
+            self._array = self.ListQPointF_to_Numpy(self._points).reshape(-1, 2)
+        return self._array
+
+    def setVertex(self, idx: int, point: QPointF) -> bool:
+        """Moves a single vertex and updates the cached array in place. Returns False if the vertex did not move"""
+        if self._points[idx] == point:
+            return False
+        self._points[idx] = point
+        if self._array is not None:
+            self._array[idx] = (point.x(), point.y())
+        self.revision += 1
+        return True
+
+    def translate(self, displacement: QPointF) -> bool:
+        """Moves all vertices and updates the cached array in place. Returns False for a zero displacement"""
+        if displacement.isNull():
+            return False
+        self._points.translate(displacement)
+        if self._array is not None:
+            self._array += (displacement.x(), displacement.y())
+        self.revision += 1
+        return True
 
     def paint(self, painter: QPainter):
         for _idx, _vertex in enumerate(self._points):
@@ -300,23 +340,32 @@ class VertexCollection(object):
     def closestVertex(self, point: np.ndarray) -> int:
         """Calculate the euclidean distance between a point and all vertices and return the index of
         the closest node to the point"""
-        return closestEuclideanDistance(point, self.ListQPointF_to_Numpy(self._points))
+        return closestEuclideanDistance(point, self.asArray())
 
     def isOnVertex(self, point: QPointF) -> Tuple[bool, int]:
         """Check if a point is within the closest vertex rectangle"""
         closestVertex = self.closestVertex(np.asarray([point.x(), point.y()]))
-        vertexCenter = self._points[closestVertex]
-        if closestVertex in [self.highlightedVertex, self.selectedVertex]:
-            size = (self.vertex_size * self._scaling) / 2
+        if self.isInVertexRect(point, closestVertex):
+            return True, closestVertex
         else:
-            size = self.vertex_size / 2
+            return False, -1
+
+    def isInVertexRect(self, point: QPointF, idx: int) -> bool:
+        """Check if a point is within the rectangle drawn around the vertex"""
+        size = self.vertexSize(idx)
+        vertexCenter = self._points[idx]
         vertexRect = QRectF(vertexCenter - QPointF(size, size),
                             vertexCenter + QPointF(size, size))
+        return vertexRect.contains(point)
 
-        if vertexRect.contains(point):
-            return True, closestVertex
-        else:
-            return False, -1
+    def vertexSize(self, idx: Optional[int] = None) -> float:
+        """Half of the edge length of the rectangle around a vertex. Without an index, the largest one is returned"""
+        scaled_size = (self.vertex_size * self._scaling) / 2
+        if idx is None:
+            return max(scaled_size, self.vertex_size / 2)
+        if idx in [self.highlightedVertex, self.selectedVertex]:
+            return scaled_size
+        return self.vertex_size / 2
 
     def updateColor(self, line_color: QColor, brush_color: QColor):
         if line_color and brush_color:
@@ -334,6 +383,7 @@ class VertexCollection(object):
         """This function generates the other bounding points of the shape"""
         self._points.insert(1, QPointF(self._points[1].x(), self._points[0].y()))
         self._points.append(QPointF(self._points[0].x(), self._points[2].y()))
+        self.invalidate()
 
     @staticmethod
     def ListQPointF_to_Numpy(point_list: List[QPointF]):
@@ -201,6 +201,20 @@ class ViewerUI(object):
         self.controlLayout.setStretch(1, 1)
         self.bodyLayout.addWidget(self.controlFrame)
 
+        # Search over file names, classes and notes with the results underneath
+        self.searchEdit = QtWidgets.QLineEdit(self.mainBody)
+        self.searchEdit.setMaximumWidth(1800)
+        self.searchEdit.setPlaceholderText("Search Filename, Class or Note")
+        self.searchEdit.setClearButtonEnabled(True)
+        self.searchEdit.setEnabled(False)
+        self.searchEdit.setObjectName("searchEdit")
+        self.bodyLayout.addWidget(self.searchEdit)
+        self.searchResults = QtWidgets.QListWidget(self.mainBody)
+        self.searchResults.setMaximumSize(1800, 100)
+        self.searchResults.setVisible(False)
+        self.searchResults.setObjectName("searchResults")
+        self.bodyLayout.addWidget(self.searchResults)
+
         self.notesWidget = QtWidgets.QTextEdit(self.mainBody)
         self.notesWidget.setMaximumSize(1800, 100)
         self.notesWidget.setPlaceholderText("Insert Notes here")
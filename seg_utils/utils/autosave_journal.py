@@ -0,0 +1,251 @@
+import json
+import os
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PyQt5.QtCore import QThread
+
+from seg_utils.utils.database import SQLiteDatabase, label_class_dict
+
+JOURNAL_SUFFIX = ".journal"  # the journal is stored next to the database
+SYNC_DELAY = 1.0  # seconds the thread collects records before they are written and synced to disk at once
+COMPACT_SIZE = 4 * 1024 * 1024  # bytes of the journal file above which it is rewritten from the unsaved state
+
+
+def encode_record(record: dict) -> bytes:
+    r"""Returns one line of the journal, which is the JSON of the record prefixed by its CRC32. A crash while the
+    line is appended leaves a torn line, which is detected by the checksum"""
+    data = json.dumps(record, separators=(',', ':'), default=_to_json).encode('utf-8')
+    return b"%08x %s\n" % (zlib.crc32(data), data)
+
+
+def decode_record(line: bytes) -> Optional[dict]:
+    r"""Returns the record of a journal line or None if the line is torn or corrupted"""
+    crc, _, data = line.rstrip(b"\n").partition(b" ")
+    try:
+        if int(crc, 16) != zlib.crc32(data):
+            return None
+        return json.loads(data.decode('utf-8'))
+    except ValueError:
+        return None
+
+
+def apply_record(state: Dict[str, List[dict]], record: dict) -> bool:
+    r"""Applies a record onto the unsaved label_lists of the images
+
+        :param state: image_path: label_list of every image with unsaved edits
+        :param record: {'op': 'labels', 'image', 'labels'} replaces the label_list of an image,
+            {'op': 'shape', 'image', 'index', 'shape'} replaces or appends a single shape and
+            {'op': 'saved' or 'discard', 'image'} removes the image from the unsaved ones
+        :returns: False if the record cannot be applied, e.g. a shape without the label_list of its image
+    """
+    image_path = record['image']
+    if record['op'] == 'labels':
+        state[image_path] = list(record['labels'])
+    elif record['op'] == 'shape':
+        labels = state.get(image_path)
+        if labels is None or not 0 <= record['index'] <= len(labels):
+            return False
+        if record['index'] == len(labels):
+            labels.append(record['shape'])
+        else:
+            labels[record['index']] = record['shape']
+    elif record['op'] in ['saved', 'discard']:
+        state.pop(image_path, None)
+    else:
+        return False
+    return True
+
+
+def read_journal(journal_path: str) -> Dict[str, List[dict]]:
+    r"""Replays a journal file and returns the unsaved label_lists. Reading stops at the first torn or corrupted
+    line, as everything behind it has not been synced completely"""
+    state = {}
+    if not os.path.exists(journal_path):
+        return state
+    with open(journal_path, 'rb') as file:
+        for line in file:
+            record = decode_record(line)
+            if record is None:
+                break
+            apply_record(state, record)
+    return state
+
+
+def _to_json(obj):
+    # decoded label_lists hold numpy arrays and scalars
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class AutosaveJournal(QThread):
+    r"""Append-only journal of the label edits which have not been written to the database yet. Edits are recorded
+    from the GUI thread into an in-memory buffer, consecutive edits of the same shape (e.g. while a vertex is dragged)
+    replace each other, and the thread appends the buffer to the file with a single fsync every SYNC_DELAY seconds.
+    The folded state of the unsaved images is kept in memory, from which the file is rewritten once it grows beyond
+    COMPACT_SIZE or is truncated once every edit has been saved. After a crash, the journal is replayed into the
+    database by recover"""
+
+    def __init__(self, journal_path: str, sync_delay: float = SYNC_DELAY, compact_size: int = COMPACT_SIZE,
+                 parent=None):
+        super(AutosaveJournal, self).__init__(parent)
+        self.journal_path = journal_path
+        self.sync_delay = sync_delay
+        self.compact_size = compact_size
+        self._state = {}  # image_path: label_list of every image with unsaved edits
+        self._seqs = {}  # image_path: sequence number of the last edit
+        self._seq = 0
+        self._buffer = []  # records which have not been written yet
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._stopped = False
+        self._flushing = 0  # number of threads waiting in flush
+
+    def recover(self, database: SQLiteDatabase) -> Tuple[List[str], List[Tuple[str, str]]]:
+        r"""Writes the unsaved label_lists of an existing journal into the database and rewrites the journal with
+        the label_lists which could not be written. Has to be called before the thread is started
+
+            :returns: image paths of the recovered labels, (image_path, error message) of the failed ones
+        """
+        state = read_journal(self.journal_path)
+        label_classes = database.get_label_classes()
+        failed = database.update_labels_batch([(_path, label_class_dict(_labels, label_classes))
+                                               for _path, _labels in state.items()]) if state else []
+        failed_paths = {_path for _path, _ in failed}
+        with self._lock:
+            self._state = {_path: _labels for _path, _labels in state.items() if _path in failed_paths}
+            self._seqs = {_path: 0 for _path in self._state}
+        self._compact()
+        return [_path for _path in state if _path not in failed_paths], failed
+
+    def has_labels(self, image_path: str) -> bool:
+        with self._lock:
+            return image_path in self._state
+
+    def last_seq(self, image_path: str) -> int:
+        r"""Returns the sequence number of the last edit of an image, which is passed to mark_saved once the labels
+        up to this edit have been written into the database"""
+        with self._lock:
+            return self._seqs.get(image_path, 0)
+
+    def set_labels(self, image_path: str, label_list: List[dict]):
+        r"""Records the complete label_list of an image"""
+        self._append({'op': 'labels', 'image': image_path, 'labels': list(label_list)})
+
+    def set_shape(self, image_path: str, index: int, shape: dict) -> bool:
+        r"""Records a single changed or appended shape. Returns False if the journal does not hold the label_list of
+        the image, which then has to be recorded by set_labels instead"""
+        return self._append({'op': 'shape', 'image': image_path, 'index': index, 'shape': shape})
+
+    def mark_saved(self, image_path: str, seq: int):
+        r"""Removes an image from the unsaved ones if it has not been edited after the edit with the given sequence
+        number, see last_seq"""
+        with self._lock:
+            if self._seqs.get(image_path) != seq:
+                return
+        self._append({'op': 'saved', 'image': image_path})
+
+    def discard(self, image_path: str):
+        r"""Removes an image from the unsaved ones, e.g. if the user dismissed the changes"""
+        self._append({'op': 'discard', 'image': image_path})
+
+    def _append(self, record: dict) -> bool:
+        with self._condition:
+            image_path = record['image']
+            if record['op'] in ['saved', 'discard'] and image_path not in self._state:
+                return True
+            if not apply_record(self._state, record):
+                return False
+            self._seq += 1
+            self._seqs[image_path] = self._seq
+            if record['op'] in ['saved', 'discard']:
+                del self._seqs[image_path]
+            last = self._buffer[-1] if self._buffer else None
+            if last is not None and last['image'] == image_path and \
+                    (record['op'] != 'shape' or (last['op'] == 'shape' and last['index'] == record['index'])):
+                # the record supersedes the last one, which has not been written yet
+                self._buffer[-1] = record
+            else:
+                self._buffer.append(record)
+            self._condition.notify_all()
+            return True
+
+    def flush(self):
+        r"""Blocks until every recorded edit has been synced to disk"""
+        with self._condition:
+            self._flushing += 1
+            self._condition.notify_all()
+            try:
+                while self._buffer and self.isRunning():
+                    self._condition.wait()
+            finally:
+                self._flushing -= 1
+
+    def stop(self):
+        r"""Syncs all recorded edits and stops the thread. The journal file is removed if nothing is unsaved"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        self.wait()
+
+    def run(self):
+        file = open(self.journal_path, 'ab')
+        try:
+            while True:
+                with self._condition:
+                    while not self._buffer and not self._stopped:
+                        self._condition.wait()
+                    # collects further edits, but a flush or stop does not wait for them
+                    deadline = time.monotonic() + self.sync_delay
+                    while self._buffer and not self._stopped and not self._flushing:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._condition.wait(remaining)
+                    records, self._buffer = self._buffer, []
+                    stopped, unsaved = self._stopped, bool(self._state)
+                self._write(file, records)
+                if not unsaved or file.tell() > self.compact_size:
+                    file.close()
+                    self._compact()
+                    file = open(self.journal_path, 'ab')
+                with self._condition:
+                    self._condition.notify_all()
+                if stopped:
+                    return
+        finally:
+            file.close()
+            if self._stopped and not self._state and os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+            with self._condition:
+                self._condition.notify_all()
+
+    @staticmethod
+    def _write(file, records: List[dict]):
+        lines = []
+        for _record in records:
+            try:
+                lines.append(encode_record(_record))
+            except (TypeError, ValueError) as err:
+                print(f"Skipping journal record of {_record['image']}: {err}")
+        if lines:
+            file.write(b"".join(lines))
+            file.flush()
+            os.fsync(file.fileno())
+
+    def _compact(self):
+        r"""Rewrites the journal with one record per unsaved image. The new journal is synced before it replaces the
+        old one, so a crash leaves either of both"""
+        with self._lock:
+            records = [{'op': 'labels', 'image': _path, 'labels': list(_labels)}
+                       for _path, _labels in self._state.items()]
+        temp_path = self.journal_path + ".tmp"
+        with open(temp_path, 'wb') as file:
+            self._write(file, records)
+        os.replace(temp_path, self.journal_path)
@@ -1,11 +1,17 @@
 import sqlite3
 import os
 import numpy as np
-from typing import Union, List, Optional, Tuple
+from typing import Union, List, Optional, Tuple, Iterator, Dict, Callable
 import pickle
 import sys
+import threading
+from contextlib import contextmanager
+from functools import wraps
 from packaging import version
 
+from seg_utils.utils.label_encoding import encode_label_list, decode_label_list, is_encoded
+from seg_utils.utils.images import read_image_size
+
 # NOTE: it is not best practice with the with statements and directly use a connection but it is also not forbidden and
 # makes the code nice and clean as the with statement terminates the connection to the database after execution
 import numpy as np
@@ -38,34 +44,515 @@ CREATE_LABEL_TABLE = """
     label_list BLOB NOT NULL,
     FOREIGN KEY (image_path) REFERENCES images(image_path));"""
 
+INSERT_LABEL = "INSERT INTO labels (image_path, label_list) VALUES (?, ?);"
+
+# Optional normalized representation of the label_list of each image, which is kept in sync with the labels table.
+# It allows per-class, per-shape_type and spatial queries without decoding any label_list
+CREATE_SHAPES_TABLES = """
+    CREATE TABLE IF NOT EXISTS classes (
+    class_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE);
+
+    CREATE TABLE IF NOT EXISTS shapes (
+    shape_id INTEGER PRIMARY KEY,
+    image_id INTEGER NOT NULL,
+    class_id INTEGER NOT NULL,
+    shape_type TEXT NOT NULL,
+    bbox_x0 REAL NOT NULL,
+    bbox_y0 REAL NOT NULL,
+    bbox_x1 REAL NOT NULL,
+    bbox_y1 REAL NOT NULL,
+    area REAL NOT NULL,
+    n_points INTEGER NOT NULL,
+    FOREIGN KEY (image_id) REFERENCES images(image_id) ON DELETE CASCADE,
+    FOREIGN KEY (class_id) REFERENCES classes(class_id));
+
+    CREATE TABLE IF NOT EXISTS points (
+    shape_id INTEGER NOT NULL,
+    point_idx INTEGER NOT NULL,
+    x REAL NOT NULL,
+    y REAL NOT NULL,
+    PRIMARY KEY (shape_id, point_idx),
+    FOREIGN KEY (shape_id) REFERENCES shapes(shape_id) ON DELETE CASCADE) WITHOUT ROWID;
+
+    CREATE INDEX IF NOT EXISTS shapes_image_idx ON shapes (image_id);
+    CREATE INDEX IF NOT EXISTS shapes_class_idx ON shapes (class_id, shape_type, area);
+    CREATE INDEX IF NOT EXISTS shapes_type_idx ON shapes (shape_type, area);
+
+    CREATE VIRTUAL TABLE IF NOT EXISTS shapes_rtree USING rtree (shape_id, x0, x1, y0, y1);"""
+INSERT_CLASS = "INSERT OR IGNORE INTO classes (name) VALUES (?);"
+INSERT_SHAPE = """
+    INSERT INTO shapes (image_id, class_id, shape_type, bbox_x0, bbox_y0, bbox_x1, bbox_y1, area, n_points)
+    VALUES ((SELECT image_id FROM images WHERE image_path = ?), (SELECT class_id FROM classes WHERE name = ?),
+    ?, ?, ?, ?, ?, ?, ?);"""
+INSERT_POINT = "INSERT INTO points (shape_id, point_idx, x, y) VALUES (?, ?, ?, ?);"
+INSERT_SHAPE_RTREE = "INSERT INTO shapes_rtree (shape_id, x0, x1, y0, y1) VALUES (?, ?, ?, ?, ?);"
+SELECT_SHAPES = """
+    SELECT images.image_path, shapes.shape_id, classes.name, shapes.shape_type, shapes.area,
+    shapes.bbox_x0, shapes.bbox_y0, shapes.bbox_x1, shapes.bbox_y1
+    FROM shapes JOIN images ON shapes.image_id = images.image_id JOIN classes ON shapes.class_id = classes.class_id"""
+
+# Cached probe results of the videos. A row is valid as long as size and mtime (in ns) of the file are unchanged.
+# The keyframes are used for seeking to single frames
+CREATE_VIDEO_META_TABLES = """
+    CREATE TABLE IF NOT EXISTS video_meta (
+    video_path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    duration REAL NOT NULL,
+    fps REAL NOT NULL,
+    num_frames INTEGER NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    codec TEXT NOT NULL);
+
+    CREATE TABLE IF NOT EXISTS keyframes (
+    video_path TEXT NOT NULL,
+    frame_num INTEGER NOT NULL,
+    pts_time REAL NOT NULL,
+    PRIMARY KEY (video_path, frame_num),
+    FOREIGN KEY (video_path) REFERENCES video_meta(video_path) ON DELETE CASCADE) WITHOUT ROWID;"""
+
+# Progress of the conversion of the source videos, which allows to resume an interrupted conversion
+CREATE_CONVERSIONS_TABLE = """
+    CREATE TABLE IF NOT EXISTS conversions (
+    conv_path TEXT PRIMARY KEY,
+    status TEXT NOT NULL DEFAULT 'pending',
+    error TEXT,
+    FOREIGN KEY (conv_path) REFERENCES videos(conv_path));"""
+CONVERSION_STATES = ["pending", "done", "failed"]
+
+# Materialized statistics of the labels. image_stats holds the number of instances and their summed area per image
+# and class, which is replaced by SQLiteDatabase with every change of a label_list. The triggers add and subtract
+# every row of image_stats to the totals per class in class_stats, so these are always up to date
+CREATE_STATS_TABLES = """
+    CREATE TABLE IF NOT EXISTS image_stats (
+    image_path TEXT NOT NULL,
+    label TEXT NOT NULL,
+    instances INTEGER NOT NULL,
+    area REAL NOT NULL,
+    PRIMARY KEY (image_path, label),
+    FOREIGN KEY (image_path) REFERENCES labels(image_path) ON DELETE CASCADE) WITHOUT ROWID;
+
+    CREATE INDEX IF NOT EXISTS image_stats_label_idx ON image_stats (label);
+
+    CREATE TABLE IF NOT EXISTS class_stats (
+    label TEXT PRIMARY KEY,
+    images INTEGER NOT NULL,
+    instances INTEGER NOT NULL,
+    area REAL NOT NULL) WITHOUT ROWID;
+
+    CREATE TRIGGER IF NOT EXISTS image_stats_insert AFTER INSERT ON image_stats BEGIN
+    INSERT INTO class_stats (label, images, instances, area) VALUES (new.label, 1, new.instances, new.area)
+    ON CONFLICT (label) DO UPDATE SET images = images + 1, instances = instances + excluded.instances,
+    area = area + excluded.area;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS image_stats_delete AFTER DELETE ON image_stats BEGIN
+    UPDATE class_stats SET images = images - 1, instances = instances - old.instances, area = area - old.area
+    WHERE label = old.label;
+    END;"""
+INSERT_IMAGE_STATS = "INSERT INTO image_stats (image_path, label, instances, area) VALUES (?, ?, ?, ?);"
+
+# Full-text index over the image path, the names of the labelled classes and the notes of every label. It stores no
+# content itself but reads it from the labels table, and is kept in sync by the triggers. The column label_names
+# holds the distinct class names of the label_list as text, which is maintained by SQLiteDatabase
+CREATE_SEARCH_INDEX = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS label_search USING fts5 (
+    image_path, label_names, notes, content='labels', content_rowid='label_id');
+
+    CREATE TRIGGER IF NOT EXISTS label_search_insert AFTER INSERT ON labels BEGIN
+    INSERT INTO label_search (rowid, image_path, label_names, notes)
+    VALUES (new.label_id, new.image_path, new.label_names, new.notes);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS label_search_delete AFTER DELETE ON labels BEGIN
+    INSERT INTO label_search (label_search, rowid, image_path, label_names, notes)
+    VALUES ('delete', old.label_id, old.image_path, old.label_names, old.notes);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS label_search_update AFTER UPDATE OF image_path, label_names, notes ON labels BEGIN
+    INSERT INTO label_search (label_search, rowid, image_path, label_names, notes)
+    VALUES ('delete', old.label_id, old.image_path, old.label_names, old.notes);
+    INSERT INTO label_search (rowid, image_path, label_names, notes)
+    VALUES (new.label_id, new.image_path, new.label_names, new.notes);
+    END;
+
+    INSERT INTO label_search (label_search) VALUES ('rebuild');"""
+
+BULK_CHUNK_SIZE = 1000  # rows per executemany call within the single bulk transaction
+
+SYNCHRONOUS_MODES = ["OFF", "NORMAL", "FULL", "EXTRA"]
+
+
+def writes(method):
+    """ Decorator for all methods of SQLiteDatabase that alter the database. In pooled mode, the method is executed
+    on the single writer connection while holding the write lock, so writes of several threads are serialized """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.writer():
+            return method(self, *args, **kwargs)
+    return wrapper
+
 
 class SQLiteDatabase:
-    def __init__(self, database_path: str):
+    def __init__(self, database_path: str, allow_pickle: bool = True, pooled: bool = False,
+                 busy_timeout: int = 5000, synchronous: str = "NORMAL", read_only: bool = False):
         """Connect to database as initialization
 
             :param database_path: path to the database
+            :param allow_pickle: whether label_lists in the legacy pickle format are loaded. Set to False for
+                untrusted databases, which then need to be converted with migrate_label_encoding first
+            :param pooled: thread-safe mode with one read connection per thread and a single serialized writer
+                connection. The database is switched to WAL journal mode, so readers never block on the writer
+            :param busy_timeout: time in ms a connection waits for a lock before raising (pooled mode)
+            :param synchronous: synchronous pragma of the writer, one of OFF, NORMAL, FULL, EXTRA (pooled mode)
+            :param read_only: open the database read-only, e.g. within worker processes
             """
-        self.connection = sqlite3.connect(database_path)
-        with self.connection:
-            self.connection.execute(f"PRAGMA foreign_keys = ON;")
-
+        if synchronous.upper() not in SYNCHRONOUS_MODES:
+            raise ValueError(f"synchronous needs to be one of {SYNCHRONOUS_MODES} but is {synchronous}")
+        self.database_path = database_path
+        self.allow_pickle = allow_pickle
+        self.pooled = pooled
+        self.busy_timeout = busy_timeout
+        self._write_lock = threading.RLock()
+        self._writer_thread = None
+        self._local = threading.local()
+        self._readers = []
+        self._readers_lock = threading.Lock()
+        self._table_info = {}  # cache of PRAGMA table_info per table, cleared by every schema change
+
+        if self.pooled:
+            self._connection = sqlite3.connect(database_path, timeout=busy_timeout / 1000.0,
+                                               check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode = WAL;")
+            self._connection.execute(f"PRAGMA synchronous = {synchronous.upper()};")
+            self._connection.execute(f"PRAGMA busy_timeout = {int(busy_timeout)};")
+        elif read_only:
+            self._connection = sqlite3.connect(f"file:{database_path}?mode=ro", uri=True)
+        else:
+            self._connection = sqlite3.connect(database_path)
+        with self._connection:
+            self._connection.execute(f"PRAGMA foreign_keys = ON;")
+        self.has_shapes_tables = self._check_shapes_tables()
+        self.has_search_index = self._check_search_index()
+        self.has_stats_tables = self._check_stats_tables()
+        self.has_video_meta_tables = self._check_video_meta_tables()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """ The connection to use by the current thread. In pooled mode, this is the writer connection if the thread
+        currently holds the write lock and its own read-only connection otherwise """
+        if not self.pooled or self._writer_thread == threading.get_ident():
+            return self._connection
+        reader = getattr(self._local, 'connection', None)
+        if reader is None:
+            # check_same_thread is disabled only such that close() can be called from any thread
+            reader = sqlite3.connect(f"file:{self.database_path}?mode=ro", uri=True,
+                                     timeout=self.busy_timeout / 1000.0, check_same_thread=False)
+            reader.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout)};")
+            reader.execute("PRAGMA foreign_keys = ON;")
+            self._local.connection = reader
+            with self._readers_lock:
+                self._readers.append(reader)
+        return reader
+
+    @contextmanager
+    def writer(self):
+        """ Context manager which serializes all writes. Within it, self.connection refers to the writer connection
+        of the current thread. Can be nested """
+        with self._write_lock:
+            previous = self._writer_thread
+            self._writer_thread = threading.get_ident()
+            try:
+                yield self._connection
+            finally:
+                self._writer_thread = previous
+
+    def close(self):
+        """ Close the writer and all read connections """
+        with self._readers_lock:
+            for reader in self._readers:
+                reader.close()
+            self._readers = []
+        self._local = threading.local()
+        with self._write_lock:
+            self._connection.close()
+
+    @writes
     def create_videos_table(self):
         """ Create a table within a connected database with columns\n
             id, origin, destination, name
             """
         with self.connection:
             self.connection.execute(CREATE_VIDEOS_TABLE)
+        self.invalidate_schema_cache()
 
+    @writes
     def create_images_table(self):
         """ Create a table for images """
         with self.connection:
             self.connection.execute(CREATE_IMAGES_TABLE)
+        self.invalidate_schema_cache()
 
+    @writes
     def create_labels_table(self):
         """ Create a table for labels """
         with self.connection:
             self.connection.execute(CREATE_LABEL_TABLE)
+        self.invalidate_schema_cache()
+
+    @writes
+    def create_shapes_tables(self, populate: bool = True):
+        """ Create the optional normalized classes, shapes and points tables together with their indices and the
+        R*Tree over the bounding boxes. From then on, they are kept in sync with every change of a label_list
+
+            :param bool populate: fill the tables with the shapes of all existing labels
+        """
+        with self.connection:
+            self.connection.executescript(CREATE_SHAPES_TABLES)
+        self.invalidate_schema_cache()
+        self.has_shapes_tables = True
+        if populate:
+            labels = self.connection.execute("SELECT image_path, label_list FROM labels;").fetchall()
+            with self.connection:
+                for image_path, label_list in labels:
+                    self._sync_shapes(image_path, decode_bytes(label_list, self.allow_pickle))
+
+    @writes
+    def create_stats_tables(self, populate: bool = True):
+        """ Create the tables of the per-image and per-class statistics. From then on, they are updated
+        incrementally with every change of a label_list
+
+            :param bool populate: fill the tables with the statistics of all existing labels
+        """
+        with self.connection:
+            self.connection.executescript(CREATE_STATS_TABLES)
+        self.invalidate_schema_cache()
+        self.has_stats_tables = True
+        if populate:
+            labels = self.connection.execute("SELECT image_path, label_list FROM labels;").fetchall()
+            with self.connection:
+                self.connection.execute("DELETE FROM image_stats;")
+                self.connection.execute("DELETE FROM class_stats;")
+                self.connection.executemany(INSERT_IMAGE_STATS, [
+                    _row for image_path, label_list in labels
+                    for _row in image_stats(image_path, decode_bytes(label_list, self.allow_pickle))])
+
+    @writes
+    def create_search_index(self):
+        """ Create the full-text index over image paths, class names and notes of all labels. The columns notes and
+        label_names are added to the labels table if they do not exist yet. From then on, the index is kept in sync
+        with every change of a label_list or a note """
+        columns = self.get_column_names("labels")
+        for column in ['notes', 'label_names']:
+            if column not in columns:
+                self.add_column("labels", column, "TEXT")
+        # fill label_names before the triggers exist, the index is built at once afterwards
+        rows = [(label_names(decode_bytes(label_list, self.allow_pickle)), image_path)
+                for image_path, label_list in self.connection.execute("SELECT image_path, label_list FROM labels;")]
+        with self.connection:
+            self.connection.executemany("UPDATE labels SET label_names = ? WHERE image_path = ?;", rows)
+        with self.connection:
+            self.connection.executescript(CREATE_SEARCH_INDEX)
+        self.invalidate_schema_cache()
+        self.has_search_index = True
+
+    @writes
+    def create_video_meta_tables(self):
+        """ Create the tables caching the probe results and keyframes of the videos """
+        with self.connection:
+            self.connection.executescript(CREATE_VIDEO_META_TABLES)
+        self.invalidate_schema_cache()
+        self.has_video_meta_tables = True
+
+    @writes
+    def set_video_metas(self, metas: List[tuple]) -> bool:
+        """ Stores (or replaces) the probe results of several videos within one transaction
+
+            :param metas: List of (video_path, size, mtime, duration, fps, num_frames, width, height, codec, keyframes)
+                with keyframes being a List of (frame number, presentation time in s)
+            :returns bool: True if successful, false otherwise
+        """
+        try:
+            with self.connection:
+                self.connection.executemany("DELETE FROM keyframes WHERE video_path = ?;",
+                                            [(_meta[0],) for _meta in metas])
+                self.connection.executemany("INSERT OR REPLACE INTO video_meta (video_path, size, mtime, duration, "
+                                            "fps, num_frames, width, height, codec) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);",
+                                            [_meta[:-1] for _meta in metas])
+                self.connection.executemany("INSERT INTO keyframes (video_path, frame_num, pts_time) VALUES (?, ?, ?);",
+                                            [(_meta[0], frame, pts) for _meta in metas for frame, pts in _meta[-1]])
+            return True
+        except sqlite3.DatabaseError as err:
+            print(err)
+            return False
+
+    def get_video_metas(self, stats: Dict[str, Tuple[int, int]]) -> Dict[str, tuple]:
+        """ Returns the cached probe results of all videos whose size and mtime still match
+
+            :param stats: Dictionary of video_path: (size, mtime in ns) of the current files
+            :returns: Dictionary of video_path: (duration, fps, num_frames, width, height, codec, keyframes)
+        """
+        try:
+            with self.connection:
+                metas = {}
+                video_paths = list(stats)
+                for _start in range(0, len(video_paths), BULK_CHUNK_SIZE // 2):
+                    chunk = video_paths[_start:_start + BULK_CHUNK_SIZE // 2]
+                    placeholders = ", ".join("?" * len(chunk))
+                    for _row in self.connection.execute(f"SELECT video_path, size, mtime, duration, fps, num_frames, "
+                                                        f"width, height, codec FROM video_meta "
+                                                        f"WHERE video_path IN ({placeholders});", chunk):
+                        if stats[_row[0]] == (_row[1], _row[2]):
+                            metas[_row[0]] = _row[3:] + ([],)
+                    for video_path, frame, pts in self.connection.execute(f"SELECT video_path, frame_num, pts_time "
+                                                                          f"FROM keyframes WHERE video_path IN "
+                                                                          f"({placeholders}) ORDER BY video_path, "
+                                                                          f"frame_num;", chunk):
+                        if video_path in metas:
+                            metas[video_path][-1].append((frame, pts))
+            return metas
+        except sqlite3.DatabaseError as err:
+            print(err)
+            return {}
+
+    @writes
+    def create_conversions_table(self):
+        """ Create the table tracking the conversion status of every video """
+        with self.connection:
+            self.connection.execute(CREATE_CONVERSIONS_TABLE)
+        self.invalidate_schema_cache()
+
+    @writes
+    def schedule_conversions(self, origin_paths: List[str], output_folder: str) -> List[Tuple[str, str]]:
+        """ Assigns the name output_folder/videoNNNN.mp4 to every source video which is not yet in the videos table
+        and marks it as pending, all within one transaction. The numbering continues after the existing videos
+
+            :param origin_paths: relative paths of the source videos
+            :param str output_folder: relative folder of the converted videos
+            :returns: List of (origin_path, conv_path) of the newly scheduled videos
+        """
+        try:
+            with self.connection:
+                known = {_row[0] for _row in self.connection.execute("SELECT origin_path FROM videos;").fetchall()}
+                counter = self.connection.execute("SELECT COUNT(*) FROM videos;").fetchone()[0]
+                scheduled = []
+                for origin_path in origin_paths:
+                    if origin_path in known:
+                        continue
+                    counter += 1
+                    # string format for at least 9999 videos
+                    scheduled.append((origin_path, f"{output_folder}/video{counter:04d}.mp4"))
+                    known.add(origin_path)
+                # the duration is only a dummy value until the conversion is done
+                self.connection.executemany(INSERT_VIDEO, [(origin, conv, 1) for origin, conv in scheduled])
+                self.connection.executemany("INSERT INTO conversions (conv_path) VALUES (?);",
+                                            [(conv,) for _, conv in scheduled])
+            return scheduled
+        except sqlite3.DatabaseError as err:
+            print(err)
+            return []
+
+    def get_unfinished_conversions(self) -> List[Tuple[str, str]]:
+        """ Returns (origin_path, conv_path) of all videos whose conversion is pending or failed """
+        try:
+            with self.connection:
+                return self.connection.execute("""SELECT videos.origin_path, videos.conv_path FROM conversions
+                                               JOIN videos ON conversions.conv_path = videos.conv_path
+                                               WHERE conversions.status != 'done' ORDER BY videos.video_id;"""
+                                               ).fetchall()
+        except sqlite3.DatabaseError as err:
+            print(err)
+            return []
+
+    @writes
+    def set_conversion_status(self, conv_path: str, status: str, error: Optional[str] = None,
+                              duration: Optional[float] = None) -> bool:
+        """ Updates the conversion status of one video and optionally its duration in ms
+
+            :param str conv_path: relative path of the converted video
+            :param str status: one of pending, done, failed
+            :param error: error message of a failed conversion
+            :param duration: duration of the converted video in ms
+            :returns bool: True if successful, false otherwise
+        """
+        if status not in CONVERSION_STATES:
+            raise ValueError(f"status needs to be one of {CONVERSION_STATES} but is {status}")
+        try:
+            with self.connection:
+                self.connection.execute("UPDATE conversions SET status = ?, error = ? WHERE conv_path = ?;",
+                                        (status, error, conv_path))
+                if duration is not None:
+                    self.connection.execute("UPDATE videos SET duration = ? WHERE conv_path = ?;",
+                                            (duration, conv_path))
+            return True
+        except sqlite3.DatabaseError as err:
+            print(err)
+            return False
 
+    def _check_shapes_tables(self) -> bool:
+        """ Returns True if the normalized shapes tables are present in the database """
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name IN ('shapes', 'shapes_rtree');"
+        ).fetchone()[0] == 2
+
+    def _check_search_index(self) -> bool:
+        """ Returns True if the full-text index of the labels is present in the database """
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name = 'label_search';").fetchone()[0] == 1
+
+    def _check_stats_tables(self) -> bool:
+        """ Returns True if the statistics tables are present in the database """
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name IN ('image_stats', 'class_stats');"
+        ).fetchone()[0] == 2
+
+    def _check_video_meta_tables(self) -> bool:
+        """ Returns True if the tables caching the probe results of the videos are present in the database """
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name IN ('video_meta', 'keyframes');"
+        ).fetchone()[0] == 2
+
+    def _sync_label_list(self, image_path: str, label_list: List[dict]):
+        """ Update everything derived from the label_list of one image, i.e. the normalized shapes, the statistics
+        and the class names of the full-text index if they exist. Needs to be called within an open transaction """
+        if self.has_shapes_tables:
+            self._sync_shapes(image_path, label_list)
+        if self.has_stats_tables:
+            self.connection.execute("DELETE FROM image_stats WHERE image_path = ?;", (image_path,))
+            self.connection.executemany(INSERT_IMAGE_STATS, image_stats(image_path, label_list))
+        if self.has_search_index:
+            self.connection.execute("UPDATE labels SET label_names = ? WHERE image_path = ?;",
+                                    (label_names(label_list), image_path))
+
+    def _sync_shapes(self, image_path: str, label_list: List[dict]):
+        """ Replace the normalized shapes of one image with the shapes in the label_list. Needs to be called within
+        an open transaction as it does not commit itself
+
+            :param str image_path: relative path of the image
+            :param label_list: list of dictionaries with the keys label, points and shape_type
+        """
+        old_ids = self.connection.execute(
+            "SELECT shape_id FROM shapes WHERE image_id = (SELECT image_id FROM images WHERE image_path = ?);",
+            (image_path,)).fetchall()
+        self.connection.executemany("DELETE FROM shapes_rtree WHERE shape_id = ?;", old_ids)
+        self.connection.executemany("DELETE FROM points WHERE shape_id = ?;", old_ids)
+        self.connection.executemany("DELETE FROM shapes WHERE shape_id = ?;", old_ids)
+
+        for _label in label_list:
+            points = np.asarray(_label.get('points', []), dtype=np.float64).reshape(-1, 2)
+            if not len(points):
+                continue
+            bbox, area = shape_geometry(_label['shape_type'], points)
+            self.connection.execute(INSERT_CLASS, (_label['label'],))
+            shape_id = self.connection.execute(INSERT_SHAPE, (image_path, _label['label'], _label['shape_type'],
+                                                              *bbox, area, len(points))).lastrowid
+            self.connection.execute(INSERT_SHAPE_RTREE, (shape_id, bbox[0], bbox[2], bbox[1], bbox[3]))
+            self.connection.executemany(INSERT_POINT, [(shape_id, _idx, _x, _y)
+                                                       for _idx, (_x, _y) in enumerate(points.tolist())])
+
+    @writes
     def add_video(self, origin_path_rel: str, conv_path_rel: str, duration: int) -> bool:
         """ Add a video entry to existing table if the origin_name is not already included in the database
 
@@ -85,6 +572,7 @@ class SQLiteDatabase:
             print(err)
             return False
 
+    @writes
     def add_image(self, video_path_rel: str, image_path_rel: str, frame_num: str) -> bool:
         """ Add a video entry to existing table if the origin_name is not already included in the database
 
@@ -108,6 +596,7 @@ class SQLiteDatabase:
             else:
                 print(err)
 
+    @writes
     def add_label(self, image_path_rel: str, label_list: List[dict], label_dict: Optional[dict] = None) -> bool:
         """ Add a label to existing label table
 
@@ -118,8 +607,8 @@ class SQLiteDatabase:
         """
         try:
             with self.connection:
-                self.connection.execute("""INSERT INTO labels (image_path, label_list) VALUES (?, ?);""",
-                                        (image_path_rel, pickle.dumps(label_list)))
+                self.connection.execute(INSERT_LABEL, (image_path_rel, encode_label_list(label_list)))
+                self._sync_label_list(image_path_rel, label_list)
                 if label_dict:
                     self.update_label(image_path_rel, label_dict)
                 else:
@@ -136,6 +625,140 @@ class SQLiteDatabase:
             else:
                 print(err)
 
+    @writes
+    def add_videos_bulk(self, videos: List[Tuple[str, str, int]],
+                        chunk_size: int = BULK_CHUNK_SIZE) -> List[Tuple[int, str]]:
+        """ Add multiple video entries within one single transaction
+
+            :param videos: List of (origin_path_rel, conv_path_rel, duration) tuples
+            :param int chunk_size: number of rows handed to one executemany call
+            :returns: List of (row index, error message) for every row that could not be inserted
+        """
+        return self._execute_bulk(INSERT_VIDEO, videos, chunk_size)
+
+    @writes
+    def add_images_bulk(self, images: List[Tuple[str, str, int]],
+                        chunk_size: int = BULK_CHUNK_SIZE) -> List[Tuple[int, str]]:
+        """ Add multiple image entries within one single transaction
+
+            :param images: List of (video_path_rel, image_path_rel, frame_num) tuples
+            :param int chunk_size: number of rows handed to one executemany call
+            :returns: List of (row index, error message) for every row that could not be inserted
+        """
+        return self._execute_bulk(INSERT_IMAGE, images, chunk_size)
+
+    @writes
+    def add_labels_bulk(self, labels: List[Tuple[str, List[dict]]],
+                        label_dicts: Optional[List[dict]] = None,
+                        chunk_size: int = BULK_CHUNK_SIZE) -> List[Tuple[int, str]]:
+        """ Add multiple labels within one single transaction
+
+            :param labels: List of (image_path_rel, label_list) tuples
+            :param label_dicts: Optional list (same length as labels) of dictionaries with additional columns of the
+                labels table, i.e. the class columns either as 'class_tumour' or 'tumour'
+            :param int chunk_size: number of rows handed to one executemany call
+            :returns: List of (row index, error message) for every row that could not be inserted
+        """
+        if not label_dicts:
+            rows = [(image_path, encode_label_list(label_list)) for image_path, label_list in labels]
+            return self._execute_bulk(INSERT_LABEL, rows, chunk_size, self._sync_label_lists(labels))
+
+        if len(label_dicts) != len(labels):
+            raise ValueError("labels and label_dicts need to be of the same length")
+
+        # map every key onto its column once, so all rows share the same INSERT statement
+        extra_columns = []
+        for _dict in label_dicts:
+            for key in _dict:
+                if key in ['label_id', 'image_path', 'label_list']:
+                    continue
+                column = self._label_column(key)
+                if column is None:
+                    print(f"Key {key} not in table. Skipping")
+                elif column not in extra_columns:
+                    extra_columns.append(column)
+
+        sql = f"INSERT INTO labels (image_path, label_list{''.join(', ' + col for col in extra_columns)}) " \
+              f"VALUES ({', '.join(['?'] * (len(extra_columns) + 2))});"
+        rows = []
+        for (image_path, label_list), _dict in zip(labels, label_dicts):
+            values = [_dict.get(col, _dict.get(col.replace('class_', '', 1))) for col in extra_columns]
+            rows.append((image_path, encode_label_list(label_list), *values))
+        return self._execute_bulk(sql, rows, chunk_size, self._sync_label_lists(labels))
+
+    def _sync_label_lists(self, labels: List[Tuple[str, List[dict]]]):
+        """ Returns the callback of _execute_bulk which syncs everything derived from the label_lists of the inserted
+        rows, or None if the database has no derived tables """
+        if not (self.has_shapes_tables or self.has_stats_tables or self.has_search_index):
+            return None
+
+        def sync(row_indices: List[int]):
+            for _idx in row_indices:
+                self._sync_label_list(*labels[_idx])
+        return sync
+
+    def _execute_bulk(self, sql: str, rows: List[tuple], chunk_size: int,
+                      sync: Optional[Callable[[List[int]], None]] = None) -> List[Tuple[int, str]]:
+        """ Execute an INSERT statement for all rows within one transaction. Every chunk is inserted with executemany
+        inside of a savepoint. If the chunk fails, it is rolled back to the savepoint and repeated row by row
+        in order to report the conflicting rows while keeping all valid ones. If the caller has already opened a
+        transaction, the rows are inserted within a savepoint of it and nothing is committed.
+
+            :param str sql: parametrized statement
+            :param rows: parameters of the individual rows
+            :param int chunk_size: number of rows handed to one executemany call
+            :param sync: called with the indices of the inserted rows within the savepoint of their chunk, e.g. to
+                write the derived tables of labels. A row is only kept together with everything written by sync
+            :returns: List of (row index, error message) for every row that could not be inserted
+        """
+        if chunk_size < 1:
+            raise ValueError(f"chunk_size needs to be at least 1 but is {chunk_size}")
+        conflicts = []
+        nested = self.connection.in_transaction
+        try:
+            if nested:
+                self.connection.execute("SAVEPOINT bulk;")
+                try:
+                    self._execute_chunks(sql, rows, chunk_size, sync, conflicts)
+                except sqlite3.DatabaseError:
+                    self.connection.execute("ROLLBACK TO bulk;")
+                    raise
+                finally:
+                    self.connection.execute("RELEASE bulk;")
+            else:
+                with self.connection:
+                    self.connection.execute("BEGIN;")
+                    self._execute_chunks(sql, rows, chunk_size, sync, conflicts)
+        except sqlite3.DatabaseError as err:
+            print(err)
+            return [(_idx, str(err)) for _idx in range(len(rows))]
+        return conflicts
+
+    def _execute_chunks(self, sql: str, rows: List[tuple], chunk_size: int,
+                        sync: Optional[Callable[[List[int]], None]], conflicts: List[Tuple[int, str]]):
+        """ Inserts the chunks of _execute_bulk within the open transaction and appends the conflicting rows """
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            self.connection.execute("SAVEPOINT bulk_chunk;")
+            try:
+                self.connection.executemany(sql, chunk)
+                if sync is not None:
+                    sync(list(range(start, start + len(chunk))))
+            except sqlite3.IntegrityError:
+                self.connection.execute("ROLLBACK TO bulk_chunk;")
+                for _idx, _row in enumerate(chunk, start=start):
+                    self.connection.execute("SAVEPOINT bulk_row;")
+                    try:
+                        self.connection.execute(sql, _row)
+                        if sync is not None:
+                            sync([_idx])
+                    except sqlite3.IntegrityError as err:
+                        self.connection.execute("ROLLBACK TO bulk_row;")
+                        conflicts.append((_idx, str(err)))
+                    self.connection.execute("RELEASE bulk_row;")
+            self.connection.execute("RELEASE bulk_chunk;")
+
+    @writes
     def add_column(self, table_name: str, column_name: str, datatype: str) -> bool:
         """ Add a column to an existing table
 
@@ -152,6 +775,7 @@ class SQLiteDatabase:
             else:
                 with self.connection:
                     self.connection.execute(f"""ALTER TABLE {table_name} ADD {column_name} {datatype};""")
+                self.invalidate_schema_cache()
                 return True
 
         # could be prevented by making the statement INSERT_VIDEO to INSERT OR REPLACE
@@ -160,49 +784,131 @@ class SQLiteDatabase:
             print(error)
             return False
 
+    @writes
     def update_label(self, image_name: str, label_class_dict: dict) -> bool:
         """Update one single label with the new label_list and the respective classes present. Every key in the
-        label_class_dict will be used to update one column specified by the key. The columns of the table are dynamic"""
+        label_class_dict will be used to update one column specified by the key. The columns of the table are dynamic.
+        All columns are updated with one single statement"""
         try:
+            columns = self._label_columns(label_class_dict)
             with self.connection:
-                columns = self.get_column_names("labels")
-                classes = self.get_label_classes()
-                for key, entry in label_class_dict.items():
-                    if key in columns:
-                        if key == 'label_list':
-                            self.connection.execute(f"""UPDATE labels SET {key} = ? WHERE image_path = ?;""",
-                                                    (pickle.dumps(entry), image_name))
-                        else:
-                            self.connection.execute(f"""UPDATE labels SET {key} = ? WHERE image_path = ?;""",
-                                                    (entry, image_name))
-                    elif key in classes:
-                        self.connection.execute(f"""UPDATE labels SET {"class_" + key} = ? WHERE image_path = ?;""",
-                                                (entry, image_name))
-                    else:
-                        print(f"Key {key} not in table. Skipping")
-                        continue
+                self._update_label(image_name, label_class_dict, columns)
                 return True
         except sqlite3.DatabaseError as error:
             print(error)
             return False
 
+    @writes
+    def update_labels_batch(self, labels: List[Tuple[str, dict]]) -> List[Tuple[str, str]]:
+        """ Update several labels like update_label within one single transaction. Every label is updated inside of
+        a savepoint, so a failing label is rolled back without losing the others
+
+            :param labels: List of (image_name, label_class_dict)
+            :returns: List of (image_name, error message) for every label that could not be updated
+        """
+        failed = []
+        try:
+            # resolving the columns reads the schema, which must not happen within the transaction
+            columns = self._label_columns({_key for _, _dict in labels for _key in _dict})
+            with self.connection:
+                self.connection.execute("BEGIN;")
+                for image_name, label_class_dict in labels:
+                    self.connection.execute("SAVEPOINT batch_label;")
+                    try:
+                        self._update_label(image_name, label_class_dict, columns)
+                    except sqlite3.DatabaseError as err:
+                        self.connection.execute("ROLLBACK TO batch_label;")
+                        failed.append((image_name, str(err)))
+                    self.connection.execute("RELEASE batch_label;")
+        except sqlite3.DatabaseError as err:
+            print(err)
+            return [(image_name, str(err)) for image_name, _ in labels]
+        return failed
+
+    def _update_label(self, image_name: str, label_class_dict: dict, label_columns: Dict[str, Optional[str]]):
+        """ Updates the columns of one label and everything derived from its label_list. Needs to be called within
+        an open transaction with the columns of the keys resolved by _label_columns """
+        columns, values = [], []
+        for key, entry in label_class_dict.items():
+            column = label_columns[key]
+            if column is None:
+                print(f"Key {key} not in table. Skipping")
+                continue
+            columns.append(column)
+            values.append(encode_label_list(entry) if column == 'label_list' else entry)
+        if columns:
+            self.connection.execute(f"""UPDATE labels SET {', '.join(col + ' = ?' for col in columns)}
+                                    WHERE image_path = ?;""", (*values, image_name))
+        if 'label_list' in label_class_dict:
+            self._sync_label_list(image_name, label_class_dict['label_list'])
+
+    def _label_columns(self, keys) -> Dict[str, Optional[str]]:
+        """ Maps several keys of label dicts onto their columns, see _label_column """
+        return {_key: self._label_column(_key) for _key in keys}
+
+    def _label_column(self, key: str) -> Optional[str]:
+        """ Maps a key of a label dict onto the column of the labels table. Keys are either the name of the column
+        or the name of a class, which is stored in the column class_<name>. Returns None for unknown keys """
+        if key in self.get_column_names("labels"):
+            return key
+        elif key in self.get_label_classes():
+            return "class_" + key
+        else:
+            return None
+
+    @writes
     def update_labels(self) -> bool:
-        """Temporary function to update the columns with the label_list of each entry"""
+        """Temporary function to update the columns with the label_list of each entry. With the statistics tables,
+        the columns are set from image_stats within SQLite without decoding any label_list"""
         try:
             with self.connection:
-                entries = self.get_entries_all("labels")
+                if self.has_stats_tables:
+                    classes = self.get_label_classes()
+                    if classes:
+                        self.connection.execute(
+                            f"""UPDATE labels SET {', '.join('class_' + _class + ' = EXISTS (SELECT 1 FROM image_stats '
+                                                               'WHERE image_stats.image_path = labels.image_path '
+                                                               'AND image_stats.label = ?)' for _class in classes)};""",
+                            classes)
+                    return True
+                entries = self.connection.execute("SELECT image_path, label_list FROM labels;").fetchall()
                 classes = self.get_label_classes()
+                if not classes:
+                    return True
+
+                # populate the columns based on the label_list with one statement for all rows
+                rows = []
+                for image_path, label_list in entries:
+                    _label_classes = {_label['label'] for _label in decode_bytes(label_list, self.allow_pickle)}
+                    # here one can also obtain the number of instances by counting instead
+                    rows.append((*[1 if _class in _label_classes else 0 for _class in classes], image_path))
+                self.connection.executemany(
+                    f"""UPDATE labels SET {', '.join('class_' + _class + ' = ?' for _class in classes)}
+                    WHERE image_path = ?;""", rows)
+                return True
+        except sqlite3.DatabaseError as error:
+            print(error)
+            return False
+
+    @writes
+    def update_label_lists(self, labels: List[Tuple[str, List[dict]]], chunk_size: int = BULK_CHUNK_SIZE) -> bool:
+        """ Replace the label_list of existing labels within one transaction, e.g. after their points have been
+        simplified. The class columns are left as they are, so the labels must not change their classes
 
-                # populate the columns based on the label_list
-                for _entry in entries:
-                    _classes_dict = {i: 0 for i in classes}
-                    _label_classes = []
-                    for _label in _entry[2]:
-                        if _label['label'] not in _label_classes:
-                            _label_classes.append(_label['label'])
-                            _classes_dict[_label[
-                                'label']] = 1  # here one can also obtain the number of instances if the if condition is removed and += 1 instead of =1
-                    self.update_label(_entry[1], _classes_dict)
+            :param labels: List of (image_path, label_list)
+            :param int chunk_size: number of rows handed to one executemany call
+            :returns bool: True if successful, false otherwise
+        """
+        try:
+            with self.connection:
+                for start in range(0, len(labels), chunk_size):
+                    chunk = labels[start:start + chunk_size]
+                    self.connection.executemany("UPDATE labels SET label_list = ? WHERE image_path = ?;",
+                                                [(encode_label_list(label_list), image_path)
+                                                 for image_path, label_list in chunk])
+                    for image_path, label_list in chunk:
+                        self._sync_label_list(image_path, label_list)
+            return True
         except sqlite3.DatabaseError as error:
             print(error)
             return False
@@ -217,16 +923,24 @@ class SQLiteDatabase:
             return False
 
     def get_table_info(self, table_name: str):
+        """ Returns the PRAGMA table_info of a table. The result is cached until the schema is altered through
+        one of the methods of this class """
         try:
-            with self.connection:
-                return self.connection.execute(f"""PRAGMA table_info({table_name})""").fetchall()
+            if table_name not in self._table_info:
+                with self.connection:
+                    self._table_info[table_name] = self.connection.execute(
+                        f"""PRAGMA table_info({table_name})""").fetchall()
+            return list(self._table_info[table_name])
         except sqlite3.DatabaseError as err:
             print(err)
 
+    def invalidate_schema_cache(self):
+        """ Clears the cached table information. Only necessary if the schema is altered from outside this object """
+        self._table_info = {}
+
     def get_column_datatype(self, table_name: str, column_name):
         try:
-            with self.connection:
-                table_info = self.connection.execute(f"""PRAGMA table_info({table_name})""").fetchall()
+            table_info = self.get_table_info(table_name)
             for entry in table_info:
                 if entry[1] == column_name:
                     return entry[2]
@@ -271,23 +985,249 @@ class SQLiteDatabase:
                         sql_string += f"class_{label_classes[idx]} > 0"
                     sql_string += ";"
                     sql_call = self.connection.execute(sql_string).fetchall()
-                    return check_for_bytes(sql_call)
+                    return check_for_bytes(sql_call, self.allow_pickle)
                 else:
                     print(f"all labels in label_class must be one of\n{classes}")
         except sqlite3.DatabaseError as error:
             print(error)
             return []
 
+    def iter_labels(self, label_classes: Optional[List[str]] = None,
+                    batch_size: int = BULK_CHUNK_SIZE, decode: bool = True) -> Iterator[Tuple[str, List[dict]]]:
+        r"""Generator over all labels (or all labels containing one of the classes) which only decodes one batch
+        of rows at a time instead of the whole table
+
+            :param label_classes: Optional list of classes, e.g. [tumour, cauterized]
+            :param batch_size: number of rows fetched from the database at once
+            :param decode: if False, the raw bytes of the label_list are returned
+            :returns: Iterator of (image_path, label_list)
+        """
+        cursor = self.connection.execute("SELECT image_path, label_list FROM labels" +
+                                         self._class_condition(label_classes) + " ORDER BY label_id;")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for image_path, label_list in rows:
+                yield image_path, decode_bytes(label_list, self.allow_pickle) if decode else label_list
+
+    def get_labeled_image_paths(self, label_classes: Optional[List[str]] = None) -> List[str]:
+        r"""Returns the image paths of all labels (or all labels containing one of the classes) in the same order as
+        iter_labels without decoding any label_list
+
+            :param label_classes: Optional list of classes, e.g. [tumour, cauterized]
+        """
+        ret = self.connection.execute("SELECT image_path FROM labels" +
+                                      self._class_condition(label_classes) + " ORDER BY label_id;").fetchall()
+        return [_row[0] for _row in ret]
+
+    def _class_condition(self, label_classes: Optional[List[str]] = None) -> str:
+        """ Returns the WHERE clause selecting all labels containing at least one of the classes """
+        if not label_classes:
+            return ""
+        classes = self.get_label_classes()
+        if not all(_class in classes for _class in label_classes):
+            raise ValueError(f"all labels in label_class must be one of\n{classes}")
+        return " WHERE " + " OR ".join(f"class_{_class} > 0" for _class in label_classes)
+
+    def get_shapes(self, label_classes: Optional[List[str]] = None, shape_types: Optional[List[str]] = None,
+                   min_area: Optional[float] = None, max_area: Optional[float] = None) -> List[tuple]:
+        r"""Returns all shapes of the normalized shapes table matching the given filters. Requires create_shapes_tables
+
+            :param label_classes: Optional list of classes, e.g. [tumour, cauterized]
+            :param shape_types: Optional list of shape types, e.g. [polygon, circle]
+            :param min_area: Optional minimum area in px²
+            :param max_area: Optional maximum area in px²
+            :returns: List of (image_path, shape_id, class, shape_type, area, bbox_x0, bbox_y0, bbox_x1, bbox_y1)
+        """
+        conditions, parameters = self._shape_conditions(label_classes, shape_types, min_area, max_area)
+        sql_string = SELECT_SHAPES
+        if conditions:
+            sql_string += " WHERE " + " AND ".join(conditions)
+        try:
+            with self.connection:
+                return self.connection.execute(sql_string + ";", parameters).fetchall()
+        except sqlite3.DatabaseError as err:
+            print(err)
+            return []
+
+    def get_shapes_in_window(self, x0: float, y0: float, x1: float, y1: float,
+                             image_path: Optional[str] = None,
+                             label_classes: Optional[List[str]] = None,
+                             shape_types: Optional[List[str]] = None) -> List[tuple]:
+        r"""Returns all shapes whose bounding box intersects the window spanned by (x0, y0) and (x1, y1)
+        using the R*Tree. Requires create_shapes_tables
+
+            :param x0: left border of the window
+            :param y0: upper border of the window
+            :param x1: right border of the window
+            :param y1: lower border of the window
+            :param image_path: Optional image to which the search is limited
+            :param label_classes: Optional list of classes, e.g. [tumour, cauterized]
+            :param shape_types: Optional list of shape types, e.g. [polygon, circle]
+            :returns: List of (image_path, shape_id, class, shape_type, area, bbox_x0, bbox_y0, bbox_x1, bbox_y1)
+        """
+        conditions, parameters = self._shape_conditions(label_classes, shape_types)
+        conditions = ["shapes_rtree.x0 <= ?", "shapes_rtree.x1 >= ?",
+                      "shapes_rtree.y0 <= ?", "shapes_rtree.y1 >= ?"] + conditions
+        parameters = [x1, x0, y1, y0] + parameters
+        if image_path:
+            conditions.append("images.image_path = ?")
+            parameters.append(image_path)
+        sql_string = SELECT_SHAPES + " JOIN shapes_rtree ON shapes.shape_id = shapes_rtree.shape_id WHERE " + \
+            " AND ".join(conditions) + ";"
+        try:
+            with self.connection:
+                return self.connection.execute(sql_string, parameters).fetchall()
+        except sqlite3.DatabaseError as err:
+            print(err)
+            return []
+
+    def get_shape_points(self, shape_id: int) -> np.ndarray:
+        r"""Returns the points of one shape of the normalized shapes table as (N, 2) array"""
+        try:
+            with self.connection:
+                ret = self.connection.execute("SELECT x, y FROM points WHERE shape_id = ? ORDER BY point_idx;",
+                                              (shape_id,)).fetchall()
+            return np.asarray(ret, dtype=np.float64).reshape(-1, 2)
+        except sqlite3.DatabaseError as err:
+            print(err)
+            return np.zeros((0, 2))
+
+    @staticmethod
+    def _shape_conditions(label_classes: Optional[List[str]] = None, shape_types: Optional[List[str]] = None,
+                          min_area: Optional[float] = None, max_area: Optional[float] = None) -> Tuple[list, list]:
+        """ Builds the WHERE conditions and the parameters of the shape queries """
+        conditions, parameters = [], []
+        if label_classes:
+            conditions.append(f"classes.name IN ({', '.join(['?'] * len(label_classes))})")
+            parameters += list(label_classes)
+        if shape_types:
+            conditions.append(f"shapes.shape_type IN ({', '.join(['?'] * len(shape_types))})")
+            parameters += list(shape_types)
+        if min_area is not None:
+            conditions.append("shapes.area >= ?")
+            parameters.append(min_area)
+        if max_area is not None:
+            conditions.append("shapes.area <= ?")
+            parameters.append(max_area)
+        return conditions, parameters
+
     def get_labeled_images(self) -> Tuple[List[str], List[int]]:
         """ Returns the image paths of labeled images and a list of whether they are already labeled or not"""
         try:
             with self.connection:
                 image_paths = self.connection.execute("SELECT image_path FROM labels").fetchall()
-                label_lists = check_for_bytes(self.connection.execute("SELECT label_list FROM labels").fetchall())
+                label_lists = check_for_bytes(self.connection.execute("SELECT label_list FROM labels").fetchall(),
+                                              self.allow_pickle)
+
+            return [tpl[0] for tpl in image_paths], [1 if lbl else 0
+                                                     for lbl in check_for_bytes(label_lists, self.allow_pickle)]
+        except sqlite3.DatabaseError as err:
+            print(err)
+
+    def get_label_ids(self) -> List[int]:
+        """ Returns the sorted label_ids of the labels table. The position of a label_id within this list is the row
+        of the label in e.g. the file list """
+        try:
+            with self.connection:
+                ret = self.connection.execute("SELECT label_id FROM labels ORDER BY label_id;").fetchall()
+            return [_row[0] for _row in ret]
+        except sqlite3.DatabaseError as err:
+            print(err)
+            return []
+
+    def get_image_path_page(self, first_label_id: int, limit: int) -> List[str]:
+        """ Returns one page of image paths of the labels table in the order of label_id without decoding any
+        label_list. The page starts at the given label_id, which is looked up in the primary key instead of
+        skipping all previous rows with OFFSET
+
+            :param int first_label_id: label_id of the first image path of the page
+            :param int limit: maximum number of image paths
+        """
+        try:
+            with self.connection:
+                ret = self.connection.execute("""SELECT image_path FROM labels WHERE label_id >= ?
+                                              ORDER BY label_id LIMIT ?;""", (first_label_id, limit)).fetchall()
+            return [_row[0] for _row in ret]
+        except sqlite3.DatabaseError as err:
+            print(err)
+            return []
 
-            return [tpl[0] for tpl in image_paths], [1 if lbl else 0 for lbl in check_for_bytes(label_lists)]
+    def get_label_id(self, image_path: str) -> Optional[int]:
+        """ Returns the label_id of an image path or None if the image has no entry in the labels table """
+        try:
+            with self.connection:
+                ret = self.connection.execute("SELECT label_id FROM labels WHERE image_path = ?;",
+                                              (image_path,)).fetchone()
+            return ret[0] if ret else None
         except sqlite3.DatabaseError as err:
             print(err)
+            return None
+
+    def search_labels(self, text: str, limit: Optional[int] = None) -> List[Tuple[int, str]]:
+        """ Searches the image paths, class names and notes of all labels with the full-text index, see
+        search_query for the syntax. Without the index (create_search_index), the image paths containing the text
+        are found by a scan of the labels
+
+            :param str text: text of the search box
+            :param limit: maximum number of matches
+            :returns: List of (label_id, image_path), ranked by relevance or ordered by label_id without the index
+        """
+        if not text.strip():
+            return []
+        try:
+            with self.connection:
+                if self.has_search_index:
+                    ret = self.connection.execute("""SELECT rowid, image_path FROM label_search
+                                                  WHERE label_search MATCH ? ORDER BY rank LIMIT ?;""",
+                                                  (search_query(text), -1 if limit is None else limit)).fetchall()
+                else:
+                    ret = self.connection.execute("""SELECT label_id, image_path FROM labels
+                                                  WHERE image_path LIKE '%' || ? || '%' ESCAPE '\\'
+                                                  ORDER BY label_id LIMIT ?;""",
+                                                  (escape_like(text), -1 if limit is None else limit)).fetchall()
+            return [tuple(_row) for _row in ret]
+        except sqlite3.DatabaseError as err:
+            print(err)
+            return []
+
+    def get_class_stats(self) -> List[Tuple[str, int, int, float]]:
+        """ Returns the distribution of the classes over the whole dataset from the statistics tables
+        (create_stats_tables) without scanning any label
+
+            :returns: List of (class, number of images, number of instances, summed area in px²) sorted by class
+        """
+        try:
+            with self.connection:
+                ret = self.connection.execute("""SELECT label, images, instances, area FROM class_stats
+                                              WHERE images > 0 ORDER BY label;""").fetchall()
+            return [tuple(_row) for _row in ret]
+        except sqlite3.DatabaseError as err:
+            print(err)
+            return []
+
+    def get_image_stats(self, image_path: str) -> Dict[str, Tuple[int, float]]:
+        """ Returns the number of instances and their summed area in px² per class of one image """
+        try:
+            with self.connection:
+                ret = self.connection.execute("SELECT label, instances, area FROM image_stats WHERE image_path = ?;",
+                                              (image_path,)).fetchall()
+            return {label: (instances, area) for label, instances, area in ret}
+        except sqlite3.DatabaseError as err:
+            print(err)
+            return {}
+
+    def get_images_with_class(self, label: str, min_instances: int = 1) -> List[str]:
+        """ Returns the image paths of all images with at least min_instances instances of a class """
+        try:
+            with self.connection:
+                ret = self.connection.execute("""SELECT image_path FROM image_stats WHERE label = ? AND instances >= ?
+                                              ORDER BY image_path;""", (label, min_instances)).fetchall()
+            return [_row[0] for _row in ret]
+        except sqlite3.DatabaseError as err:
+            print(err)
+            return []
 
     def get_table_names(self):
         """ Get all tables within one database
@@ -313,7 +1253,7 @@ class SQLiteDatabase:
         try:
             with self.connection:
                 ret = self.connection.execute(f"SELECT * FROM {table_name};").fetchall()
-                return check_for_bytes(ret)
+                return check_for_bytes(ret, self.allow_pickle)
         except sqlite3.DatabaseError as err:
             print(err)
 
@@ -332,14 +1272,14 @@ class SQLiteDatabase:
             with self.connection:
                 ret = self.connection.execute(f"SELECT * FROM {table_name} WHERE {column_name} = ?;",
                                               (entry_name,)).fetchall()
-            return check_for_bytes(ret)
+            return check_for_bytes(ret, self.allow_pickle)
         except sqlite3.DatabaseError as err:
             print(err)
 
     def get_label_from_imagepath(self, imagepath: str):
         ret = self.connection.execute(f"SELECT label_list FROM labels WHERE image_path = ?;",
                                       (imagepath,)).fetchall()
-        return check_for_bytes(ret)
+        return check_for_bytes(ret, self.allow_pickle)
 
     def get_entries_of_column(self, table_name: str, column_name: str):
         """ Get all the entries within the table by the specifier of the column
@@ -351,7 +1291,7 @@ class SQLiteDatabase:
         try:
             with self.connection:
                 ret = self.connection.execute(f"SELECT {column_name} FROM {table_name};").fetchall()
-                return check_for_bytes(ret)
+                return check_for_bytes(ret, self.allow_pickle)
         except sqlite3.DatabaseError as err:
             print(err)
 
@@ -384,6 +1324,7 @@ class SQLiteDatabase:
         except sqlite3.DatabaseError as err:
             print(err)
 
+    @writes
     def delete_table(self, table_name: str):
         """ Delete entire table
 
@@ -391,15 +1332,19 @@ class SQLiteDatabase:
             """
         try:
             with self.connection:
-                return self.connection.execute(f"DROP TABLE IF EXISTS {table_name};")
+                ret = self.connection.execute(f"DROP TABLE IF EXISTS {table_name};")
+            self.invalidate_schema_cache()
+            return ret
         except sqlite3.DatabaseError as err:
             print(err)
 
+    @writes
     def delete_column(self, table_name: str, column_name: str):
         try:
             if version.parse(sqlite3.sqlite_version) > version.parse("3.35"):
                 with self.connection:
                     self.connection.execute(f"ALTER TABLE {table_name} DROP COLUMN {column_name}")
+                self.invalidate_schema_cache()
             else:
                 raise NotImplementedError(
                     f"Your Version of sqlite ({sqlite3.sqlite_version}) does not support the method.\n"
@@ -410,6 +1355,7 @@ class SQLiteDatabase:
         except sqlite3.DatabaseError as err:
             print(err)
 
+    @writes
     def rename_column(self, table_name: str, old_column_name: str, new_column_name: str):
         """ Change all entries within a table and column that contain a certain string
 
@@ -422,9 +1368,11 @@ class SQLiteDatabase:
                 # NOTE: pure f string formatting didnt work so its a mixture. Don't know why
                 self.connection.execute(
                     f"""ALTER TABLE {table_name} RENAME COLUMN {old_column_name} TO {new_column_name};""")
+            self.invalidate_schema_cache()
         except sqlite3.DatabaseError as err:
             print(err)
 
+    @writes
     def clear_column(self, table_name: str, column_name: str):
         """This function clears all entries within one column"""
         try:
@@ -438,6 +1386,7 @@ class SQLiteDatabase:
         except sqlite3.DatabaseError as err:
             print(err)
 
+    @writes
     def rename_table(self, old: str, new: str):
         """Alters the name of an existing table
 
@@ -447,6 +1396,7 @@ class SQLiteDatabase:
         # TODO: error catching with table names if they do not exist
         with self.connection:
             self.connection.execute(f"""ALTER TABLE {old} RENAME TO {new}""")
+        self.invalidate_schema_cache()
 
     def get_video_from_image(self, image_name: str):
         try:
@@ -458,6 +1408,7 @@ class SQLiteDatabase:
         except sqlite3.DatabaseError as err:
             print(err)
 
+    @writes
     def update_entry(self, table_name: str, column_name_search: str, keyword: str, column_name_replace: str,
                      value_new: str):
         """ Update a single entry based on the old value in the column.
@@ -477,6 +1428,87 @@ class SQLiteDatabase:
         except sqlite3.DatabaseError as err:
             print(err)
 
+    @writes
+    def add_image_sizes(self, base_path: str, overwrite: bool = False) -> int:
+        """ Stores the size of every image in the columns width and height of the images table. The sizes are read
+        from the image headers without decoding any pixels
+
+            :param str base_path: parent directory of the database
+            :param bool overwrite: read the size of all images again, otherwise only missing sizes are read
+            :returns: number of updated images
+        """
+        for column in ['width', 'height']:
+            if column not in self.get_column_names("images"):
+                self.add_column("images", column, "INTEGER")
+        sql_string = "SELECT image_path FROM images"
+        if not overwrite:
+            sql_string += " WHERE width IS NULL OR height IS NULL"
+        try:
+            with self.connection:
+                image_paths = [_row[0] for _row in self.connection.execute(sql_string + ";").fetchall()]
+                rows = []
+                for image_path in image_paths:
+                    height, width = read_image_size(os.path.join(base_path, image_path))
+                    rows.append((width, height, image_path))
+                self.connection.executemany("UPDATE images SET width = ?, height = ? WHERE image_path = ?;", rows)
+            return len(rows)
+        except (sqlite3.DatabaseError, OSError) as err:
+            print(err)
+            return 0
+
+    def get_image_sizes(self) -> Dict[str, Tuple[int, int]]:
+        """ Returns the stored (height, width) of all images with known size. Empty if add_image_sizes has never
+        been called for this database """
+        if not {'width', 'height'}.issubset(self.get_column_names("images") or []):
+            return {}
+        try:
+            with self.connection:
+                ret = self.connection.execute("""SELECT image_path, height, width FROM images
+                                              WHERE width IS NOT NULL AND height IS NOT NULL;""").fetchall()
+            return {image_path: (height, width) for image_path, height, width in ret}
+        except sqlite3.DatabaseError as err:
+            print(err)
+            return {}
+
+    @writes
+    def set_image_hashes(self, hashes: List[Tuple[str, int]]) -> bool:
+        """ Stores the 64 bit perceptual hash of images in the column phash of the images table, which is added if it
+        does not exist yet. SQLite integers are signed, so the hashes are stored in two's complement
+
+            :param hashes: List of (image_path, unsigned 64 bit hash)
+            :returns bool: True if successful, false otherwise
+        """
+        if 'phash' not in self.get_column_names("images"):
+            self.add_column("images", "phash", "INTEGER")
+        try:
+            with self.connection:
+                self.connection.executemany("UPDATE images SET phash = ? WHERE image_path = ?;",
+                                            [(_hash - (1 << 64) if _hash >= (1 << 63) else _hash, image_path)
+                                             for image_path, _hash in hashes])
+            return True
+        except sqlite3.DatabaseError as err:
+            print(err)
+            return False
+
+    def get_image_hashes(self, missing: bool = False) -> Dict[str, Optional[int]]:
+        """ Returns the unsigned perceptual hash of all hashed images. Empty if no hash has been stored yet
+
+            :param bool missing: return the images without a hash (with None as value) instead
+        """
+        if 'phash' in (self.get_column_names("images") or []):
+            sql_string = f"SELECT image_path, phash FROM images WHERE phash IS {'' if missing else 'NOT '}NULL;"
+        elif missing:
+            sql_string = "SELECT image_path, NULL FROM images;"
+        else:
+            return {}
+        try:
+            with self.connection:
+                ret = self.connection.execute(sql_string).fetchall()
+            return {image_path: None if _hash is None else _hash & ((1 << 64) - 1) for image_path, _hash in ret}
+        except sqlite3.DatabaseError as err:
+            print(err)
+            return {}
+
     def get_notes(self, image_path: str):
         """ This function returns an existing label note """
         try:
@@ -486,6 +1518,7 @@ class SQLiteDatabase:
         except sqlite3.DatabaseError as err:
             print(err)
 
+    @writes
     def set_notes(self, image_path: str, text: str) -> bool:
         """ This function updates or sets a note within the database"""
         try:
@@ -507,11 +1540,12 @@ def get_filename_from_path(path: str):
     return os.path.basename(path)
 
 
-def check_for_bytes(lst: List[tuple]) -> Union[List[list], list]:
-    """ Iterates over a list of tuples and depickles byte objects. The output is converted depending on how many entries
+def check_for_bytes(lst: List[tuple], allow_pickle: bool = True) -> Union[List[list], list]:
+    """ Iterates over a list of tuples and decodes byte objects. The output is converted depending on how many entries
     the initial list contains. If its just one per sub-list, each of them is removed
 
         :param tuple lst: tuple to be searched for
+        :param bool allow_pickle: whether byte objects in the legacy pickle format are loaded
         :returns: Either a List of Lists or just a List depending on how many entries are put in
     """
     lst = convert_to_list(lst)
@@ -520,13 +1554,13 @@ def check_for_bytes(lst: List[tuple]) -> Union[List[list], list]:
         # this replaces lists with only one entry
         if len(_list_entry) == 1:
             if isinstance(_list_entry[0], bytes):
-                lst[_list_idx] = pickle.loads(_list_entry[0])
+                lst[_list_idx] = decode_bytes(_list_entry[0], allow_pickle)
             else:
                 lst[_list_idx] = _list_entry[0]
         else:
             for _tuple_idx, _value in enumerate(list(_list_entry)):
                 if isinstance(_value, bytes):
-                    lst[_list_idx][_tuple_idx] = pickle.loads(_value)
+                    lst[_list_idx][_tuple_idx] = decode_bytes(_value, allow_pickle)
                 else:
                     continue
 
@@ -536,6 +1570,93 @@ def check_for_bytes(lst: List[tuple]) -> Union[List[list], list]:
     return lst
 
 
+def decode_bytes(value: bytes, allow_pickle: bool = True):
+    """ Decodes a byte object stored in the database. Encoded label_lists are decoded directly, everything else is
+    assumed to be a legacy pickle which is only loaded if allowed
+
+        :param bytes value: byte object from the database
+        :param bool allow_pickle: whether legacy pickles are loaded
+        :returns: decoded object
+    """
+    if not value:
+        raise ValueError("Found an empty byte object, which is neither an encoded label_list nor a pickle")
+    if is_encoded(value):
+        return decode_label_list(value)
+    elif allow_pickle:
+        # every pickle ends with the STOP opcode, so a missing one means the entry is truncated or no pickle at all
+        if value[-1:] != pickle.STOP:
+            raise ValueError(f"Byte object of {len(value)} bytes is neither an encoded label_list nor a complete "
+                             f"pickle")
+        try:
+            return pickle.loads(value)
+        except (pickle.UnpicklingError, EOFError) as err:
+            raise ValueError(f"Byte object of {len(value)} bytes could not be unpickled: {err}") from err
+    else:
+        raise ValueError("Found a pickled entry but loading pickles is disabled. "
+                         "Convert the database with migrate_label_encoding first")
+
+
+def image_stats(image_path: str, label_list: List[dict]) -> List[Tuple[str, str, int, float]]:
+    """ Returns the rows of image_stats of one image, i.e. the number of instances and their summed area per class
+
+        :returns: List of (image_path, label, instances, area)
+    """
+    stats = {}
+    for _label in label_list:
+        points = np.asarray(_label.get('points', []), dtype=np.float64).reshape(-1, 2)
+        instances, area = stats.get(_label['label'], (0, 0.0))
+        area += shape_geometry(_label['shape_type'], points)[1] if len(points) else 0.0
+        stats[_label['label']] = (instances + 1, area)
+    return [(image_path, label, instances, area) for label, (instances, area) in stats.items()]
+
+
+def label_class_dict(label_list: List[dict], label_classes: List[str]) -> dict:
+    """ Returns the dict accepted by SQLiteDatabase.update_label for a label_list, i.e. the label_list itself and
+    every class column set to 1 if the class is present within the label_list and to 0 otherwise """
+    present = {_label['label'] for _label in label_list}
+    classes_dict = {_class: int(_class in present) for _class in label_classes}
+    classes_dict['label_list'] = label_list
+    return classes_dict
+
+
+def label_names(label_list: List[dict]) -> str:
+    """ Returns the distinct class names of a label_list as text for the full-text index """
+    return " ".join(sorted({str(_label['label']) for _label in label_list}))
+
+
+def search_query(text: str) -> str:
+    """ Converts the text of a search box into an FTS5 query, which matches all rows containing every term of the
+    text as prefix of a token, e.g. 'vid tum' matches video0001 labelled with tumour. Special characters of the
+    FTS5 syntax lose their meaning as every term is quoted """
+    return " ".join('"' + _term.replace('"', '""') + '"*' for _term in text.split())
+
+
+def escape_like(text: str) -> str:
+    """ Escapes the wildcards of a LIKE pattern, such that the text is matched literally with ESCAPE '\\' """
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def shape_geometry(shape_type: str, points: np.ndarray) -> Tuple[Tuple[float, float, float, float], float]:
+    """ Calculates the bounding box and the area of a shape
+
+        :param str shape_type: type of the shape, i.e. polygon, rectangle or circle
+        :param points: (N, 2) array of the points of the shape
+        :returns: bounding box as (x0, y0, x1, y1) and the area in px²
+    """
+    x0, y0 = points.min(axis=0).tolist()
+    x1, y1 = points.max(axis=0).tolist()
+    if shape_type == 'circle':
+        # circles are stored by their bounding rectangle
+        area = np.pi * (x1 - x0) * (y1 - y0) / 4.0
+    elif shape_type == 'rectangle':
+        area = (x1 - x0) * (y1 - y0)
+    else:
+        # shoelace formula
+        x, y = points[:, 0], points[:, 1]
+        area = 0.5 * abs(float(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))))
+    return (x0, y0, x1, y1), float(area)
+
+
 def convert_to_list(lst: List[tuple]) -> List[list]:
     return [list(elem) for elem in lst]
 
@@ -551,13 +1672,13 @@ def transform_databases(database_old, database_new):
 
     # First transform the videos table
     videos = db_old.get_entries_all("videos")
-    for vid in videos:
-        db_new.add_video(vid[1], vid[2], vid[3])
+    for _idx, err in db_new.add_videos_bulk([(vid[1], vid[2], vid[3]) for vid in videos]):
+        print(f"Video {videos[_idx][1]} skipped: {err}")
 
     # Second transform the images table
     images = db_old.get_entries_all("images")
-    for img in images:
-        db_new.add_image(img[1], img[2], img[3])
+    for _idx, err in db_new.add_images_bulk([(img[1], img[2], img[3]) for img in images]):
+        print(f"Image {images[_idx][2]} skipped: {err}")
 
     # Third the labels table
     label_columns = db_old.get_column_names("labels")
@@ -565,19 +1686,48 @@ def transform_databases(database_old, database_new):
 
     # create columns
     for col in label_columns:
-        db_new.add_column("labels", col, db_old.get_column_datatype("labels", col))
+        if col not in db_new.get_column_names("labels"):
+            db_new.add_column("labels", col, db_old.get_column_datatype("labels", col))
 
     # populate columns
     labels = db_old.get_entries_all("labels")
 
+    rows, label_dicts = [], []
     for lab in labels:
         lab.pop(0)  # removes the ID
-        image_path = lab[0]
-        label_list = lab[1]
         label_dict = {key: lab[idx] for idx, key in enumerate(label_columns)}
         label_dict.pop("image_path")  # remove that key from the dict
         label_dict.pop("label_list")
-        db_new.add_label(image_path, label_list, label_dict)
+        rows.append((lab[0], lab[1]))
+        label_dicts.append(label_dict)
+    for _idx, err in db_new.add_labels_bulk(rows, label_dicts):
+        print(f"Label {rows[_idx][0]} skipped: {err}")
+
+
+def migrate_label_encoding(database_path: str, chunk_size: int = BULK_CHUNK_SIZE) -> int:
+    """ Converts all pickled label_lists of a (trusted) database into the binary encoding of
+    utils.label_encoding within one single transaction. Already encoded rows are skipped,
+    so the migration can be repeated safely.
+
+        :param str database_path: path to the database
+        :param int chunk_size: number of rows converted per executemany call
+        :returns: number of converted rows
+    """
+    db = SQLiteDatabase(database_path)
+    converted = 0
+    with db.connection:
+        cursor = db.connection.execute("SELECT label_id, label_list FROM labels;")
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            update = [(encode_label_list(pickle.loads(blob)), label_id)
+                      for label_id, blob in rows if not is_encoded(blob)]
+            db.connection.executemany("UPDATE labels SET label_list = ? WHERE label_id = ?;", update)
+            converted += len(update)
+    db.connection.execute("VACUUM;")
+    print(f"Converted {converted} label_lists")
+    return converted
 
 
 if __name__ == "__main__":
@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import os.path as osp
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from seg_utils.utils.database import SQLiteDatabase, decode_bytes
+from seg_utils.utils.images import read_image_size
+from seg_utils.utils.masks import rasterize_shape
+
+# Layout of an exported dataset within its output directory:
+#   images.bin  all images as contiguous uint8 (height, width, 3) RGB arrays
+#   masks.bin   all semantic masks as contiguous uint8 (height, width) arrays with the class id per pixel
+#   index.npy   structured array with the byte offsets and the shape of every image in dataset order
+#   index.json  image paths in dataset order, the class map and per image the digest of its label row and the
+#               modification time of its image, which allow incremental re-exports
+IMAGES_FILE = "images.bin"
+MASKS_FILE = "masks.bin"
+INDEX_FILE = "index.npy"
+META_FILE = "index.json"
+INDEX_DTYPE = np.dtype([("image_offset", "<i8"), ("mask_offset", "<i8"), ("height", "<i4"), ("width", "<i4")])
+CHANNELS = 3
+BACKGROUND = 0
+
+
+def export_dataset(database_path: str, base_path: str, output_dir: str,
+                   label_classes: Optional[List[str]] = None) -> int:
+    r"""Exports all labeled images and their semantic masks into a fixed-layout, memory-mapped dataset which can be
+    read with MemmapDataset. Re-exports into the same directory are incremental: images whose label row and image
+    file did not change are skipped, changed ones are rewritten in place and new ones are appended. Slots of images
+    removed from the database remain in the files until the directory is exported from scratch. Images which are
+    missing or cannot be read are reported and left out of the dataset
+
+        :param database_path: path to the database
+        :param base_path: parent directory of the database
+        :param output_dir: directory of the dataset
+        :param label_classes: Optional list of classes, only images containing one of them are exported
+        :returns: number of (re-)written images
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    meta_path = osp.join(output_dir, META_FILE)
+    if osp.isfile(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+    else:
+        meta = {'classes': {}, 'images': {}, 'order': [], 'image_bytes': 0, 'mask_bytes': 0}
+
+    database = SQLiteDatabase(database_path, read_only=True)
+    entries = {}
+    pending = []
+    image_end, mask_end = meta['image_bytes'], meta['mask_bytes']
+    for image_path, blob in database.iter_labels(label_classes, decode=False):
+        digest = hashlib.sha1(blob).hexdigest()
+        try:
+            mtime = os.stat(osp.join(base_path, image_path)).st_mtime_ns
+            entry = meta['images'].get(image_path)
+            if entry and entry['label_digest'] == digest and entry['image_mtime'] == mtime:
+                entries[image_path] = entry
+                continue
+            height, width = read_image_size(osp.join(base_path, image_path))
+        except OSError as err:
+            print(f"Skipping {image_path}: {err}")
+            continue
+        if entry is None or entry['shape'] != [height, width]:
+            # a new slot is necessary as the image does not fit into its old one
+            entry = {'image_offset': image_end, 'mask_offset': mask_end, 'shape': [height, width],
+                     'image_mtime': None}
+            image_end += height * width * CHANNELS
+            mask_end += height * width
+        update_image = entry['image_mtime'] != mtime
+        entry = dict(entry, label_digest=digest, image_mtime=mtime)
+        entries[image_path] = entry
+        pending.append((image_path, entry, blob, update_image))
+
+    for _file, size in [(IMAGES_FILE, image_end), (MASKS_FILE, mask_end)]:
+        with open(osp.join(output_dir, _file), 'ab') as f:
+            f.truncate(size)
+
+    if pending:
+        images = np.memmap(osp.join(output_dir, IMAGES_FILE), dtype=np.uint8, mode='r+')
+        masks = np.memmap(osp.join(output_dir, MASKS_FILE), dtype=np.uint8, mode='r+')
+        for image_path, entry, blob, update_image in pending:
+            height, width = entry['shape']
+            if update_image:
+                image = cv2.imread(osp.join(base_path, image_path), cv2.IMREAD_COLOR)
+                if image is None or image.shape[:2] != (height, width):
+                    print(f"Skipping {image_path}: the image could not be decoded")
+                    del entries[image_path]
+                    continue
+                image_slot = images[entry['image_offset']:entry['image_offset'] + height * width * CHANNELS]
+                cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=image_slot.reshape(height, width, CHANNELS))
+            mask = masks[entry['mask_offset']:entry['mask_offset'] + height * width].reshape(height, width)
+            mask.fill(BACKGROUND)
+            for _label in decode_bytes(blob, database.allow_pickle):
+                if _label['label'] not in meta['classes']:
+                    # ids are never reassigned such that they stay stable over re-exports
+                    meta['classes'][_label['label']] = len(meta['classes']) + 1
+                rasterize_shape(mask, _label, meta['classes'][_label['label']])
+        images.flush()
+        masks.flush()
+        del images, masks
+    database.close()
+
+    order = list(entries.keys())
+    index = np.zeros(len(order), dtype=INDEX_DTYPE)
+    for _idx, image_path in enumerate(order):
+        entry = entries[image_path]
+        index[_idx] = (entry['image_offset'], entry['mask_offset'], *entry['shape'])
+    np.save(osp.join(output_dir, INDEX_FILE), index)
+
+    meta.update(images=entries, order=order, image_bytes=image_end, mask_bytes=mask_end)
+    # write the meta data last and atomically, so an interrupted export is simply repeated
+    with open(meta_path + ".tmp", 'w') as f:
+        json.dump(meta, f)
+    os.replace(meta_path + ".tmp", meta_path)
+    return sum(_path in entries for _path, _, _, _ in pending)
+
+
+class MemmapDataset(object):
+    r"""Reader of a dataset written by export_dataset. Images and masks are returned as read-only views into the
+    memory-mapped files, so indexing does not copy or decode anything"""
+    def __init__(self, dataset_dir: str):
+        with open(osp.join(dataset_dir, META_FILE)) as f:
+            meta = json.load(f)
+        self.image_paths = meta['order']
+        self.classes = meta['classes']
+        self.index = np.load(osp.join(dataset_dir, INDEX_FILE))
+        self._images = self._open(osp.join(dataset_dir, IMAGES_FILE))
+        self._masks = self._open(osp.join(dataset_dir, MASKS_FILE))
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, item: int) -> Tuple[np.ndarray, np.ndarray]:
+        r"""Returns the (height, width, 3) RGB image and the (height, width) class mask of the item"""
+        image_offset, mask_offset, height, width = self.index[item].tolist()
+        image = self._images[image_offset:image_offset + height * width * CHANNELS].reshape(height, width, CHANNELS)
+        mask = self._masks[mask_offset:mask_offset + height * width].reshape(height, width)
+        return image, mask
+
+    @staticmethod
+    def _open(path: str) -> np.ndarray:
+        if osp.getsize(path) == 0:
+            return np.zeros(0, dtype=np.uint8)
+        return np.memmap(path, dtype=np.uint8, mode='r')
@@ -0,0 +1,133 @@
+import os
+from typing import Iterator, List, Tuple
+
+import cv2
+import numpy as np
+
+from seg_utils.utils.database import SQLiteDatabase
+
+HASH_SIZE = 8  # the hash consists of HASH_SIZE x HASH_SIZE bits
+DCT_SIZE = 32
+
+
+def phash(image: np.ndarray) -> int:
+    r"""Computes the 64 bit perceptual hash of an image. The image is shrunk to 32 x 32 pixels and the lowest 8 x 8
+    frequencies of its discrete cosine transform are compared against their median, so the hash is robust against
+    noise, compression and small changes in brightness
+
+        :param image: gray (height, width) or rgb (height, width, 3) image
+        :returns: hash as unsigned integer
+    """
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    small = cv2.resize(image, (DCT_SIZE, DCT_SIZE), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:HASH_SIZE, :HASH_SIZE].reshape(-1)
+    # the DC coefficient only holds the mean brightness and is left out of the median
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming_distance(hash_a: int, hash_b: int) -> int:
+    r"""Number of differing bits of two hashes"""
+    return bin(hash_a ^ hash_b).count("1")
+
+
+class BKTree:
+    r"""Burkhard-Keller tree over hashes in the Hamming metric. Every child of a node is stored under its distance to
+    the node, so a query within radius r only descends into the children with a distance in [d - r, d + r] due to
+    the triangle inequality instead of comparing against every hash"""
+    def __init__(self):
+        self._root = None  # [hash, items, {distance: child}]
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, _hash: int, item) -> None:
+        r"""Adds an item with its hash. Items with identical hashes share one node
+
+            :param int _hash: hash of the item
+            :param item: e.g. the image path
+        """
+        self._size += 1
+        if self._root is None:
+            self._root = [_hash, [item], {}]
+            return
+        node = self._root
+        while True:
+            distance = hamming_distance(_hash, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [_hash, [item], {}]
+                return
+            node = child
+
+    def query(self, _hash: int, radius: int) -> List[Tuple[int, object]]:
+        r"""Returns all items whose hash is within the Hamming radius of the hash
+
+            :param int _hash: hash to search for
+            :param int radius: maximum number of differing bits
+            :returns: List of (distance, item) sorted by distance
+        """
+        found = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(_hash, node[0])
+            if distance <= radius:
+                found.extend((distance, item) for item in node[1])
+            for child_distance, child in node[2].items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+        return sorted(found, key=lambda _found: _found[0])
+
+
+def hash_images(database: SQLiteDatabase, base_path: str, overwrite: bool = False) -> int:
+    r"""Computes the perceptual hash of the images of the database and stores it in the images table
+
+        :param database: database with the images table
+        :param str base_path: parent directory of the database
+        :param bool overwrite: hash all images again, otherwise only images without a hash are read
+        :returns: number of hashed images
+    """
+    image_paths = list(database.get_image_hashes(missing=True))
+    if overwrite:
+        image_paths += list(database.get_image_hashes())
+    hashes = []
+    for image_path in image_paths:
+        image = cv2.imread(os.path.join(base_path, image_path), cv2.IMREAD_GRAYSCALE)
+        if image is None:
+            print(f"{image_path} could not be read and is not hashed")
+            continue
+        hashes.append((image_path, phash(image)))
+    if hashes:
+        database.set_image_hashes(hashes)
+    return len(hashes)
+
+
+def build_hash_index(database: SQLiteDatabase) -> BKTree:
+    r"""Builds a BK-tree over the stored hashes of all images of the database"""
+    index = BKTree()
+    for image_path, _hash in database.get_image_hashes().items():
+        index.add(_hash, image_path)
+    return index
+
+
+def find_duplicates(database: SQLiteDatabase, radius: int = 4) -> Iterator[Tuple[str, str, int]]:
+    r"""Finds all pairs of images of the database whose hashes are within the Hamming radius. Images without a hash
+    are not considered, see hash_images
+
+        :param database: database with hashed images
+        :param int radius: maximum number of differing bits
+        :returns: Iterator over (image_path, duplicate image_path, distance) with every pair reported once
+    """
+    hashes = database.get_image_hashes()
+    index = BKTree()
+    for image_path, _hash in sorted(hashes.items()):
+        for distance, duplicate in index.query(_hash, radius):
+            yield duplicate, image_path, distance
+        index.add(_hash, image_path)
+
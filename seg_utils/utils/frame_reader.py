@@ -0,0 +1,123 @@
+import os
+from typing import Iterator, List, Optional, Tuple
+
+import ffmpeg
+import numpy as np
+
+from seg_utils.utils.database import SQLiteDatabase
+from seg_utils.utils.probe import probe_video, get_video_meta
+
+PIXEL_FORMATS = {"rgb24": 3, "gray": 1}
+
+
+def iter_frames(video_path: str,
+                frames: Optional[List[int]] = None,
+                start: int = 0,
+                stop: Optional[int] = None,
+                step: int = 1,
+                pix_fmt: str = "rgb24",
+                size: Optional[Tuple[int, int]] = None,
+                scale: Optional[Tuple[int, int]] = None,
+                copy: bool = False) -> Iterator[Tuple[int, np.ndarray]]:
+    r"""Decodes a video within one ffmpeg process and yields the selected frames as arrays, which are read as raw
+    video from a pipe without any image encoding in between. Either a list of frames or a range (start, stop, step)
+    is selected.
+
+        :param str video_path: absolute path of the video
+        :param frames: frame numbers to decode. If given, start, stop and step are ignored
+        :param int start: first frame of the range
+        :param stop: end of the range (exclusive), defaults to the end of the video
+        :param int step: stride of the range
+        :param str pix_fmt: 'rgb24' for (height, width, 3) or 'gray' for (height, width) arrays
+        :param size: (height, width) of the video, probed if not given. Note the order, which is the one of the
+            arrays and not the width, height of ffmpeg and VideoMeta. Any sequence is accepted, e.g. a list from JSON
+        :param scale: (height, width) the frames are scaled to by ffmpeg before they are piped, e.g. for analysis
+        :param bool copy: if every frame is returned as its own array. By default, the same preallocated buffer is
+            filled with every frame, so it is only valid until the next frame is requested
+        :returns: Iterator over (frame number, frame)
+    """
+    if pix_fmt not in PIXEL_FORMATS:
+        raise ValueError(f"pix_fmt needs to be one of {list(PIXEL_FORMATS)} but is {pix_fmt}")
+    if step < 1:
+        raise ValueError(f"step needs to be at least 1 but is {step}")
+    if frames is not None:
+        frame_nums = sorted(set(frames))
+        if not frame_nums:
+            return
+        select = "+".join(f"eq(n,{frame})" for frame in frame_nums)
+        vframes = len(frame_nums)
+    else:
+        frame_nums = None
+        select = f"gte(n,{start})*not(mod(n-{start},{step}))"
+        vframes = None
+        if stop is not None:
+            if stop <= start:
+                return
+            select += f"*lt(n,{stop})"
+            vframes = (stop - start - 1) // step + 1
+    if scale is not None:
+        size = scale
+    elif size is None:
+        meta = probe_video(video_path)
+        size = (meta.height, meta.width)
+    size = tuple(int(_dim) for _dim in size)
+
+    channels = PIXEL_FORMATS[pix_fmt]
+    buffer = np.empty(size + (channels,), dtype=np.uint8)
+    view = memoryview(buffer.reshape(-1))
+    output_args = {'format': 'rawvideo', 'pix_fmt': pix_fmt, 'vsync': 0}
+    if vframes is not None:
+        # stops the decoding after the last requested frame instead of the end of the video
+        output_args['vframes'] = vframes
+    stream = ffmpeg.input(video_path).filter_('select', select)
+    if scale is not None:
+        stream = stream.filter_('scale', scale[1], scale[0], flags='area')
+    process = (stream.output('pipe:', **output_args)
+               .run_async(pipe_stdout=True, quiet=True))
+    try:
+        idx = 0
+        while vframes is None or idx < vframes:
+            if not _read_into(process.stdout, view):
+                break
+            frame_num = frame_nums[idx] if frame_nums is not None else start + idx * step
+            frame = buffer if channels > 1 else buffer[..., 0]
+            yield frame_num, frame.copy() if copy else frame
+            idx += 1
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            # the generator was closed before ffmpeg finished decoding
+            process.kill()
+        process.wait()
+
+
+def iter_video_frames(database: SQLiteDatabase,
+                      base_path: str,
+                      video_path: str,
+                      frames: Optional[List[int]] = None,
+                      start: int = 0,
+                      stop: Optional[int] = None,
+                      step: int = 1,
+                      pix_fmt: str = "rgb24",
+                      copy: bool = False) -> Iterator[Tuple[int, np.ndarray]]:
+    r"""Same as iter_frames for a converted video of the database. The size of the video is taken from the
+    video_meta cache, which only probes the video if it is not cached yet
+
+        :param database: database with the video_meta tables
+        :param str base_path: parent directory of the database
+        :param str video_path: relative path of the converted video as in videos.conv_path
+    """
+    meta = get_video_meta(database, base_path, video_path)
+    return iter_frames(os.path.join(base_path, video_path), frames=frames, start=start, stop=stop, step=step,
+                       pix_fmt=pix_fmt, size=(meta.height, meta.width), copy=copy)
+
+
+def _read_into(stream, view: memoryview) -> bool:
+    r"""Fills the whole view from the stream. Returns False if the stream ended before"""
+    filled = 0
+    while filled < len(view):
+        n_bytes = stream.readinto(view[filled:])
+        if not n_bytes:
+            return False
+        filled += n_bytes
+    return True
@@ -0,0 +1,163 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from seg_utils.utils.frame_reader import iter_frames
+from seg_utils.utils.video_sampling import extract_frames
+
+ANALYSIS_SIZE = (36, 64)  # (height, width) the frames are scaled to for the signals
+HISTOGRAM_BINS = 32
+HISTOGRAM_SHIFT = 3  # maps the 256 gray values to the HISTOGRAM_BINS bins
+BATCH_SIZE = 256  # frames per vectorized computation of the signals
+
+
+def compute_signals(video_path: str,
+                    step: int = 1,
+                    analysis_size: Tuple[int, int] = ANALYSIS_SIZE,
+                    batch_size: int = BATCH_SIZE) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    r"""Decodes the video once at a low resolution and computes two signals between every analysed frame and its
+    predecessor: the motion energy as mean absolute difference of the gray values and the histogram distance as
+    half of the L1 distance of the normalized gray value histograms (0 for identical, 1 for disjoint histograms).
+    Frames are gathered in batches and every batch is processed at once
+
+        :param str video_path: absolute path of the video
+        :param int step: only every step-th frame is analysed
+        :param analysis_size: (height, width) the frames are scaled to by ffmpeg
+        :param int batch_size: number of frames per batch
+        :returns: frame numbers, motion energy and histogram distance, all of the same length. Both signals are 0 for
+            the first frame
+    """
+    height, width = analysis_size
+    # slot 0 holds the last frame of the previous batch, so the differences continue across batches
+    batch = np.empty((batch_size + 1, height, width), dtype=np.uint8)
+    frame_nums, motion, histogram_distance = [], [], []
+    filled = 0
+
+    def _process(n_frames: int, first: bool):
+        frames = batch[:n_frames + 1] if not first else batch[1:n_frames + 1]
+        diff = np.abs(frames[1:].astype(np.int16) - frames[:-1]).mean(axis=(1, 2))
+        # one bincount over all frames with the frame index as offset yields all histograms at once
+        binned = (frames.reshape(len(frames), -1) >> HISTOGRAM_SHIFT).astype(np.int64)
+        binned += np.arange(len(frames))[:, None] * HISTOGRAM_BINS
+        histograms = np.bincount(binned.ravel(), minlength=len(frames) * HISTOGRAM_BINS)
+        histograms = histograms.reshape(len(frames), HISTOGRAM_BINS) / float(height * width)
+        distance = np.abs(histograms[1:] - histograms[:-1]).sum(axis=1) / 2.0
+        if first:
+            diff, distance = np.concatenate([[0.0], diff]), np.concatenate([[0.0], distance])
+        motion.append(diff)
+        histogram_distance.append(distance)
+
+    first = True
+    for frame_num, frame in iter_frames(video_path, step=step, pix_fmt="gray", scale=analysis_size):
+        filled += 1
+        batch[filled] = frame
+        frame_nums.append(frame_num)
+        if filled == batch_size:
+            _process(filled, first)
+            first = False
+            batch[0] = batch[filled]
+            filled = 0
+    if filled:
+        _process(filled, first)
+    if not frame_nums:
+        return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0)
+    return np.asarray(frame_nums, dtype=np.int64), np.concatenate(motion), np.concatenate(histogram_distance)
+
+
+def select_frames(frame_nums: np.ndarray,
+                  motion: np.ndarray,
+                  histogram_distance: np.ndarray,
+                  budget: int,
+                  min_distance: int = 25,
+                  cut_threshold: float = 0.3,
+                  smoothing: int = 5) -> List[int]:
+    r"""Picks at most budget frames from the signals. Scene cuts (histogram distance above the threshold) are picked
+    first, ordered by their distance, followed by the local maxima of the smoothed motion energy, ordered by their
+    energy. A frame is skipped if it is closer than min_distance frames to an already picked frame
+
+        :param frame_nums: frame numbers of the analysed frames
+        :param motion: motion energy of the analysed frames
+        :param histogram_distance: histogram distance of the analysed frames
+        :param int budget: maximum number of frames
+        :param int min_distance: minimum distance in frames between two picked frames
+        :param float cut_threshold: histogram distance above which a frame is the first frame of a new scene
+        :param int smoothing: window of the moving average over the motion energy in analysed frames
+        :returns: sorted frame numbers
+    """
+    if not len(frame_nums) or budget <= 0:
+        return []
+    cuts = np.flatnonzero(histogram_distance > cut_threshold)
+    cuts = cuts[np.argsort(-histogram_distance[cuts], kind='stable')]
+
+    if smoothing > 1 and len(motion) >= smoothing:
+        energy = np.convolve(motion, np.ones(smoothing) / smoothing, mode='same')
+    else:
+        energy = motion
+    padded = np.concatenate([[-np.inf], energy, [-np.inf]])
+    peaks = np.flatnonzero((padded[1:-1] > padded[:-2]) & (padded[1:-1] >= padded[2:]))
+    peaks = peaks[np.argsort(-energy[peaks], kind='stable')]
+
+    picked = []
+    for idx in np.concatenate([cuts, peaks]).tolist():
+        frame = int(frame_nums[idx])
+        if all(abs(frame - _picked) >= min_distance for _picked in picked):
+            picked.append(frame)
+            if len(picked) == budget:
+                break
+    return sorted(picked)
+
+
+def sample_video(video_path: str,
+                 budget: int = 20,
+                 step: int = 1,
+                 min_distance: int = 25,
+                 cut_threshold: float = 0.3) -> List[int]:
+    r"""Selects up to budget frames at scene cuts and motion peaks of a video within one decoding pass
+
+        :param str video_path: absolute path of the video
+        :param int budget: maximum number of frames
+        :param int step: only every step-th frame is analysed
+        :param int min_distance: minimum distance in frames between two selected frames
+        :param float cut_threshold: histogram distance above which a frame is the first frame of a new scene
+        :returns: sorted frame numbers
+    """
+    frame_nums, motion, histogram_distance = compute_signals(video_path, step=step)
+    return select_frames(frame_nums, motion, histogram_distance, budget, min_distance=min_distance,
+                         cut_threshold=cut_threshold)
+
+
+def sample_frames(video_names: List[str],
+                  base_path: str = "/home/nico/isys/data",
+                  database_name: str = "database.db",
+                  output_folder: str = "images",
+                  budget: int = 20,
+                  step: int = 1,
+                  min_distance: int = 25,
+                  cut_threshold: float = 0.3,
+                  workers: Optional[int] = None,
+                  mode: str = "auto",
+                  dedup_radius: Optional[int] = None) -> Dict[str, List[int]]:
+    r"""Samples the frames of several converted videos automatically instead of a manual frame_dictionary. The
+    videos are analysed concurrently, every one by its own ffmpeg process, and the selected frames are extracted
+    into the images table with extract_frames
+
+        :param video_names: names of the videos within the folder converted, as the keys of frame_dictionary
+        :param int budget: maximum number of frames per video
+        :param workers: number of concurrently analysed videos, defaults to the number of cores
+        :param str mode: extraction mode, see extract_frames
+        :param dedup_radius: rejects near-duplicates, see extract_frames
+        :returns: frame dictionary of the selected frames
+    """
+    video_paths = [os.path.join(base_path, "converted", video_name if os.path.splitext(video_name)[-1]
+                                else video_name + ".mp4") for video_name in video_names]
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        selected = executor.map(lambda _path: sample_video(_path, budget=budget, step=step, min_distance=min_distance,
+                                                           cut_threshold=cut_threshold), video_paths)
+        frame_dict = dict(zip(video_names, selected))
+    for video_name, frames in frame_dict.items():
+        print(f"Selected {len(frames)} frames of {video_name}")
+    extract_frames(frame_dict, base_path=base_path, database_name=database_name, output_folder=output_folder,
+                   mode=mode, dedup_radius=dedup_radius)
+    return frame_dict
@@ -0,0 +1,130 @@
+import pathlib
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from PyQt5.QtCore import QThread, pyqtSignal
+from PyQt5.QtGui import QImage
+
+from seg_utils.utils.database import SQLiteDatabase
+
+CACHE_BUDGET = 512 * 1024 * 1024  # bytes of decoded images held by the cache
+PREFETCH_RANGE = 2  # number of images before and after the current one which are decoded in advance
+
+
+class ImageCache(QThread):
+    r"""Byte-budgeted LRU cache of decoded images and their label rows, filled by a background thread.
+    QImages (unlike QPixmaps) can be created outside of the GUI thread, so only the conversion into a pixmap is
+    left for the GUI thread. The thread reads the labels with its own read-only connection to the database"""
+    sPrefetched = pyqtSignal(str)
+
+    def __init__(self, database_path: str, basedir: pathlib.Path, budget: int = CACHE_BUDGET,
+                 prefetch_range: int = PREFETCH_RANGE, parent=None):
+        super(ImageCache, self).__init__(parent)
+        self.database_path = database_path
+        self.basedir = basedir
+        self.budget = budget
+        self.prefetch_range = prefetch_range
+        self._entries = OrderedDict()  # image_path: [QImage, label_list or None, generation of the labels]
+        self._size = 0
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._pending = []
+        self._stopped = False
+        self._generations = {}  # image_path: number of times the labels of the image have been saved
+
+    def __contains__(self, image_path: str) -> bool:
+        with self._lock:
+            return image_path in self._entries
+
+    def get(self, image_path: str) -> Tuple[QImage, Optional[list]]:
+        r"""Returns the decoded image and the label_list of an image. Images which are not cached yet are decoded
+        synchronously, the label_list is None if it is not cached"""
+        with self._lock:
+            entry = self._entries.get(image_path)
+            if entry is not None:
+                self._entries.move_to_end(image_path)
+                return entry[0], entry[1]
+        image = QImage(str(self.basedir / image_path))
+        self._put(image_path, image, None, self.generation(image_path))
+        return image, None
+
+    def generation(self, image_path: str) -> int:
+        with self._lock:
+            return self._generations.get(image_path, 0)
+
+    def setLabels(self, image_path: str, label_list: Optional[list]):
+        r"""Replaces the cached label_list of an image, e.g. after it has been saved to the database. Labels of the
+        image which are currently read by the thread are dropped. Labels set by this function are never invalidated"""
+        with self._lock:
+            self._generations[image_path] = self._generations.get(image_path, 0) + 1
+            if image_path in self._entries:
+                self._entries[image_path][1:] = [label_list, None]
+
+    def invalidateLabels(self, image_path: str):
+        r"""Drops the labels of an image which have been read by the thread before, e.g. once a save of the image
+        has been committed, as they could have been read before the commit. This covers the labels which are currently
+        read as well as the cached ones. Labels set by setLabels are kept"""
+        with self._lock:
+            generation = self._generations.get(image_path, 0) + 1
+            self._generations[image_path] = generation
+            entry = self._entries.get(image_path)
+            if entry is not None and entry[2] is not None and entry[2] < generation:
+                entry[1:] = [None, None]
+
+    def prefetch(self, image_paths: List[str], current_idx: int):
+        r"""Schedules the neighbours of the current image, closest first. Previously scheduled images which have
+        not been decoded yet are dropped
+
+            :param image_paths: all images in the order of the file list
+            :param int current_idx: index of the displayed image within image_paths
+        """
+        pending = []
+        for distance in range(1, self.prefetch_range + 1):
+            for idx in (current_idx + distance, current_idx - distance):
+                image_path = image_paths[idx % len(image_paths)]
+                if image_path not in pending:
+                    pending.append(image_path)
+        with self._condition:
+            self._pending = [_path for _path in pending if _path not in self._entries]
+            self._condition.notify()
+
+    def stop(self):
+        r"""Stops the thread after the image which is currently decoded"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self.wait()
+
+    def run(self):
+        database = SQLiteDatabase(self.database_path, read_only=True)
+        try:
+            while True:
+                with self._condition:
+                    while not self._pending and not self._stopped:
+                        self._condition.wait()
+                    if self._stopped:
+                        return
+                    image_path = self._pending.pop(0)
+                generation = self.generation(image_path)
+                image = QImage(str(self.basedir / image_path))
+                label_list = database.get_label_from_imagepath(image_path)
+                self._put(image_path, image, label_list, generation)
+                self.sPrefetched.emit(image_path)
+        finally:
+            database.close()
+
+    def _put(self, image_path: str, image: QImage, label_list: Optional[list], generation: int):
+        r"""Inserts an entry and evicts the least recently used entries until the cache is within its budget again.
+        The newest entry is always kept. An existing entry is never replaced, and the labels are dropped if the image
+        has been saved since they were read (i.e. its generation changed), as they could be outdated"""
+        with self._lock:
+            if image_path in self._entries:
+                return
+            if self._generations.get(image_path, 0) != generation:
+                label_list = None
+            self._entries[image_path] = [image, label_list, generation if label_list is not None else None]
+            self._size += image.sizeInBytes()
+            while self._size > self.budget and len(self._entries) > 1:
+                _, (evicted, _, _) = self._entries.popitem(last=False)
+                self._size -= evicted.sizeInBytes()
@@ -1,5 +1,7 @@
 import base64
 import io
+import struct
+from typing import Tuple
 
 import numpy as np
 import PIL.ExifTags
@@ -23,4 +25,19 @@ def img_data_to_arr(img_data):
 def img_b64_to_arr(img_b64):
     img_data = base64.b64decode(img_b64)
     img_arr = img_data_to_arr(img_data)
-    return img_arr
\ No newline at end of file
+    return img_arr
+
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def read_image_size(path: str) -> Tuple[int, int]:
+    """Returns (height, width) of an image without decoding its pixels. PNGs are read directly from the IHDR chunk,
+    all other formats are opened lazily with PIL which only parses the header"""
+    with open(path, 'rb') as f:
+        header = f.read(24)
+    if header[:8] == PNG_SIGNATURE and header[12:16] == b"IHDR":
+        width, height = struct.unpack(">II", header[16:24])
+        return height, width
+    with PIL.Image.open(path) as img_pil:
+        return img_pil.height, img_pil.width
@@ -1,10 +1,10 @@
 import os
-import pickle
 import sys
 import json
 import glob
 from pathlib import Path
-from database import SQLiteDatabase
+from seg_utils.utils.database import SQLiteDatabase
+from seg_utils.utils.label_encoding import encode_label_list
 
 
 def main():
@@ -17,17 +17,22 @@ def main():
 def convert_json_to_sql(image_dir: str, database_path: str):
     database = SQLiteDatabase(database_path)
     database.create_labels_table()
-    for idx, file in enumerate(sorted(glob.glob(os.path.join(image_dir, "*.json")))):
+    files = sorted(glob.glob(os.path.join(image_dir, "*.json")))
+    labels = []
+    for idx, file in enumerate(files):
         try:
             _file = open(file)
             _json = json.load(_file)
             if _json['imageData']:
                 del _json['imageData']
             label_list = [_label for _label in _json['shapes']]
-            database.add_label("images/" + _json['imagePath'], label_list)
-            print(f"Processed Label {idx+1}/{len(glob.glob(os.path.join(image_dir, '*.json')))}")
+            labels.append(("images/" + _json['imagePath'], label_list))
+            print(f"Processed Label {idx+1}/{len(files)}")
         except ValueError:
             pass
+    # one transaction for all labels instead of one per file
+    for _idx, err in database.add_labels_bulk(labels):
+        print(f"Label {labels[_idx][0]} skipped: {err}")
 
 
 def remove_label_category(database_path: str, label_dir: str, category: str):
@@ -46,7 +51,7 @@ def remove_label_category(database_path: str, label_dir: str, category: str):
             json.dump(_json, data_file)
             label_list = [_label for _label in _json['shapes']]
             filename = "images/" + os.path.basename(file).replace(".json", ".png")
-            database.update_entry("labels", "image_path", filename, "label_list", pickle.dumps(label_list))
+            database.update_entry("labels", "image_path", filename, "label_list", encode_label_list(label_list))
             print(f"Processed Label {idx + 1}/{len(glob.glob(os.path.join(label_dir, '*.json')))}")
 
 
@@ -63,7 +68,7 @@ def replaceTraceWithPolygon(database_path: str, label_dir: str):
             json.dump(_json, data_file)
             label_list = [_label for _label in _json['shapes']]
             filename = "images/" + os.path.basename(file).replace(".json", ".png")
-            database.update_entry("labels", "image_path", filename, "label_list", pickle.dumps(label_list))
+            database.update_entry("labels", "image_path", filename, "label_list", encode_label_list(label_list))
             print(f"Processed Label {idx + 1}/{len(glob.glob(os.path.join(label_dir, '*.json')))}")
 
 if __name__ == "__main__":
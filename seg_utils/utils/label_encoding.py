@@ -0,0 +1,127 @@
+import json
+import struct
+from typing import List, Tuple
+
+import numpy as np
+
+# Binary layout of an encoded label_list (all values little endian):
+#   header      MAGIC, version (uint8), padding, number of strings (uint16), number of shapes (uint32),
+#               total number of points (uint32)
+#   strings     per string a uint16 length followed by the utf-8 bytes. The table holds the label names,
+#               the shape types and the json encoded remaining keys (e.g. flags) of the shapes
+#   shapes      per shape the indices of label, shape_type and meta into the string table (uint16 each),
+#               the group_id (int32) and the number of points (uint32)
+#   padding     zeros up to the next multiple of 4 bytes
+#   points      all points of all shapes as contiguous float32 (x, y) pairs
+MAGIC = b"SEGL"
+VERSION = 1
+
+HEADER = struct.Struct("<4sBxHII")
+STRING_LENGTH = struct.Struct("<H")
+SHAPE_RECORD = np.dtype([("label", "<u2"), ("shape_type", "<u2"), ("meta", "<u2"),
+                         ("group_id", "<i4"), ("n_points", "<u4")])
+
+NO_META = 0xFFFF
+NO_GROUP_ID = np.iinfo(np.int32).min
+CORE_KEYS = ['label', 'points', 'shape_type', 'group_id']
+
+
+def is_encoded(blob: bytes) -> bool:
+    r"""Returns True if the blob is a label_list in the binary encoding of this module"""
+    return blob[:len(MAGIC)] == MAGIC
+
+
+def encode_label_list(label_list: List[dict]) -> bytes:
+    r"""Encodes a list of shape dicts (as returned by Shape.to_dict) into the versioned binary format.
+    Keys apart from label, points, shape_type and group_id are stored as json in the string table
+
+        :param label_list: list of dictionaries with at least the keys label, points and shape_type
+        :returns: encoded bytes which can be stored as BLOB
+    """
+    strings = []
+    string_index = {}
+
+    def _index(string: str) -> int:
+        if string not in string_index:
+            string_index[string] = len(strings)
+            strings.append(string)
+        return string_index[string]
+
+    records = np.zeros(len(label_list), dtype=SHAPE_RECORD)
+    points = []
+    for _idx, _label in enumerate(label_list):
+        _points = np.asarray(_label.get('points', []), dtype='<f4').reshape(-1, 2)
+        meta = {key: value for key, value in _label.items() if key not in CORE_KEYS}
+        group_id = _label.get('group_id')
+        records[_idx] = (_index(str(_label.get('label'))),
+                         _index(str(_label.get('shape_type'))),
+                         _index(json.dumps(meta, sort_keys=True)) if meta else NO_META,
+                         NO_GROUP_ID if group_id is None else group_id,
+                         len(_points))
+        points.append(_points)
+
+    if len(strings) >= NO_META:
+        raise ValueError(f"Too many distinct strings ({len(strings)}) within one label_list")
+
+    n_points = int(records['n_points'].sum())
+    parts = [HEADER.pack(MAGIC, VERSION, len(strings), len(label_list), n_points)]
+    for string in strings:
+        _bytes = string.encode('utf-8')
+        parts.append(STRING_LENGTH.pack(len(_bytes)))
+        parts.append(_bytes)
+    parts.append(records.tobytes())
+    size = sum(len(_part) for _part in parts)
+    parts.append(b"\x00" * (-size % 4))
+    if points:
+        parts.append(np.concatenate(points).tobytes())
+    return b"".join(parts)
+
+
+def decode_header(blob: bytes) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    r"""Decodes an encoded label_list into its string table, the shape records and all points
+    without creating any per-point python objects
+
+        :param blob: encoded label_list
+        :returns: string table, structured array of the shape records, (N, 2) float32 array of all points
+    """
+    magic, _version, n_strings, n_shapes, n_points = HEADER.unpack_from(blob, 0)
+    if magic != MAGIC:
+        raise ValueError("Blob is not an encoded label_list")
+    if _version != VERSION:
+        raise ValueError(f"Unsupported label_list encoding version {_version}. Supported is version {VERSION}")
+
+    offset = HEADER.size
+    strings = []
+    for _ in range(n_strings):
+        length, = STRING_LENGTH.unpack_from(blob, offset)
+        offset += STRING_LENGTH.size
+        strings.append(bytes(blob[offset:offset + length]).decode('utf-8'))
+        offset += length
+
+    records = np.frombuffer(blob, dtype=SHAPE_RECORD, count=n_shapes, offset=offset)
+    offset += records.nbytes
+    offset += -offset % 4
+    points = np.frombuffer(blob, dtype='<f4', count=2 * n_points, offset=offset).reshape(-1, 2)
+    return strings, records, points
+
+
+def decode_label_list(blob: bytes) -> List[dict]:
+    r"""Decodes an encoded label_list back into a list of shape dicts. The points of every shape are returned as
+    read-only (N, 2) float32 views into the blob
+
+        :param blob: encoded label_list
+        :returns: list of dictionaries with the keys label, points, shape_type, group_id and the stored meta keys
+    """
+    strings, records, points = decode_header(blob)
+    ends = np.cumsum(records['n_points'], dtype=np.int64)
+    label_list = []
+    for _record, _end in zip(records.tolist(), ends.tolist()):
+        label_idx, type_idx, meta_idx, group_id, n_points = _record
+        _label = {'label': strings[label_idx],
+                  'points': points[_end - n_points:_end],
+                  'shape_type': strings[type_idx],
+                  'group_id': None if group_id == NO_GROUP_ID else group_id}
+        if meta_idx != NO_META:
+            _label.update(json.loads(strings[meta_idx]))
+        label_list.append(_label)
+    return label_list
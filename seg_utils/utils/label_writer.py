@@ -0,0 +1,95 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from seg_utils.utils.database import SQLiteDatabase
+
+BATCH_DELAY = 0.25  # seconds the thread waits after the first queued save for further saves of the same batch
+
+
+class LabelWriter(QThread):
+    r"""Background thread which writes the saved labels into the database, so the GUI thread never waits on disk I/O.
+    Saves are queued per image, a save replaces a queued but not yet written save of the same image, and all queued
+    saves are written within one transaction. The thread writes with its own connection to the database"""
+    sSaved = pyqtSignal(list)  # image paths of a committed batch
+    sFailed = pyqtSignal(str, str)  # image path, error message
+
+    def __init__(self, database_path: str, batch_delay: float = BATCH_DELAY, parent=None):
+        super(LabelWriter, self).__init__(parent)
+        self.database_path = database_path
+        self.batch_delay = batch_delay
+        self._queued = OrderedDict()  # image_path: label_class_dict
+        self._writing = {}  # the batch which is currently written
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._stopped = False
+        self._flushing = 0  # number of threads waiting in flush
+
+    def save(self, image_path: str, label_class_dict: dict):
+        r"""Queues a save as accepted by SQLiteDatabase.update_label. Returns immediately"""
+        with self._condition:
+            self._queued.pop(image_path, None)
+            self._queued[image_path] = label_class_dict
+            self._condition.notify_all()
+
+    def pending(self, image_path: str) -> Optional[dict]:
+        r"""Returns the label_class_dict of an image which is queued or currently written, None otherwise. The
+        database does not contain this state yet, so it has to be preferred when the labels are read"""
+        with self._lock:
+            if image_path in self._queued:
+                return self._queued[image_path]
+            return self._writing.get(image_path)
+
+    def flush(self):
+        r"""Blocks until every queued save has been written"""
+        with self._condition:
+            self._flushing += 1
+            self._condition.notify_all()
+            try:
+                while (self._queued or self._writing) and self.isRunning():
+                    self._condition.wait()
+            finally:
+                self._flushing -= 1
+
+    def stop(self):
+        r"""Writes all queued saves and stops the thread"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        self.wait()
+
+    def run(self):
+        database = SQLiteDatabase(self.database_path)
+        try:
+            while True:
+                with self._condition:
+                    while not self._queued and not self._stopped:
+                        self._condition.wait()
+                    if not self._queued:
+                        return
+                    # collects further saves, but a flush or stop does not wait for them
+                    deadline = time.monotonic() + self.batch_delay
+                    while not self._stopped and not self._flushing:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._condition.wait(remaining)
+                    self._writing = dict(self._queued)
+                    self._queued.clear()
+                failed = dict(database.update_labels_batch(list(self._writing.items())))
+                saved = [_path for _path in self._writing if _path not in failed]
+                # the signals are emitted before the batch is released, so they have been posted once flush returns
+                if saved:
+                    self.sSaved.emit(saved)
+                for image_path, error in failed.items():
+                    self.sFailed.emit(image_path, error)
+                with self._condition:
+                    self._writing = {}
+                    self._condition.notify_all()
+        finally:
+            database.close()
+            with self._condition:
+                self._condition.notify_all()
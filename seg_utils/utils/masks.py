@@ -1,9 +1,15 @@
-from typing import List, Tuple
+from typing import List, Tuple, Optional, Iterator, Dict
+from concurrent.futures import ProcessPoolExecutor
 import cv2
+import json
 import numpy as np
+import os
 import os.path as osp
 from PIL import Image
 
+from seg_utils.utils.images import read_image_size
+from seg_utils.utils.database import SQLiteDatabase
+
 
 import matplotlib.pyplot as plt
 
@@ -52,3 +58,212 @@ def get_image_size(base_path: str, image_path: str) -> List[int]:
     image = Image.open(path)
     return [image.width, image.height]
 
+
+
+def rasterize_shape(out: np.ndarray, label: dict, value: int = 1) -> np.ndarray:
+    r"""Rasterizes one shape into the preallocated 2D uint8 buffer out without allocating a new mask
+
+        :param out: (height, width) uint8 buffer which is drawn into
+        :param label: dict with the keys points and shape_type
+        :param value: value written into the pixels of the shape
+        :returns: the buffer out
+    """
+    points = np.asarray(label.get('points', []), dtype=np.float32).reshape(-1, 2)
+    if not len(points):
+        return out
+    if label['shape_type'] in ['circle', 'rectangle']:
+        # both are stored by the points of their bounding rectangle
+        top_left = np.rint(points.min(axis=0)).astype(np.int32)
+        bottom_right = np.rint(points.max(axis=0)).astype(np.int32)
+        if label['shape_type'] == 'circle':
+            center = (top_left + bottom_right) // 2
+            axes = (bottom_right - top_left) // 2
+            cv2.ellipse(out, tuple(center.tolist()), tuple(axes.tolist()), 0, 0, 360, value, -1)
+        else:
+            cv2.rectangle(out, tuple(top_left.tolist()), tuple(bottom_right.tolist()), value, -1)
+    else:
+        cv2.fillPoly(out, [np.rint(points).astype(np.int32)], value)
+    return out
+
+
+def rasterize_instances(label_list: List[dict], out: np.ndarray) -> np.ndarray:
+    r"""Rasterizes all shapes of one image into a preallocated uint8 instance map. The pixels of the i-th shape have
+    the value i + 1 and 0 is background. Later shapes overwrite earlier ones where they overlap
+
+        :param label_list: list of shape dicts of one image
+        :param out: (height, width) uint8 buffer which is reset and drawn into
+        :returns: the buffer out
+    """
+    if len(label_list) > np.iinfo(np.uint8).max:
+        raise ValueError(f"An uint8 instance map holds at most 255 instances but there are {len(label_list)}")
+    out.fill(0)
+    for _idx, _label in enumerate(label_list):
+        rasterize_shape(out, _label, _idx + 1)
+    return out
+
+
+def rasterize_bitpacked(label_list: List[dict], image_size: Tuple[int, int], scratch: np.ndarray) -> np.ndarray:
+    r"""Rasterizes every shape of one image into its own binary mask and packs the masks bitwise along the
+    width, so overlapping shapes are preserved at 1/8 of the memory of a uint8 stack
+
+        :param label_list: list of shape dicts of one image
+        :param image_size: (height, width) of the image
+        :param scratch: (height, width) uint8 buffer which is reused for every shape
+        :returns: (number of shapes, height, ceil(width / 8)) uint8 array, unpack with np.unpackbits(axis=-1)
+    """
+    height, width = image_size
+    packed = np.empty((len(label_list), height, (width + 7) // 8), dtype=np.uint8)
+    for _idx, _label in enumerate(label_list):
+        scratch.fill(0)
+        rasterize_shape(scratch, _label)
+        packed[_idx] = np.packbits(scratch, axis=-1)
+    return packed
+
+
+def iter_masks(database, base_path: str, label_classes: Optional[List[str]] = None, mode: str = "instance",
+               reuse_buffer: bool = True) -> Iterator[Tuple[str, np.ndarray, List[str]]]:
+    r"""Generator over the masks of all labeled images of a database. Only the masks of one image are in memory at a
+    time, so the memory consumption is independent of the number of images.
+
+        :param database: SQLiteDatabase to read the labels from
+        :param base_path: parent directory of the database
+        :param label_classes: Optional list of classes, only images containing one of them are exported
+        :param mode: 'instance' for uint8 instance maps (see rasterize_instances) or 'bitpacked'
+            for bit-packed binary stacks (see rasterize_bitpacked)
+        :param reuse_buffer: in instance mode, the same buffer is yielded for all images of the same size.
+            Copy the mask if it is kept beyond the next iteration or set this to False
+        :returns: Iterator of (image_path, mask, class name of every instance)
+    """
+    if mode not in ["instance", "bitpacked"]:
+        raise ValueError(f"mode needs to be either 'instance' or 'bitpacked' but is {mode}")
+    image_sizes = database.get_image_sizes()
+    buffer = np.zeros((0, 0), dtype=np.uint8)
+    for image_path, label_list in database.iter_labels(label_classes):
+        if image_path in image_sizes:
+            image_size = image_sizes[image_path]
+        else:
+            image_size = read_image_size(osp.join(base_path, image_path))
+        if buffer.shape != image_size or not reuse_buffer:
+            buffer = np.zeros(image_size, dtype=np.uint8)
+        classes = [_label['label'] for _label in label_list]
+        if mode == "instance":
+            yield image_path, rasterize_instances(label_list, buffer), classes
+        else:
+            yield image_path, rasterize_bitpacked(label_list, image_size, buffer), classes
+
+
+def export_masks(database, base_path: str, output_dir: str, label_classes: Optional[List[str]] = None,
+                 mode: str = "instance", chunk_size: int = 256) -> str:
+    r"""Streams the masks of all labeled images into chunked files on disk. Every chunk is a compressed .npz file
+    holding the masks of at most chunk_size images, such that only one chunk is in memory at a time. An index.json
+    maps every image onto its chunk file, its key within the chunk and the class names of its instances
+
+        :param database: SQLiteDatabase to read the labels from
+        :param base_path: parent directory of the database
+        :param output_dir: directory the chunks and the index are written to
+        :param label_classes: Optional list of classes, only images containing one of them are exported
+        :param mode: 'instance' or 'bitpacked', see iter_masks
+        :param chunk_size: maximum number of images per chunk file
+        :returns: path of the index file
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    index = {'mode': mode, 'images': {}}
+    chunk, chunk_idx = {}, 0
+    for image_path, mask, classes in iter_masks(database, base_path, label_classes, mode, reuse_buffer=False):
+        key = f"mask_{len(index['images']):07d}"
+        chunk[key] = mask
+        index['images'][image_path] = {'chunk': f"masks_{chunk_idx:05d}.npz", 'key': key, 'classes': classes}
+        if len(chunk) == chunk_size:
+            np.savez_compressed(osp.join(output_dir, f"masks_{chunk_idx:05d}.npz"), **chunk)
+            chunk, chunk_idx = {}, chunk_idx + 1
+    if chunk:
+        np.savez_compressed(osp.join(output_dir, f"masks_{chunk_idx:05d}.npz"), **chunk)
+
+    index_path = osp.join(output_dir, "index.json")
+    with open(index_path, 'w') as f:
+        json.dump(index, f)
+    return index_path
+
+
+def export_masks_parallel(database_path: str, base_path: str, output_path: str,
+                          label_classes: Optional[List[str]] = None, workers: Optional[int] = None,
+                          tasks_per_worker: int = 4) -> str:
+    r"""Rasterizes the uint8 instance maps of all labeled images with a pool of processes. All maps are written into
+    one memory-mapped file, where every worker writes its images directly into their slots, so no mask is pickled
+    back to the parent process. Each worker opens the database read-only. An index file <output_path>.json
+    holds the offset, shape and instance classes of every image, i.e. image k is
+    np.memmap(output_path, np.uint8, 'r', offset, height * width).reshape(height, width)
+    Images which cannot be rasterized (e.g. more than 255 instances) are reported and left out of the index, their
+    slot stays empty
+
+        :param database_path: path to the database
+        :param base_path: parent directory of the database
+        :param output_path: path of the memory-mapped output file
+        :param label_classes: Optional list of classes, only images containing one of them are exported
+        :param workers: number of processes, defaults to the number of cores
+        :param tasks_per_worker: number of partitions per worker, more partitions balance uneven images better
+        :returns: path of the index file
+    """
+    database = SQLiteDatabase(database_path, read_only=True)
+    image_sizes = database.get_image_sizes()
+    images = []
+    offset = 0
+    for image_path in database.get_labeled_image_paths(label_classes):
+        if image_path in image_sizes:
+            height, width = image_sizes[image_path]
+        else:
+            height, width = read_image_size(osp.join(base_path, image_path))
+        images.append({'image_path': image_path, 'offset': offset, 'shape': [height, width]})
+        offset += height * width
+    database.close()
+
+    # preallocate the output such that the workers only have to fill it
+    with open(output_path, 'wb') as f:
+        f.truncate(offset)
+
+    workers = workers or os.cpu_count()
+    n_tasks = max(1, min(len(images), workers * tasks_per_worker))
+    partitions = [images[_idx::n_tasks] for _idx in range(n_tasks)]
+    classes, failed = {}, {}
+    if images:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for result, errors in executor.map(_rasterize_partition, [database_path] * n_tasks,
+                                               [output_path] * n_tasks, partitions):
+                classes.update(result)
+                failed.update(errors)
+
+    for image_path, error in failed.items():
+        print(f"Skipping {image_path}: {error}")
+    images = [_image for _image in images if _image['image_path'] not in failed]
+    for _image in images:
+        _image['classes'] = classes[_image['image_path']]
+    index_path = output_path + ".json"
+    with open(index_path, 'w') as f:
+        json.dump({'mode': 'instance', 'images': images}, f)
+    return index_path
+
+
+def _rasterize_partition(database_path: str, output_path: str,
+                         images: List[dict]) -> Tuple[Dict[str, List[str]], Dict[str, str]]:
+    r"""Worker of export_masks_parallel which rasterizes one partition of images into the memory-mapped output
+
+        :returns: the class names of the instances per image and the error message per image which failed
+    """
+    database = SQLiteDatabase(database_path, read_only=True)
+    output = np.memmap(output_path, dtype=np.uint8, mode='r+')
+    classes, failed = {}, {}
+    for _image in images:
+        label_list = database.get_label_from_imagepath(_image['image_path'])
+        height, width = _image['shape']
+        out = output[_image['offset']:_image['offset'] + height * width].reshape(height, width)
+        try:
+            rasterize_instances(label_list, out)
+        except ValueError as err:
+            # a failing image must not abort the whole pool
+            failed[_image['image_path']] = str(err)
+            continue
+        classes[_image['image_path']] = [_label['label'] for _label in label_list]
+    output.flush()
+    del output
+    database.close()
+    return classes, failed
@@ -0,0 +1,85 @@
+import json
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from seg_utils.utils.database import SQLiteDatabase
+
+
+class VideoMeta(NamedTuple):
+    r"""Everything known about a video after one probe"""
+    duration: float  # in s
+    fps: float
+    num_frames: int
+    width: int
+    height: int
+    codec: str
+    keyframes: List[Tuple[int, float]]  # (frame number, presentation time in s)
+
+
+def probe_video(video_path: str) -> VideoMeta:
+    r"""Probes a video with one single ffprobe call, which reads the container, the video stream and the packets
+    but does not decode any frame
+
+        :param str video_path: absolute path of the video
+        :returns: meta data of the video
+    """
+    output = subprocess.check_output(["ffprobe", "-v", "error", "-select_streams", "v:0",
+                                      "-show_entries", "format=duration:stream=codec_name,width,height,r_frame_rate:"
+                                                       "packet=pts_time,flags",
+                                      "-of", "json", video_path])
+    probe = json.loads(output)
+    stream = probe['streams'][0]
+    numerator, _, denominator = stream['r_frame_rate'].partition("/")
+    fps = float(numerator) / float(denominator or 1)
+
+    packets = sorted((float(_packet['pts_time']), 'K' in _packet.get('flags', ''))
+                     for _packet in probe.get('packets', []) if 'pts_time' in _packet)
+    # packets are stored in decoding order, the frame number is the position in presentation order
+    keyframes = [(frame, pts_time) for frame, (pts_time, is_key) in enumerate(packets) if is_key]
+    return VideoMeta(duration=float(probe['format']['duration']), fps=fps, num_frames=len(packets),
+                     width=int(stream['width']), height=int(stream['height']), codec=stream['codec_name'],
+                     keyframes=keyframes)
+
+
+def probe_videos(database: SQLiteDatabase, base_path: str, video_paths: List[str],
+                 workers: Optional[int] = None) -> Dict[str, VideoMeta]:
+    r"""Returns the meta data of all videos. Videos whose size and modification time match the video_meta table
+    are taken from there, all others are probed concurrently by a pool of threads and stored in the table
+
+        :param database: database with the video_meta tables, which are created if they do not exist yet
+        :param str base_path: parent directory of the database
+        :param video_paths: paths of the videos relative to the base path
+        :param workers: number of concurrent probes, defaults to the number of cores
+        :returns: meta data of every video
+    """
+    if not database.has_video_meta_tables:
+        # only the first probe of a database creates the tables, cache hits never write
+        database.create_video_meta_tables()
+    stats = {}
+    for video_path in video_paths:
+        stat = os.stat(os.path.join(base_path, video_path))
+        stats[video_path] = (stat.st_size, stat.st_mtime_ns)
+    metas = {}
+    for video_path, meta in database.get_video_metas(stats).items():
+        metas[video_path] = VideoMeta(*meta)
+
+    missing = [video_path for video_path in video_paths if video_path not in metas]
+    if missing:
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+            probed = dict(zip(missing, executor.map(probe_video, [os.path.join(base_path, _path)
+                                                                  for _path in missing])))
+        database.set_video_metas([(video_path, *stats[video_path], *meta) for video_path, meta in probed.items()])
+        metas.update(probed)
+    return metas
+
+
+def get_video_meta(database: SQLiteDatabase, base_path: str, video_path: str) -> VideoMeta:
+    r"""Returns the meta data of one video, probing it only if it is not cached or has changed since
+
+        :param database: database with the video_meta tables
+        :param str base_path: parent directory of the database
+        :param str video_path: path of the video relative to the base path
+    """
+    return probe_videos(database, base_path, [video_path], workers=1)[video_path]
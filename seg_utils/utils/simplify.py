@@ -0,0 +1,125 @@
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from seg_utils.utils.database import SQLiteDatabase, BULK_CHUNK_SIZE
+
+TOLERANCE = 1.0  # maximum deviation in image pixels of a simplified polyline from the original one
+MIN_POLYGON_POINTS = 3  # polygons are never simplified below this number of points
+
+
+def radial_distance(points: np.ndarray, tolerance: float = TOLERANCE) -> np.ndarray:
+    r"""Drops every point which is closer than the tolerance to the last kept point. The first and the last point
+    are always kept. This is the cheap pre-filter applied while a trace is drawn
+
+        :param points: (N, 2) array of points
+        :param float tolerance: minimum distance between two consecutive kept points
+        :returns: (M, 2) array of the kept points
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if len(points) < 3:
+        return points
+    keep = [0]
+    last = points[0]
+    for idx in range(1, len(points) - 1):
+        if np.hypot(*(points[idx] - last)) >= tolerance:
+            keep.append(idx)
+            last = points[idx]
+    keep.append(len(points) - 1)
+    return points[keep]
+
+
+def douglas_peucker(points: np.ndarray, tolerance: float = TOLERANCE) -> np.ndarray:
+    r"""Simplifies a polyline with the Douglas-Peucker algorithm, such that no removed point is further away than
+    the tolerance from the simplified polyline. Uses an explicit stack instead of recursion, so long traces cannot
+    exceed the recursion limit, and computes the distances of all points of a segment at once
+
+        :param points: (N, 2) array of points
+        :param float tolerance: maximum distance of a removed point to the simplified polyline
+        :returns: (M, 2) array of the kept points in their original order
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if len(points) < 3:
+        return points
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, stop = stack.pop()
+        if stop - start < 2:
+            continue
+        segment = points[stop] - points[start]
+        offsets = points[start + 1:stop] - points[start]
+        length = np.hypot(*segment)
+        if length > 0:
+            # perpendicular distance to the line through start and stop
+            distances = np.abs(segment[0] * offsets[:, 1] - segment[1] * offsets[:, 0]) / length
+        else:
+            # closed polylines start and stop at the same point
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            idx = start + 1 + farthest
+            keep[idx] = True
+            stack.append((start, idx))
+            stack.append((idx, stop))
+    return points[keep]
+
+
+def simplify_polyline(points: np.ndarray, tolerance: float = TOLERANCE) -> np.ndarray:
+    r"""Applies the radial distance filter followed by Douglas-Peucker. If less than MIN_POLYGON_POINTS would remain,
+    the points are returned unchanged"""
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    simplified = douglas_peucker(radial_distance(points, tolerance), tolerance)
+    return simplified if len(simplified) >= MIN_POLYGON_POINTS else points
+
+
+def simplify_label_list(label_list: List[dict], tolerance: float = TOLERANCE) -> Tuple[List[dict], int, int]:
+    r"""Simplifies the points of all polygons within a label_list. Other shape types are left as they are
+
+        :returns: simplified label_list, number of points before and after
+    """
+    before, after = 0, 0
+    simplified = []
+    for _label in label_list:
+        original = _label.get('points')
+        if _label.get('shape_type') == 'polygon' and original is not None and len(original):
+            points = simplify_polyline(original, tolerance)
+            before += len(original)
+            after += len(points)
+            # decoded label_lists hold arrays, pickled ones lists
+            points = points.astype(original.dtype) if isinstance(original, np.ndarray) else points.tolist()
+            _label = dict(_label, points=points)
+        simplified.append(_label)
+    return simplified, before, after
+
+
+def simplify_database(database_path: str,
+                      tolerance: float = TOLERANCE,
+                      label_classes: Optional[List[str]] = None,
+                      chunk_size: int = BULK_CHUNK_SIZE) -> float:
+    r"""Simplifies the polygons of all stored labels (or all labels containing one of the classes) and writes the
+    altered label_lists back within one transaction
+
+        :param str database_path: path to the database
+        :param float tolerance: maximum deviation in image pixels
+        :param label_classes: Optional list of classes, e.g. [tumour, cauterized]
+        :param int chunk_size: number of rows decoded and written at once
+        :returns: ratio of removed polygon points
+    """
+    database = SQLiteDatabase(database_path)
+    before, after = 0, 0
+    updates = []
+    for image_path, label_list in database.iter_labels(label_classes, batch_size=chunk_size):
+        if not label_list:
+            continue
+        simplified, n_before, n_after = simplify_label_list(label_list, tolerance)
+        before += n_before
+        after += n_after
+        if n_after < n_before:
+            updates.append((image_path, simplified))
+    database.update_label_lists(updates, chunk_size)
+    database.close()
+    reduction = 1.0 - after / before if before else 0.0
+    print(f"Simplified {len(updates)} labels from {before} to {after} polygon points ({reduction:.1%} removed)")
+    return reduction
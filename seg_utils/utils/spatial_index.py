@@ -0,0 +1,114 @@
+import math
+from collections import defaultdict
+from typing import List, Tuple
+
+import numpy as np
+
+CELL_SIZE = 64.0  # edge length of a grid cell in image pixels
+
+
+def _cell_key(cell_x, cell_y):
+    r"""Combines the cell coordinates into one integer key. Works for scalars and numpy arrays"""
+    return cell_x * (1 << 32) + cell_y
+
+
+class SpatialIndex(object):
+    r"""Uniform grid over the shapes of one image for hit-testing. Every grid cell lists the shapes whose bounding
+    box touches it, and the vertices of every shape are kept sorted by their cell key, so the vertices within a cell
+    are found by a binary search. A query therefore only looks at the shapes and vertices close to the point.
+
+    The index is kept up to date by sync, which only re-indexes the shapes that have changed since the last call,
+    detected by the revision counter of their vertices"""
+    def __init__(self, cell_size: float = CELL_SIZE):
+        self.cell_size = cell_size
+        self._grid = defaultdict(set)  # cell key: indices of the shapes whose bounding box touches the cell
+        self._entries = []  # per shape: [shape, revision, bounding box, bounding box cells, sorted keys, order]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        self._grid.clear()
+        self._entries = []
+
+    def sync(self, shapes: list):
+        r"""Re-indexes all shapes which are new or have been altered since the last call
+
+            :param shapes: current shapes, identified by their index within the list
+        """
+        for idx, shape in enumerate(shapes):
+            if idx < len(self._entries):
+                entry = self._entries[idx]
+                if entry[0] is shape and entry[1] == shape.vertices.revision:
+                    continue
+                self._unindex(idx)
+            else:
+                self._entries.append(None)
+            self._index(idx, shape)
+        for idx in range(len(shapes), len(self._entries)):
+            self._unindex(idx)
+        del self._entries[len(shapes):]
+
+    def shapesAt(self, x: float, y: float) -> List[int]:
+        r"""Returns the sorted indices of all shapes whose bounding box contains the point"""
+        key = _cell_key(math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+        shapes = []
+        for idx in self._grid.get(key, ()):
+            x0, y0, x1, y1 = self._entries[idx][2]
+            if x0 <= x <= x1 and y0 <= y <= y1:
+                shapes.append(idx)
+        return sorted(shapes)
+
+    def closestVertices(self, x: float, y: float, radius: float) -> List[Tuple[int, int, float]]:
+        r"""Returns the closest vertex of every shape which has at least one vertex within the radius of the point
+
+            :returns: List of (shape index, vertex index, distance) sorted by the shape index
+        """
+        cell_x, cell_y = math.floor(x / self.cell_size), math.floor(y / self.cell_size)
+        reach = math.ceil(radius / self.cell_size)
+        cells = [(cell_x + _dx, cell_y + _dy) for _dx in range(-reach, reach + 1) for _dy in range(-reach, reach + 1)]
+        candidates = set()
+        for _cell in cells:
+            candidates.update(self._grid.get(_cell_key(*_cell), ()))
+
+        point = np.asarray([x, y])
+        found = []
+        for idx in sorted(candidates):
+            shape, _, _, _, keys, order = self._entries[idx]
+            vertex_idx = []
+            for _cell in cells:
+                key = _cell_key(*_cell)
+                start, stop = np.searchsorted(keys, [key, key + 1])
+                if stop > start:
+                    vertex_idx.append(order[start:stop])
+            if not vertex_idx:
+                continue
+            vertex_idx = np.concatenate(vertex_idx)
+            distances = np.hypot(*(shape.vertices.asArray()[vertex_idx] - point).T)
+            closest = int(np.argmin(distances))
+            if distances[closest] <= radius:
+                found.append((idx, int(vertex_idx[closest]), float(distances[closest])))
+        return found
+
+    def _index(self, idx: int, shape):
+        vertices = shape.vertices.asArray()
+        if len(vertices):
+            cells = np.floor(vertices / self.cell_size).astype(np.int64)
+            keys = _cell_key(cells[:, 0], cells[:, 1])
+            order = np.argsort(keys, kind='stable')
+            bbox = (*vertices.min(axis=0).tolist(), *vertices.max(axis=0).tolist())
+            (cell_x0, cell_y0), (cell_x1, cell_y1) = cells.min(axis=0).tolist(), cells.max(axis=0).tolist()
+            bbox_cells = [_cell_key(_x, _y) for _x in range(cell_x0, cell_x1 + 1) for _y in range(cell_y0, cell_y1 + 1)]
+        else:
+            keys, order = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+            bbox, bbox_cells = (math.inf, math.inf, -math.inf, -math.inf), []
+        for _key in bbox_cells:
+            self._grid[_key].add(idx)
+        self._entries[idx] = [shape, shape.vertices.revision, bbox, bbox_cells, keys[order], order]
+
+    def _unindex(self, idx: int):
+        for _key in self._entries[idx][3]:
+            cell = self._grid[_key]
+            cell.discard(idx)
+            if not cell:
+                del self._grid[_key]
@@ -1,53 +1,93 @@
 import os
-from database import SQLiteDatabase
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Optional
+from seg_utils.utils.database import SQLiteDatabase
 import ffmpeg
-from seg_utils.utils.video_sampling import get_duration
+from seg_utils.utils.probe import probe_videos
+
+VIDEO_EXTENSIONS = [".mpg", ".mp4"]
 
 
 def mpg_to_mp4(base_dir: str = "/home/nico/isys/data",
                source_dir: str = "/home/nico/isys/data/source",
                output_folder: str = "converted",
                database_name: str = "database.db",
-               quiet: bool = False):
-    """ Convert videos in mpg format to mp4
+               quiet: bool = False,
+               workers: Optional[int] = None):
+    """ Convert videos in mpg format to mp4. First, the whole source tree is scanned and every new video gets its
+    output name within one transaction. Afterwards, all videos which are not converted yet (including the ones of
+    an interrupted or failed previous run) are converted by a bounded pool of concurrent ffmpeg processes.
+    Every video is marked as done as soon as its conversion is finished, so an interrupted run resumes after the
+    last finished video. The converted videos are probed concurrently afterwards, which fills the video_meta cache
+    and the durations. The progress is stored per video in the conversions table of the database.
 
         :param str base_dir: filepath of the base folder where everything starts from
         :param str source_dir: source directory name
         :param str output_folder: folder name of the output folder in the base dir
         :param str database_name: name of the database file with extension
-        :param bool quiet: if the frame contains a tumour
+        :param bool quiet: if the output of ffmpeg is suppressed
+        :param workers: number of concurrent ffmpeg processes, defaults to the number of cores
         """
     db = SQLiteDatabase(os.path.join(base_dir, database_name))
     db.create_videos_table()
-    for element in sorted(os.listdir(source_dir)):
-        counter = db.get_num_entries("videos")  # call here necessary for the recursion
-        elem_path = os.path.join(source_dir, element)
-        if os.path.isfile(elem_path):
-            # check if it is not already included
-            extensions = [".mpg", ".mp4"]
-            if any(ext == os.path.splitext(element)[1] for ext in extensions):
-                # string format for at least 9999 videos
-                conv_filename = f"{output_folder}/video{counter+1:04d}.mp4"
-                origin = source_dir.replace(base_dir+'/', '') + f"/{element}"
-
-                # this is only a dummy value as conversion influences with durations due to adding and deleting frames
-                duration = 1
-                out_file = os.path.join(base_dir, conv_filename)
-                # checks if video exists already so it returns False if it does since the add didnt work
-                # prevents overwrite
-                if db.add_video(origin, conv_filename, duration):
-                    ffmpeg.input(elem_path).output(out_file).run(quiet=quiet)
-                    # conversion to mp4 from mpg changes some frame timings. As i only reside on the mp4 versions,
-                    # i need to update the value again in the database
-                    db.update_entry('videos', "origin", origin, "duration", get_duration(out_file) * 1000.0)
-
-            else:
-                continue
-
-        elif os.path.isdir(elem_path):
-            mpg_to_mp4(source_dir=elem_path)
-        else:
-            pass
+    db.create_conversions_table()
+    os.makedirs(os.path.join(base_dir, output_folder), exist_ok=True)
+
+    scheduled = db.schedule_conversions(find_videos(base_dir, source_dir), output_folder)
+    print(f"Scheduled {len(scheduled)} new videos")
+
+    jobs = db.get_unfinished_conversions()
+    converted = []
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = {executor.submit(convert_video, os.path.join(base_dir, origin), os.path.join(base_dir, conv),
+                                   quiet): conv
+                   for origin, conv in jobs}
+        for idx, future in enumerate(as_completed(futures)):
+            conv = futures[future]
+            try:
+                future.result()
+                db.set_conversion_status(conv, "done")
+                converted.append(conv)
+                print(f"Converted {idx + 1}/{len(jobs)}: {conv}")
+            except (ffmpeg.Error, OSError) as err:
+                stderr = getattr(err, 'stderr', None)
+                db.set_conversion_status(conv, "failed", error=stderr.decode(errors='ignore') if stderr else str(err))
+                print(f"Failed {idx + 1}/{len(jobs)}: {conv}")
+
+    # conversion to mp4 from mpg changes some frame timings. As i only reside on the mp4 versions,
+    # i need to update the value again in the database
+    try:
+        metas = probe_videos(db, base_dir, converted, workers)
+    except (subprocess.CalledProcessError, OSError, ValueError) as err:
+        print(err)
+        return
+    for conv, meta in metas.items():
+        db.set_conversion_status(conv, "done", duration=meta.duration * 1000.0)
+
+
+def find_videos(base_dir: str, source_dir: str) -> List[str]:
+    """ Walks the source tree and returns the paths of all videos relative to the base dir in sorted order """
+    videos = []
+    for root, dirs, files in os.walk(source_dir):
+        dirs.sort()
+        for element in sorted(files):
+            if os.path.splitext(element)[1] in VIDEO_EXTENSIONS:
+                videos.append(os.path.relpath(os.path.join(root, element), base_dir))
+    return videos
+
+
+def convert_video(source: str, destination: str, quiet: bool = False):
+    """ Converts one video. The output is written to a temporary file first and only moved to the destination
+    once it is complete, so an interrupted conversion never leaves a truncated video behind
+
+        :param str source: absolute path of the source video
+        :param str destination: absolute path of the converted video
+        :param bool quiet: if the output of ffmpeg is suppressed. The error output is always captured
+        """
+    partial = destination + ".part.mp4"
+    ffmpeg.input(source).output(partial).overwrite_output().run(capture_stdout=quiet, capture_stderr=True)
+    os.replace(partial, destination)
 
 
 if __name__ == "__main__":
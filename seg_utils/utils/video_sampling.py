@@ -1,8 +1,20 @@
-from typing import List
+from typing import List, Optional, Tuple
+from bisect import bisect_right
 import ffmpeg
 import os
-from database import SQLiteDatabase, ImageSample
-import subprocess
+import re
+import shutil
+import tempfile
+from seg_utils.utils.database import SQLiteDatabase
+from seg_utils.utils.probe import probe_video, probe_videos, get_video_meta
+from seg_utils.utils.frame_reader import iter_video_frames
+from seg_utils.utils.dedup import BKTree, phash, hash_images, build_hash_index
+import cv2
+
+EXTRACTION_MODES = ["auto", "single_pass", "seek", "per_frame"]
+# estimated cost of starting one ffmpeg process and seeking, expressed in decoded frames
+SEEK_OVERHEAD_FRAMES = 50
+
 
 def get_frame(fps: int,
               h: int,
@@ -28,18 +40,35 @@ def get_frame(fps: int,
 def extract_frames(frame_dict: dict,
                    base_path: str = "/home/nico/isys/data",
                    database_name: str = "database.db",
-                   output_folder: str = "images"):
+                   output_folder: str = "images",
+                   mode: str = "auto",
+                   dedup_radius: Optional[int] = None):
     """ Convert a list of frames of one video to the respective images
 
         :param List frame_dict: dictionary containing video name as key and the list of frames as values
         :param str database_name: name of the SQLite database file
         :param str base_path: path to the base folder where to extract to
         :param str output_folder: name of the output folder where the images are saved to
+        :param str mode: 'single_pass' decodes every video once and extracts all of its frames within this pass,
+            'seek' seeks to the keyframe preceding each frame and only decodes from there,
+            'auto' picks between both of them per video based on the frame density (see plan_extraction),
+            'per_frame' runs one ffmpeg process per frame which decodes the video from the start every time
+        :param dedup_radius: if given, frames whose perceptual hash differs in at most this many bits from any image
+            of the database (or any previously accepted frame) are rejected. The frames are then decoded within a
+            single pass and the mode is ignored, see extract_frames_unique
         """
+    if mode not in EXTRACTION_MODES:
+        raise ValueError(f"mode needs to be one of {EXTRACTION_MODES} but is {mode}")
+    database = SQLiteDatabase(os.path.join(base_path, database_name))
+    database.create_images_table()
+    index = None
+    if dedup_radius is not None:
+        # images extracted without deduplication are hashed once, so the index covers the whole database
+        hash_images(database, base_path)
+        index = build_hash_index(database)
     for video_name, frames in frame_dict.items():
         # sort the video list based on the frame number
-        # TODO: include a database entry and saving
-        frame_list = sorted(frames)
+        frame_list = sorted(set(frames))
         # check for filetype
         if os.path.splitext(video_name)[-1] == ".mp4":
             video_name_without_filetype = os.path.splitext(video_name)[0]
@@ -53,45 +82,265 @@ def extract_frames(frame_dict: dict,
         # combine to relative path
         video_name = os.path.join("converted", video_name)
         original_path = os.path.join(base_path, video_name)
-        database = SQLiteDatabase(os.path.join(base_path, database_name))
-        database.create_images_table()
-        for idx, frame in enumerate(frame_list):
-            num = database.get_num_entries_specific(table_name="images",
-                                                    column_name="video_path",
-                                                    entry_name=video_name)
-            filename = os.path.join(output_folder, f"{video_name_without_filetype}_{num + 1:04d}.png")
-
-            if os.path.isfile(original_path):
-                # TODO: extract one frame before and after current one?
-                if database.add_image(video_name, filename, frame):
-                    out, err = (ffmpeg.input(original_path).filter_('select', 'gte(n,{})'.format(frame))
-                                .output(os.path.join(base_path, filename), vframes=1, )
-                                .run(capture_stdout=True, quiet=True))
-                    print(f"Processed Image {idx + 1}/{len(frame_list)}")
+        if not os.path.isfile(original_path):
+            raise ValueError(f"{original_path} is not a valid file. Check paths and video name")
+
+        if index is not None:
+            num_images = extract_frames_unique(database, base_path, video_name, video_name_without_filetype,
+                                               output_folder, frame_list, index, dedup_radius)
+            print(f"Processed {num_images} Images of {video_name} (unique)")
+            continue
+
+        if mode == "per_frame":
+            _extract_per_frame(database, base_path, video_name, video_name_without_filetype, output_folder,
+                               frame_list)
+            continue
+
+        images = _register_images(database, video_name, video_name_without_filetype, output_folder, frame_list)
+        if not images:
+            continue
+        images = [(frame, os.path.join(base_path, filename)) for frame, filename in images]
+        video_mode = mode
+        if mode in ["auto", "seek"]:
+            fps, num_frames, keyframes = get_keyframe_index(database, base_path, video_name)
+            if mode == "auto":
+                video_mode = plan_extraction([frame for frame, _ in images], keyframes)
+        if video_mode == "seek":
+            extract_frames_seek(original_path, images, fps, keyframes)
+        else:
+            extract_frames_single_pass(original_path, images)
+        print(f"Processed {len(images)} Images of {video_name} ({video_mode})")
+
+
+def _register_images(database: SQLiteDatabase, video_name: str, video_name_without_filetype: str,
+                     output_folder: str, frame_list: List[int]) -> List[Tuple[int, str]]:
+    """ Adds all frames which are not yet part of the database to the images table in one transaction. The images
+    are numbered consecutively after the images already extracted from the video
+
+        :returns: List of (frame number, relative image path) of all newly added images
+    """
+    existing_frames = _get_existing_frames(database, video_name)
+    num = len(existing_frames)
+    images = []
+    for frame in frame_list:
+        if frame in existing_frames:
+            continue
+        num += 1
+        images.append((frame, os.path.join(output_folder, f"{video_name_without_filetype}_{num:04d}.png")))
+    conflicts = database.add_images_bulk([(video_name, filename, frame) for frame, filename in images])
+    for _idx, err in conflicts:
+        print(f"Frame {images[_idx][0]} of {video_name} skipped: {err}")
+    failed = {_idx for _idx, _ in conflicts}
+    return [_image for _idx, _image in enumerate(images) if _idx not in failed]
+
+
+def _get_existing_frames(database: SQLiteDatabase, video_name: str) -> set:
+    """ Returns the frame numbers of all images already extracted from the video """
+    existing = database.get_entries_specific("images", "video_path", video_name) or []
+    if existing and not isinstance(existing[0], list):
+        existing = [existing]
+    return {_row[3] for _row in existing}
+
+
+def extract_frames_unique(database: SQLiteDatabase, base_path: str, video_name: str,
+                          video_name_without_filetype: str, output_folder: str, frame_list: List[int],
+                          index: BKTree, radius: int) -> int:
+    """ Decodes all new frames within one pass and rejects every frame whose perceptual hash is within the Hamming
+    radius of an image in the index. Accepted frames are written as images, added to the database together with
+    their hash and added to the index, so near-duplicates among the frames themselves are rejected as well
+
+        :param index: BK-tree over the hashes of all images of the database, see dedup.build_hash_index
+        :param int radius: maximum number of differing bits of a near-duplicate
+        :returns: number of extracted images
+    """
+    existing_frames = _get_existing_frames(database, video_name)
+    frame_list = [frame for frame in frame_list if frame not in existing_frames]
+    if not frame_list:
+        return 0
+    os.makedirs(os.path.join(base_path, output_folder), exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=os.path.join(base_path, output_folder)) as tmp_dir:
+        accepted = []
+        for frame, image in iter_video_frames(database, base_path, video_name, frames=frame_list):
+            _hash = phash(image)
+            found = index.query(_hash, radius)
+            if found:
+                distance, duplicate = found[0]
+                print(f"Frame {frame} of {video_name} rejected as near-duplicate of {duplicate} ({distance} bits)")
+                continue
+            index.add(_hash, f"{video_name}:{frame}")
+            cv2.imwrite(os.path.join(tmp_dir, f"{frame:06d}.png"), cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+            accepted.append((frame, _hash))
+
+        images = dict(_register_images(database, video_name, video_name_without_filetype, output_folder,
+                                       [frame for frame, _ in accepted]))
+        for frame, filename in images.items():
+            shutil.move(os.path.join(tmp_dir, f"{frame:06d}.png"), os.path.join(base_path, filename))
+    database.set_image_hashes([(images[frame], _hash) for frame, _hash in accepted if frame in images])
+    return len(images)
+
+
+def extract_frames_single_pass(video_path: str, frames: List[Tuple[int, str]]):
+    """ Extracts all frames within one single decoding pass of the video. One select filter lists every frame,
+    the selected frames are written in ascending order and renamed to their final paths afterwards
+
+        :param str video_path: absolute path of the video
+        :param frames: List of (frame number, absolute output path of the image)
+        """
+    frames = sorted(frames)
+    select = "+".join(f"eq(n,{frame})" for frame, _ in frames)
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(frames[0][1])) as tmp_dir:
+        # vframes stops the decoding after the last requested frame instead of the end of the video
+        (ffmpeg.input(video_path).filter_('select', select)
+         .output(os.path.join(tmp_dir, "%06d.png"), vsync=0, vframes=len(frames))
+         .run(capture_stdout=True, quiet=True))
+        for _idx, (frame, filename) in enumerate(frames):
+            tmp_file = os.path.join(tmp_dir, f"{_idx + 1:06d}.png")
+            if os.path.isfile(tmp_file):
+                shutil.move(tmp_file, filename)
             else:
-                raise ValueError(f"{original_path} is not a valid file. Check paths and video name")
-            four = 4
+                print(f"Frame {frame} is not part of {video_path}")
+
+
+def probe_keyframes(video_path: str) -> Tuple[float, int, List[Tuple[int, float]]]:
+    """ Reads the keyframe positions of a video from its packets without decoding it
+
+        :param str video_path: absolute path of the video
+        :returns: fps, number of frames and a List of (frame number, presentation time in s) of all keyframes
+        """
+    meta = probe_video(video_path)
+    return meta.fps, meta.num_frames, meta.keyframes
+
+
+def get_keyframe_index(database: SQLiteDatabase, base_path: str,
+                       video_name: str) -> Tuple[float, int, List[Tuple[int, float]]]:
+    """ Returns the keyframe index of a video from the video_meta cache and probes it only if it is not cached yet
+    or the file has changed
+
+        :param database: database with the video_meta tables
+        :param str base_path: parent directory of the database
+        :param str video_name: relative path of the converted video
+        :returns: fps, number of frames and a List of (frame number, presentation time in s) of all keyframes
+        """
+    meta = get_video_meta(database, base_path, video_name)
+    return meta.fps, meta.num_frames, meta.keyframes
+
+
+def plan_extraction(frames: List[int], keyframes: List[Tuple[int, float]]) -> str:
+    """ Decides whether a set of frames is extracted faster by seeking or by a single pass. A single pass decodes
+    everything up to the last frame, seeking decodes from the preceding keyframe of every frame but pays the
+    overhead of one ffmpeg process per frame
+
+        :param frames: frame numbers to extract
+        :param keyframes: List of (frame number, presentation time in s) of all keyframes
+        :returns: 'seek' or 'single_pass'
+        """
+    if not keyframes:
+        return "single_pass"
+    keyframe_nums = [frame for frame, _ in keyframes]
+    single_pass_cost = max(frames) + 1
+    seek_cost = sum(frame - keyframe_nums[max(bisect_right(keyframe_nums, frame) - 1, 0)] + 1 + SEEK_OVERHEAD_FRAMES
+                    for frame in frames)
+    return "seek" if seek_cost < single_pass_cost else "single_pass"
+
+
+def extract_frames_seek(video_path: str, frames: List[Tuple[int, str]], fps: float,
+                        keyframes: List[Tuple[int, float]]):
+    """ Extracts every frame by an input-side seek to its preceding keyframe and decoding only up to the frame.
+    The presentation time of the extracted frame is checked against the expected one of the frame number and the
+    frame is extracted with a single pass instead if they do not match or if the seek failed
+
+        :param str video_path: absolute path of the video
+        :param frames: List of (frame number, absolute output path of the image)
+        :param float fps: frames per second of the video
+        :param keyframes: List of (frame number, presentation time in s) of all keyframes. Without any keyframe,
+            the frames are extracted with a single pass
+        """
+    if not keyframes:
+        print(f"No keyframes known for {video_path}, extracting its frames with a single pass")
+        extract_frames_single_pass(video_path, frames)
+        return
+    keyframe_nums = [frame for frame, _ in keyframes]
+    inaccurate, failed = [], []
+    for frame, filename in frames:
+        keyframe, keyframe_pts = keyframes[max(bisect_right(keyframe_nums, frame) - 1, 0)]
+        try:
+            _, err = (ffmpeg.input(video_path, ss=keyframe_pts, noaccurate_seek=None)
+                      .filter_('select', f"eq(n,{frame - keyframe})")
+                      .filter_('showinfo')
+                      .output(filename, vframes=1, vsync=0, copyts=None)
+                      .overwrite_output()
+                      .run(capture_stdout=True, capture_stderr=True))
+        except ffmpeg.Error:
+            failed.append((frame, filename))
+            continue
+        pts_time = re.search(r"pts_time:\s*([-\d.]+)", err.decode(errors='ignore'))
+        expected_pts = keyframe_pts + (frame - keyframe) / fps
+        if pts_time is None or abs(float(pts_time.group(1)) - expected_pts) >= 0.5 / fps:
+            inaccurate.append((frame, filename))
+    if inaccurate or failed:
+        print(f"{len(inaccurate)} frames of {video_path} were not frame accurate and seeking to {len(failed)} frames "
+              f"failed, they are extracted again")
+        extract_frames_single_pass(video_path, inaccurate + failed)
+
+
+def _extract_per_frame(database: SQLiteDatabase, base_path: str, video_name: str, video_name_without_filetype: str,
+                       output_folder: str, frame_list: List[int]):
+    """ Previous extraction with one ffmpeg process per frame """
+    original_path = os.path.join(base_path, video_name)
+    for idx, frame in enumerate(frame_list):
+        num = database.get_num_entries_specific(table_name="images",
+                                                column_name="video_path",
+                                                entry_name=video_name)
+        filename = os.path.join(output_folder, f"{video_name_without_filetype}_{num + 1:04d}.png")
+        # TODO: extract one frame before and after current one?
+        if database.add_image(video_name, filename, frame):
+            out, err = (ffmpeg.input(original_path).filter_('select', 'gte(n,{})'.format(frame))
+                        .output(os.path.join(base_path, filename), vframes=1, )
+                        .run(capture_stdout=True, quiet=True))
+            print(f"Processed Image {idx + 1}/{len(frame_list)}")
+
+
+def get_frame_of_video(database: SQLiteDatabase,
+                       base_path: str,
+                       video_name: str,
+                       h: int,
+                       m: int,
+                       s: int,
+                       ms: int,
+                       first_frame: int = 80) -> int:
+    """ Convert the timestamp to the respective frame number using the actual fps of the video
+
+        :param database: database with the video_meta tables
+        :param str base_path: parent directory of the database
+        :param str video_name: relative path of the video
+        :param int h: hours
+        :param int m: minutes
+        :param int s: seconds
+        :param int ms: milliseconds
+        :param int first_frame: first frame ms of avidemux.
+        :returns: frame number as int
+        """
+    return get_frame(get_video_meta(database, base_path, video_name).fps, h, m, s, ms, first_frame)
 
 
 def add_duration_to_sql(base_path: str = "/home/nico/isys/data",
-                        database_name: str = "database.db"):
-    db = SQLiteDatabase(os.path.join(base_path, database_name))
+                        database_name: str = "database.db",
+                        workers: Optional[int] = None):
+    """ Probes all converted videos concurrently and stores their duration in ms in the videos table
 
-    for video in os.listdir(os.path.join(base_path, "converted")):
-        duration = get_duration(os.path.join(base_path, "converted", video)) * 1000.0
-        db.update_entry('videos', 'dest', "converted/" + str(video), 'duration', duration)
+        :param str base_path: parent directory of the database
+        :param str database_name: name of the database
+        :param workers: number of concurrent probes, defaults to the number of cores
+        """
+    db = SQLiteDatabase(os.path.join(base_path, database_name))
+    videos = ["converted/" + str(video) for video in sorted(os.listdir(os.path.join(base_path, "converted")))]
+    for video, meta in probe_videos(db, base_path, videos, workers).items():
+        db.update_entry('videos', 'conv_path', video, 'duration', meta.duration * 1000.0)
 
 
 def get_duration(file):
-    """Get the duration of a video using ffprobe."""
-    cmd = 'ffprobe -i {} -show_entries format=duration -v quiet -of csv="p=0"'.format(file)
-    output = subprocess.check_output(
-        cmd,
-        shell=True,  # Let this run in the shell
-        stderr=subprocess.STDOUT
-    )
-    # return round(float(output))  # ugly, but rounds your seconds up or down
-    return float(output)
+    """Get the duration of a video in s using ffprobe."""
+    return probe_video(file).duration
 
 
 frame_dictionary = \
@@ -561,5 +810,6 @@ frame_dictionary = \
                           ],
      }
 
-extract_frames(frame_dictionary)
+if __name__ == "__main__":
+    extract_frames(frame_dictionary)
 